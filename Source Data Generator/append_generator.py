@@ -0,0 +1,197 @@
+import datetime
+import json
+import os
+import numpy as np
+from catalog import get_catalog
+from common import bulk_insert_into, connect_to_sql_server
+from columnar_generator import get_rng, randint, count_rows, generate_daily_visit_columns, \
+    generate_treatment_columns, generate_medication_columns, generate_billing_columns
+from schema import to_date
+
+# Adds the next days of visits to a source database that is already filled instead of generating
+# everything again, so the routine (not first load) procedures of the etl can be run and measured.
+# The last ids, the last visit date, the doctors and the patients are read from source.Health or from
+# the manifest that every run writes next to the script. Some patients get a new phone and some doctors
+# a new specialization, these are the changes that the slowly changing dimensions keep the history of.
+# Only the new rows and the changes are loaded.
+
+MANIFEST_FILE = ".source_manifest.json"
+APPENDED_TABLES = ("Visit", "Treatment", "Medication", "Billing")
+
+
+def read_state_from_server(cursor):
+    max_ids = {}
+
+    for table in APPENDED_TABLES:
+        cursor.execute(f"select max({table.lower()}_id) from source.Health.{table}")
+        max_ids[table] = cursor.fetchone()[0] or 0
+
+    cursor.execute("select max(visit_date), count(*), datediff(day, min(visit_date), max(visit_date)) + 1 "
+                   "from source.Health.Visit")
+    max_visit_date, visit_count, days = cursor.fetchone()
+
+    if max_visit_date is None:
+        raise ValueError("source.Health.Visit is empty, append only works on a filled source database")
+
+    cursor.execute("select doctor_id, department_id, specialization from source.Health.Doctor")
+    doctors = [list(row) for row in cursor.fetchall()]
+
+    cursor.execute("select patient_id from source.Health.Patient")
+    patient_ids = [row[0] for row in cursor.fetchall()]
+
+    return {
+        "max_ids": max_ids,
+        "max_visit_date": str(max_visit_date.date() if isinstance(max_visit_date, datetime.datetime)
+                              else to_date(max_visit_date)),
+        "visits_per_day": round(visit_count / days) if days else 0,
+        "doctors": doctors,
+        "patient_ids": patient_ids,
+    }
+
+
+# State of a full run of data_generator.py, tables is a dict of the generated tables (dicts or columns)
+def get_generated_state(doctors: list[dict], patients: list[dict], tables: dict):
+    visits = tables["Visit"]
+
+    if isinstance(visits, dict):
+        dates = visits["visit_date"]
+        first_date, last_date = dates.min().astype(datetime.date), dates.max().astype(datetime.date)
+    else:
+        dates = [to_date(visit["visit_date"]) for visit in visits]
+        first_date, last_date = min(dates), max(dates)
+
+    return {
+        "max_ids": {table: count_rows(tables[table]) for table in APPENDED_TABLES},
+        "max_visit_date": str(last_date),
+        "visits_per_day": round(count_rows(visits) / ((last_date - first_date).days + 1)),
+        # generate_doctors keeps the specialization under the specializations key
+        "doctors": [[doctor["doctor_id"], doctor["department_id"], doctor["specializations"]] for doctor in doctors],
+        "patient_ids": [patient["patient_id"] for patient in patients],
+    }
+
+
+def read_manifest(path=MANIFEST_FILE):
+    if not os.path.exists(path):
+        return None
+
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def write_manifest(state: dict, path=MANIFEST_FILE):
+    with open(path, 'w') as file:
+        json.dump(state, file)
+
+
+def remove_manifest(path=MANIFEST_FILE):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def generate_phones(rng, size: int):
+    # zfill fails on an empty array, a small database can have no phone changes
+    if size == 0:
+        return np.array([], dtype=object)
+
+    return np.char.add('9', np.char.zfill(randint(rng, 0, 999999999, size).astype(str), 9)).astype(object)
+
+
+# rate of the patients get a new phone and rate of the doctors get another specialization of their department,
+# the changes are (patient_id, phone) and (doctor_id, specialization)
+def generate_changes(state: dict, phone_change_rate: float, specialization_change_rate: float, rng=None):
+    rng = get_rng(rng)
+
+    patient_ids = np.array(state["patient_ids"])
+    changed_patients = patient_ids[rng.random(len(patient_ids)) < phone_change_rate]
+    phones = generate_phones(rng, len(changed_patients))
+
+    specializations = get_catalog()["specializations"]
+    doctor_changes = []
+
+    for doctor_id, department_id, specialization in state["doctors"]:
+        if rng.random() < specialization_change_rate:
+            # generate_doctors only uses the first 5 specializations of each department
+            others = [item for item in specializations[department_id - 1][:5] if item != specialization]
+            doctor_changes.append((doctor_id, others[int(rng.integers(len(others)))]))
+
+    return list(zip(changed_patients.tolist(), phones.tolist())), doctor_changes
+
+
+# The new rows of the days after the last visit date, ids continue from the last ids
+def generate_days(state: dict, departments: list[dict], days: int, visits_per_day=None, rng=None):
+    rng = get_rng(rng)
+
+    max_ids = state["max_ids"]
+    start_date = datetime.date.fromisoformat(state["max_visit_date"]) + datetime.timedelta(days=1)
+    doctors = [{"doctor_id": doctor_id, "department_id": department_id}
+               for doctor_id, department_id, _ in state["doctors"]]
+
+    visits = generate_daily_visit_columns(doctors, state["patient_ids"], start_date, days,
+                                          visits_per_day or state["visits_per_day"], rng, max_ids["Visit"] + 1)
+    treatments = generate_treatment_columns(visits, departments, rng, max_ids["Treatment"] + 1)
+    medications = generate_medication_columns(treatments, visits, rng, max_ids["Medication"] + 1)
+    billings = generate_billing_columns(visits, treatments, medications, rng, max_ids["Billing"] + 1)
+
+    return [("Visit", visits), ("Treatment", treatments), ("Medication", medications), ("Billing", billings)]
+
+
+# The state after the days and changes are loaded
+def advance_state(state: dict, tables: list, doctor_changes: list):
+    state = dict(state, max_ids=dict(state["max_ids"]))
+
+    for table, records in tables:
+        if count_rows(records) != 0:
+            state["max_ids"][table] = int(records[f"{table.lower()}_id"][-1])
+
+    visit_dates = dict(tables)["Visit"]["visit_date"]
+
+    if len(visit_dates) != 0:
+        state["max_visit_date"] = str(visit_dates.max().astype(datetime.date))
+
+    specializations = dict(doctor_changes)
+    state["doctors"] = [[doctor_id, department_id, specializations.get(doctor_id, specialization)]
+                        for doctor_id, department_id, specialization in state["doctors"]]
+
+    return state
+
+
+def apply_changes(cursor, patient_changes: list, doctor_changes: list, batch_size=10000):
+    for sql, changes in (("update source.Health.Patient set phone = ? where patient_id = ?", patient_changes),
+                         ("update source.Health.Doctor set specialization = ? where doctor_id = ?", doctor_changes)):
+        for start in range(0, len(changes), batch_size):
+            cursor.executemany(sql, [(value, key) for key, value in changes[start:start + batch_size]])
+            cursor.commit()
+
+    print(f"{len(patient_changes)} patient phones and {len(doctor_changes)} doctor specializations changed")
+
+
+# from_manifest reads the state from the manifest of the last run when it exists, the server is always
+# right but reading all the patients of a big database takes time
+def append_to_source(departments: list[dict], days: int, from_manifest=True, phone_change_rate=0.01,
+                     specialization_change_rate=0.05, visits_per_day=None, rng=None):
+    rng = get_rng(rng)
+    cursor = connect_to_sql_server()
+    # The phone and specialization updates are sent a batch at a time like the inserts of bulk_insert_into
+    cursor.fast_executemany = True
+
+    state = read_manifest() if from_manifest else None
+
+    if state is None:
+        state = read_state_from_server(cursor)
+
+    patient_changes, doctor_changes = generate_changes(state, phone_change_rate, specialization_change_rate, rng)
+    tables = generate_days(state, departments, days, visits_per_day, rng)
+
+    print(f"Appending {days} days after {state['max_visit_date']}: " +
+          ', '.join(f"{count_rows(records)} {table}" for table, records in tables))
+
+    # The manifest is removed before the first commit and only written again after everything is loaded,
+    # so the next run reads the state from the server when this one fails halfway
+    remove_manifest()
+
+    apply_changes(cursor, patient_changes, doctor_changes)
+    cursor.close()
+
+    bulk_insert_into(tables)
+
+    write_manifest(advance_state(state, tables, doctor_changes))
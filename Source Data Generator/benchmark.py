@@ -0,0 +1,204 @@
+import argparse
+import datetime
+import json
+import sys
+import time
+import tracemalloc
+from random import seed, getstate, setstate
+from common import insert_batches
+from columnar_generator import generate_visit_columns, generate_treatment_columns, generate_medication_columns, \
+    generate_billing_columns, count_rows
+from data_generator import get_departments, generate_doctors, generate_patients, generate_visits, \
+    generate_treatments, generate_medications, generate_billing
+from local_database import RecordingCursor, SqliteCursor
+from national_code import reset_national_codes
+from time_generator import time_generator, build_time_dimension
+
+# Runs every generator and the loader at a few numbers of visits and reports rows per second, wall time and
+# the peak memory (tracemalloc, in a separate run) of each stage as json. The loader inserts into a local
+# stand-in of sql server (look at local_database.py). With a baseline file, the run fails when a stage got
+# slower or used more memory than the threshold allows, so a change can be checked before it's merged.
+#
+#   python benchmark.py --scales 10k 100k --output result.json
+#   python benchmark.py --scales 10k 100k --baseline result.json --threshold 0.2
+
+# Number of visits of each scale, every patient has 100 visits
+SCALES = {"10k": 10000, "100k": 100000, "1m": 1000000}
+VISIT_PER_PATIENT = 100
+
+# Stages that take less time than this are too noisy to compare their speed
+MIN_SECONDS = 0.05
+
+
+# count turns the value of the function to its number of rows. tracemalloc makes the allocations of python code
+# several times slower, so the peak memory is traced in a first run and the time is measured in a second run
+# from the same random state, which gives the same value
+def measure(name: str, scale: str, function, count=count_rows):
+    state = getstate()
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    setstate(state)
+    started = time.perf_counter()
+
+    value = function()
+
+    seconds = time.perf_counter() - started
+
+    rows = count(value)
+    print(f"{name} ({scale}): {rows} rows in {seconds:.2f}s", file=sys.stderr)
+
+    return value, {
+        "stage": name,
+        "scale": scale,
+        "rows": rows,
+        "seconds": round(seconds, 4),
+        "rows_per_second": round(rows / seconds, 1) if seconds > 0 else None,
+        "peak_memory_mb": round(peak / 1024 / 1024, 2),
+    }
+
+
+def load(tables: list, target: str):
+    cursor = SqliteCursor() if target == "sqlite" else RecordingCursor()
+    rows = sum(insert_batches(cursor, table, records, quiet=True) for table, records in tables)
+    cursor.close()
+
+    return rows
+
+
+def run_scale(scale: str, departments, doctors, patients, generators: list, target: str):
+    results = []
+    patients = patients[:SCALES[scale] // VISIT_PER_PATIENT]
+
+    def stage(name, function, count=count_rows):
+        value, result = measure(name, scale, function, count)
+        results.append(result)
+
+        return value
+
+    # compact is the dict generators with the tables in a RecordTable
+    for generator, compact, suffix in (("dict", False, ""), ("compact", True, "_compact")):
+        if generator not in generators:
+            continue
+
+        visits = stage(f"generate_visits{suffix}", lambda: generate_visits(doctors, patients, VISIT_PER_PATIENT,
+                                                                            compact))
+        treatments = stage(f"generate_treatments{suffix}", lambda: generate_treatments(visits, departments, compact))
+        medications = stage(f"generate_medications{suffix}", lambda: generate_medications(treatments, visits,
+                                                                                           compact))
+        billings = stage(f"generate_billing{suffix}", lambda: generate_billing(visits, treatments, medications,
+                                                                               compact))
+
+        tables = [("Visit", visits), ("Treatment", treatments), ("Medication", medications), ("Billing", billings)]
+        stage(f"load_{generator}_{target}", lambda: load(tables, target), int)
+
+    if "columnar" in generators:
+        visits = stage("generate_visit_columns", lambda: generate_visit_columns(doctors, patients, VISIT_PER_PATIENT))
+        treatments = stage("generate_treatment_columns", lambda: generate_treatment_columns(visits, departments))
+        medications = stage("generate_medication_columns", lambda: generate_medication_columns(treatments, visits))
+        billings = stage("generate_billing_columns", lambda: generate_billing_columns(visits, treatments, medications))
+
+        tables = [("Visit", visits), ("Treatment", treatments), ("Medication", medications), ("Billing", billings)]
+        stage(f"load_columnar_{target}", lambda: load(tables, target), int)
+
+    return results
+
+
+def run_time_dimension(start_year: int, end_year: int):
+    _, legacy = measure("time_generator", "time", lambda: time_generator(start_year, end_year))
+    _, columnar = measure("build_time_dimension", "time", lambda: build_time_dimension(
+        datetime.date(start_year, 1, 1), datetime.date(end_year, 12, 31)))
+
+    return [legacy, columnar]
+
+
+def run(scales: list, generators: list, target: str, random_seed=0):
+    seed(random_seed)
+    reset_national_codes(random_seed)
+
+    departments = get_departments()
+    doctors = generate_doctors(departments)
+
+    # generate_patients makes 10,000 patients in each round
+    patients = generate_patients(rounds=-(-max(SCALES[scale] for scale in scales) // VISIT_PER_PATIENT // 10000))
+
+    results = []
+
+    for scale in scales:
+        seed(random_seed)
+        results.extend(run_scale(scale, departments, doctors, patients, generators, target))
+
+    results.extend(run_time_dimension(2020, 2050))
+
+    return {
+        "created_at": datetime.datetime.now().isoformat(timespec='seconds'),
+        "python": sys.version.split()[0],
+        "target": target,
+        "results": results,
+    }
+
+
+# A stage regresses when its rows per second dropped or its peak memory grew by more than the threshold,
+# stages that are not in the baseline are skipped and very short stages only have their memory compared,
+# a stage that took no measurable time has no rows per second
+def compare(report: dict, baseline: dict, threshold: float):
+    baseline_results = {(result["stage"], result["scale"]): result for result in baseline["results"]}
+    regressions = []
+
+    for result in report["results"]:
+        old = baseline_results.get((result["stage"], result["scale"]))
+
+        if old is None:
+            continue
+
+        if max(old["seconds"], result["seconds"]) >= MIN_SECONDS and \
+                None not in (result["rows_per_second"], old["rows_per_second"]) and \
+                result["rows_per_second"] < old["rows_per_second"] * (1 - threshold):
+            regressions.append(f'{result["stage"]} ({result["scale"]}): {result["rows_per_second"]} rows/s, '
+                               f'was {old["rows_per_second"]} rows/s')
+
+        if result["peak_memory_mb"] > old["peak_memory_mb"] * (1 + threshold):
+            regressions.append(f'{result["stage"]} ({result["scale"]}): {result["peak_memory_mb"]} MB, '
+                               f'was {old["peak_memory_mb"]} MB')
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the generators and the loader")
+    parser.add_argument("--scales", nargs="+", choices=SCALES, default=["10k", "100k"])
+    parser.add_argument("--generators", nargs="+", choices=["dict", "compact", "columnar"],
+                        default=["dict", "compact", "columnar"])
+    parser.add_argument("--target", choices=["sqlite", "recording"], default="sqlite",
+                        help="the local stand-in of sql server that the loader inserts into")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="json file of the result, printed when it's not given")
+    parser.add_argument("--baseline", help="json file of an earlier result to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="allowed slowdown or memory growth of each stage, 0.2 is 20%%")
+    args = parser.parse_args()
+
+    report = run(args.scales, args.generators, args.target, args.seed)
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as file:
+            regressions = compare(report, json.load(file), args.threshold)
+
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+
+        if len(regressions) != 0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+import numpy as np
+
+# Treatment and medication costs are summed for each visit_id before billing, a visit can have
+# any number of treatments and medications (including none).
+# Lists in memory are aggregated in a dict and numpy columns are summed with bincount, the streamed chunks
+# of stream_generator.py, parallel_generator.py and scale_factor.py are columns, so each chunk is summed
+# with bincount on its own
+
+
+def sum_by_visit(rows, cost_column: str):
+    costs = {}
+
+    for row in rows:
+        costs[row["visit_id"]] = costs.get(row["visit_id"], 0) + row[cost_column]
+
+    return costs
+
+
+# Yields (visit, treatment cost, medication cost)
+def join_costs(visits, treatments, medications):
+    treatment_costs = sum_by_visit(treatments, "treatment_cost")
+    medication_costs = sum_by_visit(medications, "medication_cost")
+
+    for visit in visits:
+        yield visit, treatment_costs.get(visit["visit_id"], 0), medication_costs.get(visit["visit_id"], 0)
+
+
+# Same as sum_by_visit for numpy columns, the visits of the columns are continuous from first_visit_id
+def sum_columns_by_visit(visit_ids, costs, first_visit_id: int, size: int):
+    return np.bincount(visit_ids - first_visit_id, weights=costs, minlength=size)
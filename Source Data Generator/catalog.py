@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import pickle
+import numpy as np
+
+# All the predefined json data is loaded here once, checked and indexed, so the generators don't
+# open the json files or search lists in their loops. The result is pickled next to the json files
+# and is used as long as the json files are not changed.
+
+JSON_FILES = ("departments.json", "specializations.json", "doctors_names.json", "patient_names.json",
+              "treatments.json", "medications.json")
+CACHE_FILE = ".catalog.pickle"
+
+# Cost effect of each department in the order of departments.json
+DEPARTMENTS_COST_EFFECT = [2, 7, 4, 3, 1, 6, 5]
+
+catalog = None
+
+
+def load_json(file_name: str):
+    with open(file_name, 'r') as file:
+        return json.load(file)
+
+
+# Flattens the treatments of all departments into arrays, offsets[department] is the position
+# of the first treatment of the department
+def flatten_treatments(treatment_types, treatment_descriptions):
+    counts = np.array([len(descriptions) for descriptions in treatment_descriptions])
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    flat = [item for descriptions in treatment_descriptions for item in descriptions]
+
+    descriptions = np.array([description for description, _ in flat], dtype=object)
+    types = np.array([treatment_types[treatment_type][0] for _, treatment_type in flat], dtype=object)
+    effects = np.array([treatment_types[treatment_type][1] for _, treatment_type in flat])
+
+    return counts, offsets, descriptions, types, effects
+
+
+# Same as flatten_treatments for the medication names of each treatment,
+# a treatment without medication has a count of 0
+def flatten_medications(medication_costs: dict, medication_names):
+    lists = [names or [] for department in medication_names for names in department]
+    counts = np.array([len(names) for names in lists])
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    names = np.array([name for names in lists for name in names], dtype=object)
+    effects = np.array([medication_costs[name] for name in names])
+
+    return counts, offsets, names, effects
+
+
+def validate(departments, specializations, treatment_descriptions, medication_costs, medication_names):
+    if len(DEPARTMENTS_COST_EFFECT) != len(departments):
+        raise ValueError("Each department needs a cost effect in DEPARTMENTS_COST_EFFECT")
+
+    # generate_doctors picks one of the first 5 specializations of the department
+    if len(specializations) != len(departments) or any(len(items) < 5 for items in specializations):
+        raise ValueError("specializations.json needs at least 5 specializations for each department")
+
+    if len(treatment_descriptions) != len(departments):
+        raise ValueError("treatments.json needs a list of treatments for each department")
+
+    # The medications of a treatment are found with the index of the treatment
+    if [len(items) for items in medication_names] != [len(items) for items in treatment_descriptions]:
+        raise ValueError("medications.json should have the same shape as the treatments in treatments.json")
+
+    for department in medication_names:
+        for names in department:
+            for name in names or []:
+                if name not in medication_costs:
+                    raise ValueError(f"Medication {name} has no cost in medications.json")
+
+
+def build_catalog():
+    departments = load_json("departments.json")
+    specializations = load_json("specializations.json")
+    doctor_firstnames_gender, doctor_lastnames = load_json("doctors_names.json").values()
+    patient_firstnames_gender, patient_lastnames = load_json("patient_names.json").values()
+    treatment_types, treatment_descriptions = load_json("treatments.json").values()
+    medications_cost, medication_names = load_json("medications.json").values()
+
+    medication_costs = dict(medications_cost)
+
+    validate(departments, specializations, treatment_descriptions, medication_costs, medication_names)
+
+    # description -> index in the department, the first one is used if a description is repeated
+    treatment_indexes = []
+
+    for descriptions in treatment_descriptions:
+        indexes = {}
+
+        for i, (description, _) in enumerate(descriptions):
+            indexes.setdefault(description, i)
+
+        treatment_indexes.append(indexes)
+
+    flat_treatments = flatten_treatments(treatment_types, treatment_descriptions)
+
+    # (department index, description) -> position in the flat treatments
+    treatment_positions = {(department_index, description): flat_treatments[1][department_index] + i
+                           for department_index, indexes in enumerate(treatment_indexes)
+                           for description, i in indexes.items()}
+
+    return {
+        "departments": departments,
+        "departments_cost_effect": DEPARTMENTS_COST_EFFECT,
+        "specializations": specializations,
+        "doctor_names": (doctor_firstnames_gender, doctor_lastnames),
+        "patient_names": (patient_firstnames_gender, patient_lastnames),
+        "treatment_types": treatment_types,
+        "treatment_descriptions": treatment_descriptions,
+        "treatment_indexes": treatment_indexes,
+        "medication_costs": medication_costs,
+        "medication_names": medication_names,
+        # arrays for the columnar generator
+        "flat_treatments": flat_treatments,
+        "treatment_positions": treatment_positions,
+        "flat_medications": flatten_medications(medication_costs, medication_names),
+    }
+
+
+# Size and modification time of the json files and a hash of this file, the cache is rebuilt when any of the
+# json files changes or build_catalog makes another structure
+def get_cache_key():
+    with open(__file__, 'rb') as file:
+        code_hash = hashlib.sha256(file.read()).hexdigest()
+
+    return [(file_name, os.stat(file_name).st_size, os.stat(file_name).st_mtime_ns) for file_name in JSON_FILES] + \
+        [code_hash]
+
+
+def get_catalog():
+    global catalog
+
+    if catalog is not None:
+        return catalog
+
+    key = get_cache_key()
+
+    if os.path.exists(CACHE_FILE):
+        with open(CACHE_FILE, 'rb') as file:
+            cached_key, cached_catalog = pickle.load(file)
+
+        if cached_key == key:
+            catalog = cached_catalog
+            return catalog
+
+    catalog = build_catalog()
+
+    with open(CACHE_FILE, 'wb') as file:
+        pickle.dump((key, catalog), file)
+
+    return catalog
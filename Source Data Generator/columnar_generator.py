@@ -0,0 +1,231 @@
+import random
+import numpy as np
+from billing_join import sum_columns_by_visit
+from catalog import get_catalog
+
+# This is the same generator as data_generator.py but each table is made of numpy columns instead of
+# a list of dicts, every random number of a column is drawn at once, so it's many times faster for
+# millions of visits. The distributions are the same as the dict generators.
+# Each table is a dict of column name to array in the column order of the schema module,
+# bulk_insert_into accepts it directly.
+# first_id of each generator is the id of the first row, so a table can be generated in several parts
+
+lorem_ipsum = ("Lorem ipsum dolor sit amet, consectetur adipiscing elit, "
+               "sed do eiusmod tempor incididunt ut labore et dolore magna aliqua. "
+               "Ut enim ad minim veniam, quis nostrud exercitation ullamco laboris "
+               "nisi ut aliquip ex ea commodo consequat. Duis aute irure dolor in "
+               "reprehenderit in voluptate velit esse cillum dolore eu fugiat nulla pariatur. "
+               "Excepteur sint occaecat cupidatat non proident, sunt in culpa qui officia "
+               "deserunt mollit anim id est laborum.")
+
+month_days = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+frequency_units = np.array(['minute', 'hour', 'day', 'week', 'month'], dtype=object)
+
+# Length of each frequency unit in minutes, month is 30 weeks same as calculate_medication_cost
+frequency_units_in_minute = np.array([1, 60, 24 * 60, 7 * 24 * 60, 30 * 7 * 24 * 60])
+
+
+# The generator is seeded from the random module, so random.seed fixes the columnar data too
+def get_rng(rng=None):
+    if rng is None:
+        return np.random.default_rng(random.getrandbits(64))
+
+    return rng
+
+
+# Draws a random int between low and high (both inclusive) for each item, low and high can be arrays
+def randint(rng, low, high, size):
+    return np.floor(rng.random(size) * (high - low + 1)).astype(np.int64) + low
+
+
+def get_random_dates(rng, start_year: int, end_year: int, size: int):
+    years = randint(rng, start_year, end_year, size)
+    months = randint(rng, 1, 12, size)
+    days = randint(rng, 1, month_days[months - 1], size)
+
+    dates = (years - 1970).astype('datetime64[Y]') + (months - 1).astype('timedelta64[M]')
+
+    return dates.astype('datetime64[D]') + (days - 1).astype('timedelta64[D]')
+
+
+# Works for both a dict of columns and a list of dict records
+def count_rows(table: dict | list):
+    if isinstance(table, dict):
+        return len(next(iter(table.values())))
+
+    return len(table)
+
+
+# patient_id is the patient of each visit and get_dates(size) draws the visit dates,
+# doctor_weights is the probability of each doctor, all doctors are equally likely when it's None
+def make_visit_columns(doctors: list[dict], patient_id, get_dates, rng, first_id: int, checkup_ratio=0.1,
+                       doctor_weights=None):
+    doctor_ids = np.array([doctor["doctor_id"] for doctor in doctors])
+    doctor_department_ids = np.array([doctor["department_id"] for doctor in doctors])
+
+    size = len(patient_id)
+
+    if doctor_weights is None:
+        doctor_indexes = randint(rng, 0, len(doctors) - 1, size)
+    else:
+        doctor_indexes = rng.choice(len(doctors), size, p=doctor_weights)
+
+    doctor_id = doctor_ids[doctor_indexes]
+    department_id = doctor_department_ids[doctor_indexes]
+
+    # 10% of the visits are checkup by default
+    is_checkup = rng.random(size) < checkup_ratio
+
+    # All possible diagnoses are sliced once and the column only points to them
+    diagnoses = np.array([lorem_ipsum[:length] for length in range(len(lorem_ipsum))], dtype=object)
+
+    departments_cost_effect = np.array(get_catalog()["departments_cost_effect"])
+    visit_cost = departments_cost_effect[department_id - 1] * doctor_id * 5000.0
+
+    return {
+        "visit_id": np.arange(first_id, first_id + size),
+        "patient_id": patient_id,
+        "doctor_id": doctor_id,
+        "visit_date": get_dates(size),
+        "diagnosis": diagnoses[randint(rng, 50, len(lorem_ipsum) - 1, size)],
+        # Checkup visits cost half
+        "visit_cost": np.where(is_checkup, visit_cost / 2, visit_cost),
+        "is_check_up": is_checkup.astype(np.int64),
+    }
+
+
+def generate_visit_columns(doctors: list[dict], patients: list[dict], visit_per_patient=100, rng=None, first_id=1):
+    rng = get_rng(rng)
+
+    patient_ids = np.array([patient["patient_id"] for patient in patients])
+
+    return make_visit_columns(doctors, np.repeat(patient_ids, visit_per_patient),
+                              lambda size: get_random_dates(rng, 2021, 2023, size), rng, first_id)
+
+
+# Visits of random patients on the days from start_date, visits_per_day visits for each day,
+# the visits are in the order of their dates
+def generate_daily_visit_columns(doctors: list[dict], patient_ids, start_date, days: int, visits_per_day: int,
+                                 rng=None, first_id=1):
+    rng = get_rng(rng)
+
+    size = days * visits_per_day
+    patient_id = np.asarray(patient_ids)[randint(rng, 0, len(patient_ids) - 1, size)]
+    dates = np.datetime64(start_date, 'D') + np.repeat(np.arange(days), visits_per_day).astype('timedelta64[D]')
+
+    return make_visit_columns(doctors, patient_id, lambda _: dates, rng, first_id)
+
+
+def calculate_treatment_costs(treatment_effect, department_effect, index_effect):
+    gdc = 5 * 2 * 7 * 3
+    unit = 1000000
+
+    normalized_treatment_effect = treatment_effect * (gdc / 10)
+    normalized_department_effect = department_effect * (gdc / 7)
+    normalized_index_effect = index_effect * (gdc / 15)
+
+    return np.round(((normalized_treatment_effect * 6 * unit) + (normalized_department_effect * 4 * unit) + (
+            normalized_index_effect * 1 * unit)) / gdc, 2)
+
+
+def generate_treatment_columns(visits: dict, departments: list[dict], rng=None, first_id=1):
+    rng = get_rng(rng)
+
+    counts, offsets, descriptions, types, effects = get_catalog()["flat_treatments"]
+    departments_cost_effect = np.array(get_catalog()["departments_cost_effect"])
+    department_ids = np.array([department["department_id"] for department in departments])
+
+    visit_id = visits["visit_id"][visits["is_check_up"] == 0]
+    size = len(visit_id)
+
+    department_index = randint(rng, 0, len(departments) - 1, size)
+    treatment_index = randint(rng, 0, counts[department_index] - 1, size)
+    flat_index = offsets[department_index] + treatment_index
+
+    return {
+        "treatment_id": np.arange(first_id, first_id + size),
+        "visit_id": visit_id,
+        "treatment_type": types[flat_index],
+        "treatment_description": descriptions[flat_index],
+        "treatment_cost": calculate_treatment_costs(effects[flat_index], departments_cost_effect[department_index],
+                                                    treatment_index),
+        "department_id": department_ids[department_index],
+    }
+
+
+def calculate_medication_costs(medication_effect, frequency, frequency_unit_index, duration):
+    cycles = (duration * 24 * 60) / (frequency * frequency_units_in_minute[frequency_unit_index])
+
+    return np.round(medication_effect * cycles * 10000, 2)
+
+
+def generate_medication_columns(treatments: dict, visits: dict, rng=None, first_id=1):
+    rng = get_rng(rng)
+
+    # The medications json has the same shape as the treatments json, so both are found with the same index
+    positions = get_catalog()["treatment_positions"]
+    counts, offsets, names, effects = get_catalog()["flat_medications"]
+
+    department_index = treatments["department_id"] - 1
+    treatment_position = np.array(
+        [positions[key] for key in zip(department_index.tolist(), treatments["treatment_description"].tolist())],
+        dtype=np.int64)
+
+    # Some treatments don't have any medication so no medication is generated
+    has_medication = counts[treatment_position] != 0
+    visit_id = treatments["visit_id"][has_medication]
+    treatment_position = treatment_position[has_medication]
+    size = len(visit_id)
+
+    medication_index = offsets[treatment_position] + randint(rng, 0, counts[treatment_position] - 1, size)
+
+    frequency_unit_index = randint(rng, 0, len(frequency_units) - 1, size)
+    is_minute = frequency_unit_index == 0
+
+    frequency = np.where(is_minute, randint(rng, 30, 480, size), randint(rng, 1, 12, size))
+    duration = np.where(is_minute, randint(rng, 1, 30, size), randint(rng, 1 + frequency, 30 * frequency, size))
+
+    # visit ids have no gap, so the visit of each medication is found by position
+    prescription_date = visits["visit_date"][visit_id - visits["visit_id"][0]]
+
+    return {
+        "medication_id": np.arange(first_id, first_id + size),
+        "visit_id": visit_id,
+        "medication_name": names[medication_index],
+        "dosage": randint(rng, 30, 1000, size),  # milli gram
+        "frequency": frequency,
+        "frequency_unit": frequency_units[frequency_unit_index],
+        "medication_cost": calculate_medication_costs(effects[medication_index], frequency, frequency_unit_index,
+                                                      duration),
+        "prescription_date": prescription_date,
+        "duration": duration,
+    }
+
+
+def generate_billing_columns(visits: dict, treatments: dict, medications: dict, rng=None, first_id=1):
+    rng = get_rng(rng)
+
+    size = count_rows(visits)
+    first_visit_id = visits["visit_id"][0]
+
+    insurance_coverage_percentage = randint(rng, 10, 30, size) / 100
+    tax_percentage = randint(rng, 15, 30, size) / 100
+
+    treatment_cost = sum_columns_by_visit(treatments["visit_id"], treatments["treatment_cost"], first_visit_id, size)
+    medication_cost = sum_columns_by_visit(medications["visit_id"], medications["medication_cost"], first_visit_id,
+                                           size)
+
+    total_amount_without_tax = visits["visit_cost"] + treatment_cost + medication_cost
+    tax_amount = tax_percentage * total_amount_without_tax
+    total_amount = total_amount_without_tax + tax_amount
+
+    insurance_coverage = total_amount_without_tax * insurance_coverage_percentage
+
+    return {
+        "billing_id": np.arange(first_id, first_id + size),
+        "visit_id": visits["visit_id"],
+        "total_amount": total_amount,
+        "paid_amount": total_amount - insurance_coverage,
+        "tax_amount": tax_amount,
+        "insurance_coverage": insurance_coverage,
+    }
@@ -1,5 +1,9 @@
 import pyodbc
 import re
+import time
+from itertools import islice
+from metrics import get_metrics, stage
+from schema import TABLES, parse_type, get_converters, to_rows
 
 
 def is_date(date_str):
@@ -17,8 +21,14 @@ def connect_to_sql_server():
         "TrustServerCertificate=yes;"
     )
 
+    recorder = get_metrics()
+    started = time.perf_counter()
+
     connection = pyodbc.connect(connection_string)
 
+    if recorder is not None:
+        recorder.add_connection(time.perf_counter() - started)
+
     return connection.cursor()
 
 
@@ -53,3 +63,85 @@ def produce_sql_and_insert_into(data: list[tuple[str, list[dict]]], database="so
         callback(cursor)
 
     cursor.close()
+
+
+# Each sql type is mapped to (pyodbc type, size, scale), so the values are bound
+# as parameters instead of being formatted into the sql string
+def get_input_sizes(table: str):
+    input_sizes = []
+
+    for _, sql_type in TABLES[table]:
+        name, size, scale = parse_type(sql_type)
+
+        if name == "nvarchar":
+            # size 0 is nvarchar(max), fast_executemany needs it to be bound this way
+            input_sizes.append((pyodbc.SQL_WVARCHAR, size, 0))
+        elif name == "date":
+            input_sizes.append((pyodbc.SQL_TYPE_DATE, 0, 0))
+        elif name == "datetime":
+            input_sizes.append((pyodbc.SQL_TYPE_TIMESTAMP, 0, 0))
+        elif name == "decimal":
+            # costs are floats in the generators, the server rounds them to the column scale
+            input_sizes.append((pyodbc.SQL_DOUBLE, 0, 0))
+        elif name == "bit":
+            input_sizes.append((pyodbc.SQL_BIT, 0, 0))
+        else:
+            input_sizes.append((pyodbc.SQL_INTEGER, 0, 0))
+
+    return input_sizes
+
+
+# table_name is used to insert into another table with the same columns as table, i.e. a staging table
+def insert_batches(cursor, table: str, records, database="source", schema="Health", batch_size=10000,
+                   quiet=False, table_name=None):
+    input_sizes = get_input_sizes(table)
+    placeholders = ', '.join('?' * len(input_sizes))
+    sql = f'insert into {database}.{schema}.{table_name or table} values ({placeholders})'
+
+    rows = to_rows(records, get_converters(table))
+    count = 0
+
+    # metrics are only read once, so the loop doesn't pay for them when they are disabled
+    recorder = get_metrics()
+
+    while True:
+        # The latency of a batch includes turning the records to rows
+        started = time.perf_counter()
+        batch = list(islice(rows, batch_size))
+
+        if len(batch) == 0:
+            break
+
+        cursor.setinputsizes(input_sizes)
+        cursor.executemany(sql, batch)
+        cursor.commit()
+
+        if recorder is not None:
+            recorder.add_batch(table, len(batch), time.perf_counter() - started)
+
+        count += len(batch)
+
+        if not quiet:
+            print(f"{table}: {count} rows inserted")
+
+    return count
+
+
+# Same as produce_sql_and_insert_into but every table is sent in batches of parameterized rows,
+# and there is only one commit per batch instead of one for each record.
+# records of each table can be dicts or tuples in the column order of the schema module,
+# or a dict of columns from the columnar generator
+def bulk_insert_into(data: list[tuple[str, list | dict]], database="source", schema="Health", callback=None,
+                     batch_size=10000, quiet=False):
+    cursor = connect_to_sql_server()
+    cursor.fast_executemany = True
+    print("Connected to Sql Server...")
+
+    for table, records in data:
+        with stage(f"insert_{table}") as current:
+            current.rows = insert_batches(cursor, table, records, database, schema, batch_size, quiet)
+
+    if callback is not None:
+        callback(cursor)
+
+    cursor.close()
@@ -1,6 +1,23 @@
-import json
-from random import randint, shuffle
-from common import produce_sql_and_insert_into
+import sys
+from random import randint, seed, shuffle
+import numpy as np
+from common import bulk_insert_into, connect_to_sql_server
+from file_sink import export_tables
+from append_generator import append_to_source, get_generated_state, write_manifest, remove_manifest
+from billing_join import join_costs
+from catalog import get_catalog
+from dataset_cache import get_dataset_key, read_dataset, write_dataset
+from columnar_generator import generate_visit_columns, generate_treatment_columns, generate_medication_columns, \
+    generate_billing_columns, count_rows
+from parallel_generator import generate_shards
+from parallel_loader import parallel_insert_into
+from metrics import enable_metrics, stage, write_report
+from pipeline import run_pipeline
+from record_store import RecordTable, Prefix
+from scale_factor import get_scale, get_patient_rounds, generate_scaled_chunks
+from stream_generator import generate_chunks, stream_tables
+from national_code import allocate_national_code, allocate_national_codes, reserve_existing_national_codes, \
+    reset_national_codes
 
 
 # Each table has its own generator function
@@ -21,26 +38,16 @@ def get_duplicates(names):
     return duplicates
 
 
-reserved_national_code = []
-
-
 # This function just put 10 random numbers together and don't check for uniqueness
 def generate_national_code():
     return str(randint(0, 9)) + str(randint(0, 9)) + str(randint(0, 9)) + str(randint(0, 9)) + str(randint(0, 9)) + str(
         randint(0, 9)) + str(randint(0, 9)) + str(randint(0, 9)) + str(randint(0, 9)) + str(randint(0, 9))
 
 
-# This function uses random national code but check weather It's reserved or not and tries as many times to pass
+# Unique national codes come from the national_code module which doesn't need to check the generated
+# codes, the old approach checked a list of all codes and generating a million patients never ended
 def generate_unique_national_code():
-    while True:
-        national_code = generate_national_code()
-
-        if national_code in reserved_national_code:
-            continue
-
-        reserved_national_code.append(national_code)
-
-        return national_code
+    return allocate_national_code()
 
 
 def get_random_date(start_year: int, end_year: int):
@@ -55,10 +62,9 @@ def get_random_date(start_year: int, end_year: int):
 
 
 def get_departments():
-    with open('departments.json', 'r') as file:
-        departments: list[str] = json.load(file)
+    departments: list[str] = get_catalog()["departments"]
 
-        return [{"department_id": i + 1, "department_name": item} for i, item in enumerate(departments)]
+    return [{"department_id": i + 1, "department_name": item} for i, item in enumerate(departments)]
 
 
 def phone_number_generator():
@@ -69,14 +75,12 @@ def phone_number_generator():
 # This function generates 400 doctors that are above average for a healthcare
 def generate_doctors(departments: list[dict]):
     # Each item in specialization is related to the corresponding department in order
-    with open('specializations.json', 'r') as file:
-        specializations: list[list[str]] = json.load(file)
-
-    with open('doctors_names.json', 'r') as file:
-        firstnames_gender, lastnames = json.load(file).values()
+    specializations: list[list[str]] = get_catalog()["specializations"]
+    firstnames_gender, lastnames = get_catalog()["doctor_names"]
 
     doctors = []
     index = 1
+    national_codes = allocate_national_codes(len(firstnames_gender) * len(lastnames))
 
     for firstname_gender in firstnames_gender:
         for lastname in lastnames:
@@ -86,7 +90,7 @@ def generate_doctors(departments: list[dict]):
 
             doctor = {
                 "doctor_id": index,
-                "national_code": generate_unique_national_code(),
+                "national_code": national_codes[index - 1],
                 "firstname": firstname,
                 "lastname": lastname,
                 "gender": gender,
@@ -107,19 +111,18 @@ def generate_doctors(departments: list[dict]):
 # This function generates 10,000 patients, and also you set round to be more than 1
 # i.e., to generate 1 million patients, you should set round to 100
 # which produces duplicate firstname and lastname combos, but with different national_code
-# keep in mind as the round grows, the process takes much longer due to unique national code
 def generate_patients(rounds=1):
-    with open('patient_names.json', 'r') as file:
-        firstnames_gender, lastnames = json.load(file).values()
+    firstnames_gender, lastnames = get_catalog()["patient_names"]
 
-        # You can feed you your own data to the script and uncomment this part to check
-        # for duplicates firstnames and lastnames
-        # pprint(get_duplicates([item[0] for item in firstnames_gender]))
-        # print('-' * 100)
-        # pprint(get_duplicates(lastnames))
+    # You can feed you your own data to the script and uncomment this part to check
+    # for duplicates firstnames and lastnames
+    # pprint(get_duplicates([item[0] for item in firstnames_gender]))
+    # print('-' * 100)
+    # pprint(get_duplicates(lastnames))
 
     patients = []
     index = 1
+    national_codes = allocate_national_codes(rounds * len(firstnames_gender) * len(lastnames))
 
     for _ in range(rounds):
         for firstname_gender in firstnames_gender:
@@ -128,7 +131,7 @@ def generate_patients(rounds=1):
 
                 patient = {
                     "patient_id": index,
-                    "national_code": generate_unique_national_code(),
+                    "national_code": national_codes[index - 1],
                     "firstname": firstname,
                     "lastname": lastname,
                     "dob": get_random_date(1995, 2010),
@@ -155,7 +158,7 @@ def weighted_rand_selector(a: tuple[any, int], b: tuple[any, int]):
 
 
 def calculate_visit_cost(department_id, doctor_id, is_checkup):
-    departments_cost_effect = [2, 7, 4, 3, 1, 6, 5]
+    departments_cost_effect = get_catalog()["departments_cost_effect"]
     unit = 5000
 
     cost = departments_cost_effect[department_id - 1] * doctor_id * unit
@@ -165,8 +168,12 @@ def calculate_visit_cost(department_id, doctor_id, is_checkup):
 
 
 # Visit per patient means that how many visits should be generated for each patient
-# default is 100 to produce 1 million visits, but you can increase it
-def generate_visits(doctors: list[dict], patients: list[dict], visit_per_patient=100):
+# default is 100 to produce 1 million visits, but you can increase it.
+# Compact keeps the visits in a RecordTable instead of a list of dicts, look at record_store.py,
+# the diagnosis is always a prefix of the same text so only its length is kept.
+# checkup_ratio is the share of the checkup visits, it's rounded to a percent
+def generate_visits(doctors: list[dict], patients: list[dict], visit_per_patient=100, compact=False,
+                    checkup_ratio=0.1):
     lorem_ipsum = ("Lorem ipsum dolor sit amet, consectetur adipiscing elit, "
                    "sed do eiusmod tempor incididunt ut labore et dolore magna aliqua. "
                    "Ut enim ad minim veniam, quis nostrud exercitation ullamco laboris "
@@ -174,16 +181,18 @@ def generate_visits(doctors: list[dict], patients: list[dict], visit_per_patient
                    "reprehenderit in voluptate velit esse cillum dolore eu fugiat nulla pariatur. "
                    "Excepteur sint occaecat cupidatat non proident, sunt in culpa qui officia "
                    "deserunt mollit anim id est laborum.")
+    checkup_percent = round(checkup_ratio * 100)
     index = 1
-    visits = []
+    visits = RecordTable("Visit", {"diagnosis": Prefix(lorem_ipsum)}) if compact else []
 
     for patient in patients:
         for _ in range(visit_per_patient):
             doctor_index = randint(0, len(doctors) - 1)
             doctor_id = doctors[doctor_index]["doctor_id"]
             department_id = doctors[doctor_index]["department_id"]
-            # this line make the 10% of the visits checkup
-            is_checkup = weighted_rand_selector((1, 10), (0, 90))
+            # weighted_rand_selector((1, 10), (0, 90)) did the same for 10%, but it only works for
+            # the ratios below 50% because it compares with the smaller weight
+            is_checkup = 1 if randint(1, 100) <= checkup_percent else 0
 
             visit = {
                 "visit_id": index,
@@ -230,13 +239,13 @@ def calculate_treatment_cost(treatment_effect: int, department_effect: int, inde
 # to show some kind of effect on the cost.
 # So to calculate the cost of the treatment, the most important factor is
 # treatment type then department and the least effective is the treatment index
-def generate_treatments(visits: list[dict], departments: list[dict]):
-    with open('treatments.json', 'r') as file:
-        treatment_types, treatment_descriptions = json.load(file).values()
+def generate_treatments(visits: list[dict], departments: list[dict], compact=False):
+    treatment_types = get_catalog()["treatment_types"]
+    treatment_descriptions = get_catalog()["treatment_descriptions"]
 
     index = 1
-    treatments = []
-    departments_cost_effect = [2, 7, 4, 3, 1, 6, 5]
+    treatments = RecordTable("Treatment") if compact else []
+    departments_cost_effect = get_catalog()["departments_cost_effect"]
 
     for visit in visits:
         if visit["is_check_up"]:
@@ -265,19 +274,6 @@ def generate_treatments(visits: list[dict], departments: list[dict]):
     return treatments
 
 
-def find_index(lst, condition):
-    return next((i for i, x in enumerate(lst) if condition(x)), -1)
-
-
-def find(lst, condition, default=None):
-    item = next((x for x in lst if condition(x)), None)
-
-    if item is None:
-        return default
-
-    return item
-
-
 def calculate_medication_cost(medication_effect, frequency, frequency_unit, duration):
     hour_in_minute = 60
     day_in_minute = 1 * 24 * hour_in_minute
@@ -303,21 +299,18 @@ def calculate_medication_cost(medication_effect, frequency, frequency_unit, dura
     return round(medication_effect * cycles * unit, 2)
 
 
-def generate_medications(treatments: list[dict], visits: list[dict]):
-    with open('treatments.json', 'r') as file:
-        treatment_types, treatment_descriptions = json.load(file).values()
-
-    with open('medications.json', 'r') as file:
-        medications_cost, medication_names = json.load(file).values()
+def generate_medications(treatments: list[dict], visits: list[dict], compact=False):
+    treatment_indexes = get_catalog()["treatment_indexes"]
+    medication_costs = get_catalog()["medication_costs"]
+    medication_names = get_catalog()["medication_names"]
 
     index = 1
     frequency_units = ('minute', 'hour', 'day', 'week', 'month')
-    medications = []
+    medications = RecordTable("Medication") if compact else []
 
     for treatment in treatments:
         department_index = treatment["department_id"] - 1
-        treatment_description_index = find_index(treatment_descriptions[department_index],
-                                                 lambda t: t[0] == treatment["treatment_description"])
+        treatment_description_index = treatment_indexes[department_index][treatment["treatment_description"]]
 
         # The data I supplied always makes the range from 0 to 5,
         # but if you add or remove, this generator still works flawlessly
@@ -346,7 +339,7 @@ def generate_medications(treatments: list[dict], visits: list[dict]):
             "frequency": frequency,
             "frequency_unit": frequency_unit,
             "medication_cost": calculate_medication_cost(
-                find(medications_cost, lambda cost: cost[0] == medication_name)[1],
+                medication_costs[medication_name],
                 frequency, frequency_unit, duration),
             "prescription_date": visits[treatment["visit_id"] - 1]["visit_date"],
             "duration": duration,
@@ -359,27 +352,15 @@ def generate_medications(treatments: list[dict], visits: list[dict]):
     return medications
 
 
-def generate_billing(visits: list[dict], treatments: list[dict], medications: list[dict]):
+# Treatment and medication costs of each visit come from the join stage, so a visit can have
+# any number of treatments and medications, look at billing_join.py
+def generate_billing_rows(visits, treatments, medications):
     index = 1
-    treatment_index = 0
-    medication_index = 0
-    billings = []
 
-    for visit in visits:
+    for visit, treatment_cost, medication_cost in join_costs(visits, treatments, medications):
         insurance_coverage_percentage = randint(10, 30) / 100
         tax_percentage = randint(15, 30) / 100
 
-        treatment_cost = 0
-        medication_cost = 0
-
-        if treatments[treatment_index]["visit_id"] == visit["visit_id"]:
-            treatment_cost = treatments[treatment_index]["treatment_cost"]
-            treatment_index += 1
-
-        if medications[medication_index]["visit_id"] == visit["visit_id"]:
-            medication_cost = medications[medication_index]["medication_cost"]
-            medication_index += 1
-
         total_amount_without_tax = visit["visit_cost"] + treatment_cost + medication_cost
         tax_amount = tax_percentage * total_amount_without_tax
         total_amount = total_amount_without_tax + tax_amount
@@ -396,30 +377,200 @@ def generate_billing(visits: list[dict], treatments: list[dict], medications: li
             "insurance_coverage": insurance_coverage,
         }
 
-        billings.append(billing)
+        yield billing
 
         index += 1
 
-    return billings
+
+def generate_billing(visits: list[dict], treatments: list[dict], medications: list[dict], compact=False):
+    if compact:
+        return RecordTable("Billing").extend(generate_billing_rows(visits, treatments, medications))
+
+    return list(generate_billing_rows(visits, treatments, medications))
 
 
 if __name__ == '__main__':
-    departments = get_departments()
-    doctors = generate_doctors(departments)
-    patients = generate_patients()
-    visits = generate_visits(doctors, patients)
-    treatments = generate_treatments(visits, departments)
-    medications = generate_medications(treatments, visits)
-    billings = generate_billing(visits, treatments, medications)
-
-    all_data = [("Department", departments), ("Doctor", doctors), ("Patient", patients), ("Visit", visits),
-                ("Treatment", treatments),
-                ("Medication", medications),
-                ("Billing", billings)]
-
-    print("Visit Count: ", len(visits))
-    print("Treatment Count: ", len(treatments))
-    print("Medication Count: ", len(medications))
-    print("Billing Count: ", len(billings))
-
-    produce_sql_and_insert_into(all_data)
+    # Reserve the national codes of the doctors and patients that are already in the source database when you are
+    # adding data to a database that is filled, otherwise the unique constraint of national_code may fail
+    reserve_existing = False
+
+    if reserve_existing:
+        reserve_existing_national_codes(connect_to_sql_server())
+
+    # Instrumented records the time, rows and memory of each stage and the latency of the insert batches,
+    # prints the progress and writes metrics.json at the end, look at metrics.py. Profile writes a cProfile
+    # file for each stage
+    instrumented = False
+    profile = False
+
+    if instrumented:
+        enable_metrics(trace_memory=True, profile=profile)
+
+    # Appending adds append_days days of visits after the last visit of a filled source database and changes
+    # some patient phones and doctor specializations instead of generating everything, look at
+    # append_generator.py. The state is read from the manifest of the last run or from the server
+    append_days = 0
+    from_manifest = True
+    phone_change_rate = 0.01
+    specialization_change_rate = 0.05
+
+    if append_days > 0:
+        seed(None)
+        append_to_source(get_departments(), append_days, from_manifest, phone_change_rate, specialization_change_rate)
+        write_report("metrics.json")
+        sys.exit()
+
+    # Set a number to get the same data in every run
+    master_seed = None
+    seed(master_seed)
+    reset_national_codes()
+
+    with stage("generate_departments") as current:
+        departments = get_departments()
+        current.rows = len(departments)
+
+    with stage("generate_doctors") as current:
+        doctors = generate_doctors(departments)
+        current.rows = len(doctors)
+
+    # A scale factor fixes the number of patients and visits instead of the json files and visit_per_patient,
+    # and the skews and curves make some doctors, patients and days much busier, look at scale_factor.py.
+    # The scaled data is always columnar
+    scale_factor = None
+    scale = get_scale(scale_factor, doctor_skew=1.0, patient_skew=0.5, weekday_curve="clinic",
+                      season_curve="flu", checkup_ratio=0.1) if scale_factor is not None else None
+
+    with stage("generate_patients") as current:
+        patients = generate_patients(get_patient_rounds(scale) if scale is not None else 1)
+
+        if scale is not None:
+            patients = patients[:scale["patients"]]
+
+        current.rows = len(patients)
+
+    # The columnar generator makes the same data with numpy, it's much faster when visits are millions
+    columnar = False
+
+    # Compact keeps the tables of the dict generators in typed arrays, it uses a fraction of the memory
+    # of the dicts and the data is the same, look at record_store.py
+    compact = False
+
+    # Streaming generates and loads visits for a chunk of patients at a time, memory doesn't
+    # grow with the number of visits, use it for tens of millions of visits
+    streaming = False
+
+    # Parallel streaming generates the chunks in a pool of processes, the data only depends
+    # on the master seed and not on the number of workers
+    parallel = False
+    workers = None
+
+    # "odbc" inserts the data into sql server, "csv", "char", "native" and "parquet" write the tables
+    # to files in the output directory with a bulk insert script, look at file_sink.py
+    output = "odbc"
+
+    # Number of connections that the odbc output uses, with more than one, independent tables and slices of
+    # each table are inserted at the same time (doesn't work with streaming)
+    load_workers = 1
+
+    # Pipelined inserts the tables in other threads while the next chunks are generated, the generator waits
+    # when queue_depth parts are not inserted yet, load_workers is the number of loader threads
+    pipelined = False
+    queue_depth = 4
+
+    # The cache keeps the generated tables on the disk and a run with the same seed, settings, json files and
+    # generator code maps them again instead of generating them, look at dataset_cache.py. It needs a master
+    # seed and columnar or scaled data and doesn't work with streaming
+    use_cache = False
+    cache_key = get_dataset_key({"master_seed": master_seed, "scale": scale}) \
+        if use_cache and master_seed is not None and (columnar or scale is not None) else None
+
+    # The scaled visits come from their own generator, so they only depend on the master seed and the scale
+    scale_rng = np.random.default_rng(master_seed) if master_seed is not None else None
+
+    if scale is not None and streaming and parallel:
+        raise ValueError("Parallel streaming doesn't generate scaled data, set parallel or scale_factor")
+
+    if streaming:
+        if scale is not None:
+            chunks = generate_scaled_chunks(departments, doctors, patients, scale, rng=scale_rng)
+        elif parallel:
+            chunks = generate_shards(departments, doctors, patients, master_seed=master_seed, workers=workers)
+        else:
+            chunks = generate_chunks(departments, doctors, patients)
+
+        all_data = stream_tables([("Department", departments), ("Doctor", doctors), ("Patient", patients)], chunks)
+    else:
+        cached = None
+
+        if cache_key is not None:
+            with stage("read_cache") as current:
+                cached = read_dataset(cache_key)
+                current.rows = count_rows(cached[0][1]) if cached is not None else 0
+
+        if cached is not None:
+            visits, treatments, medications, billings = (records for _, records in cached)
+        elif scale is not None:
+            # All the patients are in one chunk
+            with stage("generate_scaled") as current:
+                visits, treatments, medications, billings = (records for _, records in next(
+                    generate_scaled_chunks(departments, doctors, patients, scale, len(patients), scale_rng)))
+                current.rows = count_rows(visits)
+        else:
+            with stage("generate_visits") as current:
+                visits = generate_visit_columns(doctors, patients) if columnar else \
+                    generate_visits(doctors, patients, compact=compact)
+                current.rows = count_rows(visits)
+
+            with stage("generate_treatments") as current:
+                treatments = generate_treatment_columns(visits, departments) if columnar else \
+                    generate_treatments(visits, departments, compact)
+                current.rows = count_rows(treatments)
+
+            with stage("generate_medications") as current:
+                medications = generate_medication_columns(treatments, visits) if columnar else \
+                    generate_medications(treatments, visits, compact)
+                current.rows = count_rows(medications)
+
+            with stage("generate_billing") as current:
+                billings = generate_billing_columns(visits, treatments, medications) if columnar else \
+                    generate_billing(visits, treatments, medications, compact)
+                current.rows = count_rows(billings)
+
+        if cache_key is not None and cached is None:
+            with stage("write_cache"):
+                write_dataset(cache_key, [("Visit", visits), ("Treatment", treatments),
+                                          ("Medication", medications), ("Billing", billings)],
+                              {"master_seed": master_seed, "scale": scale})
+
+        all_data = [("Department", departments), ("Doctor", doctors), ("Patient", patients), ("Visit", visits),
+                    ("Treatment", treatments),
+                    ("Medication", medications),
+                    ("Billing", billings)]
+
+        print("Visit Count: ", count_rows(visits))
+        print("Treatment Count: ", count_rows(treatments))
+        print("Medication Count: ", count_rows(medications))
+        print("Billing Count: ", count_rows(billings))
+
+    # The manifest of the last run doesn't describe the database after this load starts, a failed load leaves
+    # no manifest and the append mode reads the state from the server
+    remove_manifest()
+
+    # With streaming, the generation of the chunks is a part of the load stage
+    with stage("load"):
+        if output == "odbc" and pipelined:
+            run_pipeline(all_data, loaders=load_workers, queue_depth=queue_depth)
+        elif output == "odbc" and load_workers > 1 and not streaming:
+            parallel_insert_into(all_data, workers=load_workers, slices=load_workers)
+        elif output == "odbc":
+            bulk_insert_into(all_data)
+        else:
+            export_tables(all_data, "output", output)
+
+    # The manifest lets the append mode continue from this data when it's inserted into the source database,
+    # a streamed run doesn't keep its tables and the files of the other outputs may never be loaded (or loaded
+    # into another database), so the append mode reads the state from the server after them
+    if output == "odbc" and not streaming:
+        write_manifest(get_generated_state(doctors, patients, dict(all_data)))
+
+    write_report("metrics.json")
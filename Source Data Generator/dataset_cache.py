@@ -0,0 +1,270 @@
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+from catalog import JSON_FILES
+
+# Keeps the tables of a generated dataset on disk, so a run with the same json files, generator code,
+# parameters and seed loads them again instead of generating everything. The key of a dataset is the sha256
+# of all of those, so any change makes another entry and an entry never has to be checked again.
+# Every entry is a directory with a manifest and a file for each column:
+#   numeric, bool and date columns  .npy files that are memory mapped when the entry is read, nothing is
+#                                   copied until the loader turns a batch of rows into python values
+#   string columns                  .npy of int32 codes that is memory mapped and a json of the distinct strings
+#   lists of dicts                  json (departments, doctors and patients are small)
+# Entries that were not used for the longest time are removed when the cache is bigger than max_bytes.
+#
+#   python dataset_cache.py list
+#   python dataset_cache.py prune --max-size 2G
+
+CACHE_DIRECTORY = ".dataset_cache"
+MANIFEST_FILE = "manifest.json"
+MAX_BYTES = 10 * 1024 ** 3
+
+# The data of a seed also depends on the code that generates it
+CODE_FILES = ("catalog.py", "columnar_generator.py", "billing_join.py", "scale_factor.py", "data_generator.py",
+              "national_code.py")
+
+
+# A string column of codes and the distinct strings, it acts like the object array for the loaders:
+# slices are other CategoryColumns over the same memory map and tolist gives the strings
+class CategoryColumn:
+    def __init__(self, codes, values):
+        self.codes = codes
+        self.values = values
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return CategoryColumn(self.codes[index], self.values)
+
+        return self.values[self.codes[index]]
+
+    def __array__(self, dtype=None, copy=None):
+        return self.values[self.codes]
+
+    def tolist(self):
+        return self.values[self.codes].tolist()
+
+
+def get_dataset_key(parameters: dict):
+    digest = hashlib.sha256()
+
+    for file_name in JSON_FILES + CODE_FILES:
+        with open(file_name, 'rb') as file:
+            digest.update(file_name.encode() + b'\0' + file.read() + b'\0')
+
+    # numpy values of the parameters, i.e. the curves of a scale, are written as lists
+    digest.update(json.dumps(parameters, sort_keys=True, default=lambda value: value.tolist()).encode())
+
+    return digest.hexdigest()
+
+
+def get_entry_directory(key: str, directory=CACHE_DIRECTORY):
+    return os.path.join(directory, key)
+
+
+def write_column(path: str, name: str, column):
+    column = np.asarray(column)
+
+    if column.dtype == object:
+        values, codes = np.unique(column, return_inverse=True)
+        np.save(os.path.join(path, f"{name}.npy"), codes.astype(np.int32))
+
+        with open(os.path.join(path, f"{name}.json"), 'w', encoding='utf-8') as file:
+            json.dump(values.tolist(), file, ensure_ascii=False)
+
+        return {"name": name, "strings": True}
+
+    np.save(os.path.join(path, f"{name}.npy"), column)
+
+    return {"name": name, "strings": False}
+
+
+def read_column(path: str, column: dict):
+    values = np.load(os.path.join(path, f"{column['name']}.npy"), mmap_mode='r')
+
+    if not column["strings"]:
+        return values
+
+    with open(os.path.join(path, f"{column['name']}.json"), 'r', encoding='utf-8') as file:
+        return CategoryColumn(values, np.array(json.load(file), dtype=object))
+
+
+def get_size(path: str):
+    return sum(os.path.getsize(os.path.join(path, file_name)) for file_name in os.listdir(path))
+
+
+# data is a list of (table, records) like bulk_insert_into, records are a dict of columns or a list of dicts.
+# The entry is written to another directory first, so a failed write never leaves a broken entry
+def write_dataset(key: str, data: list, parameters: dict, directory=CACHE_DIRECTORY, max_bytes=MAX_BYTES):
+    path = get_entry_directory(key, directory)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    os.makedirs(temporary_path, exist_ok=True)
+
+    tables = []
+
+    for i, (table, records) in enumerate(data):
+        # A table can come in several parts, so the files are named by position
+        prefix = f"{i:03}_{table}"
+
+        if isinstance(records, dict):
+            tables.append({"table": table, "columns": [dict(write_column(temporary_path, f"{prefix}_{name}", column),
+                                                            column=name) for name, column in records.items()]})
+        else:
+            with open(os.path.join(temporary_path, f"{prefix}.json"), 'w', encoding='utf-8') as file:
+                json.dump(list(records), file, ensure_ascii=False)
+
+            tables.append({"table": table, "records": f"{prefix}.json"})
+
+    manifest = {
+        "key": key,
+        "created_at": datetime.datetime.now().isoformat(timespec='seconds'),
+        "parameters": parameters,
+        "tables": tables,
+        "bytes": get_size(temporary_path),
+    }
+
+    with open(os.path.join(temporary_path, MANIFEST_FILE), 'w') as file:
+        json.dump(manifest, file, indent=2, default=lambda value: value.tolist())
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+
+    os.replace(temporary_path, path)
+    prune(max_bytes, directory, keep=key)
+
+    return manifest
+
+
+# The tables of the entry with memory mapped columns, None when the dataset is not in the cache
+def read_dataset(key: str, directory=CACHE_DIRECTORY):
+    path = get_entry_directory(key, directory)
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+
+    if not os.path.exists(manifest_path):
+        return None
+
+    with open(manifest_path, 'r') as file:
+        manifest = json.load(file)
+
+    data = []
+
+    for table in manifest["tables"]:
+        if "records" in table:
+            with open(os.path.join(path, table["records"]), 'r', encoding='utf-8') as file:
+                data.append((table["table"], json.load(file)))
+        else:
+            data.append((table["table"], {column["column"]: read_column(path, column)
+                                          for column in table["columns"]}))
+
+    # The modification time of the manifest is the last use of the entry for the eviction
+    os.utime(manifest_path)
+
+    return data
+
+
+def list_entries(directory=CACHE_DIRECTORY):
+    entries = []
+
+    if not os.path.exists(directory):
+        return entries
+
+    for key in os.listdir(directory):
+        manifest_path = os.path.join(directory, key, MANIFEST_FILE)
+
+        if not os.path.exists(manifest_path):
+            continue
+
+        with open(manifest_path, 'r') as file:
+            manifest = json.load(file)
+
+        entries.append({
+            "key": key,
+            "bytes": manifest["bytes"],
+            "created_at": manifest["created_at"],
+            "last_used": os.path.getmtime(manifest_path),
+            "parameters": manifest["parameters"],
+        })
+
+    return sorted(entries, key=lambda entry: entry["last_used"], reverse=True)
+
+
+def remove_entry(key: str, directory=CACHE_DIRECTORY):
+    shutil.rmtree(get_entry_directory(key, directory))
+
+
+# Removes the least recently used entries until the cache fits in max_bytes, keep is never removed
+def prune(max_bytes=MAX_BYTES, directory=CACHE_DIRECTORY, keep=None):
+    removed = []
+    entries = list_entries(directory)
+    total = sum(entry["bytes"] for entry in entries)
+
+    for entry in reversed(entries):
+        if total <= max_bytes:
+            break
+
+        if entry["key"] == keep:
+            continue
+
+        remove_entry(entry["key"], directory)
+        total -= entry["bytes"]
+        removed.append(entry["key"])
+
+    return removed
+
+
+def parse_size(size: str):
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+    if size[-1].upper() in units:
+        return int(float(size[:-1]) * units[size[-1].upper()])
+
+    return int(size)
+
+
+def format_size(size: int):
+    return f"{size / 1024 ** 2:.1f} MB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lists and prunes the cache of generated datasets")
+    parser.add_argument("--directory", default=CACHE_DIRECTORY)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="entries from the most recently used")
+    prune_parser = commands.add_parser("prune", help="remove the least recently used entries")
+    prune_parser.add_argument("--max-size", default=str(MAX_BYTES), help="size to keep, i.e. 500M or 2G")
+    remove_parser = commands.add_parser("remove", help="remove entries by the start of their key")
+    remove_parser.add_argument("keys", nargs="+")
+    commands.add_parser("clear", help="remove every entry")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        entries = list_entries(args.directory)
+
+        for entry in entries:
+            last_used = time.strftime('%Y-%m-%d %H:%M', time.localtime(entry["last_used"]))
+            print(f"{entry['key'][:16]}  {format_size(entry['bytes']):>10}  used {last_used}  "
+                  f"{json.dumps(entry['parameters'], sort_keys=True)}")
+
+        print(f"{len(entries)} entries, {format_size(sum(entry['bytes'] for entry in entries))}")
+    elif args.command == "prune":
+        removed = prune(parse_size(args.max_size), args.directory)
+        print(f"{len(removed)} entries removed")
+    else:
+        entries = list_entries(args.directory)
+
+        for entry in entries:
+            if args.command == "clear" or any(entry["key"].startswith(key) for key in args.keys):
+                remove_entry(entry["key"], args.directory)
+                print(f"{entry['key']} removed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+import csv
+import datetime
+import os
+import struct
+from schema import TABLES, parse_type, get_converters, to_rows
+
+# Instead of inserting over odbc, the tables are written to files in the column order of source.sql and
+# a sql script with a BULK INSERT for each file is written next to them. Bulk insert with TABLOCK is
+# minimally logged and is the fastest way to fill sql server, the files can also be loaded to other databases.
+# Formats:
+#   csv     utf-8 csv, loaded with FORMAT = 'CSV'
+#   char    bcp character format, tab separated utf-16 (widechar) so persian names are kept
+#   native  bcp native format, binary values described by a format file for each table
+#   parquet parquet files for other engines, needs pyarrow and has no bulk insert script
+# None is written as an empty field in the text files and loaded as NULL with KEEPNULLS, native files need
+# the nullable columns of each table to give their fixed length fields a length prefix.
+FILE_EXTENSIONS = {"csv": "csv", "char": "dat", "native": "bcp", "parquet": "parquet"}
+
+
+# Host type, prefix length and data length of each sql type in the native files, a nullable fixed length
+# field has a 1 byte prefix like the native files of bcp
+def get_native_field(sql_type: str, nullable=False):
+    name, size, _ = parse_type(sql_type)
+
+    if name == "nvarchar":
+        # nvarchar(max) has a length of 0 and an 8 byte prefix
+        return ("SQLNCHAR", 2, size * 2) if size != 0 else ("SQLNCHAR", 8, 0)
+    elif name == "date":
+        host_type, length = "SQLDATE", 3
+    elif name == "datetime":
+        host_type, length = "SQLDATETIME", 8
+    elif name == "decimal":
+        # Costs are written as float and sql server converts them to the decimal of the column
+        host_type, length = "SQLFLT8", 8
+    elif name == "bit":
+        host_type, length = "SQLBIT", 1
+    else:
+        host_type, length = "SQLINT", 4
+
+    return host_type, 1 if nullable else 0, length
+
+
+def write_format_file(path: str, table: str, nullable=()):
+    columns = TABLES[table]
+    lines = ["14.0", str(len(columns))]
+
+    for i, (column, sql_type) in enumerate(columns):
+        host_type, prefix, length = get_native_field(sql_type, column in nullable)
+        lines.append(f'{i + 1}\t{host_type}\t{prefix}\t{length}\t""\t{i + 1}\t{column}\t""')
+
+    with open(path, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+
+
+def pack_fixed_value(value, sql_type: str):
+    name, _, _ = parse_type(sql_type)
+
+    if name == "date":
+        # Days since 0001-01-01 in 3 bytes
+        return (value.toordinal() - 1).to_bytes(3, 'little')
+    elif name == "datetime":
+        # Days since 1900-01-01 and 1/300 of seconds since midnight
+        days = (value.date() - datetime.date(1900, 1, 1)).days
+        seconds = value.hour * 3600 + value.minute * 60 + value.second + value.microsecond / 1000000
+        return struct.pack('<iI', days, round(seconds * 300))
+    elif name == "decimal":
+        return struct.pack('<d', value)
+    elif name == "bit":
+        return struct.pack('<B', 1 if value else 0)
+
+    return struct.pack('<i', value)
+
+
+# A prefix of -1 is NULL, the fields without a prefix (not nullable fixed length fields) can't be NULL
+def pack_native_value(value, sql_type: str, nullable=False):
+    name, size, _ = parse_type(sql_type)
+
+    if name == "nvarchar":
+        prefix = '<h' if size != 0 else '<q'
+
+        if value is None:
+            return struct.pack(prefix, -1)
+
+        encoded = value.encode('utf-16-le')
+        return struct.pack(prefix, len(encoded)) + encoded
+
+    if nullable:
+        if value is None:
+            return struct.pack('<b', -1)
+
+        packed = pack_fixed_value(value, sql_type)
+        return struct.pack('<B', len(packed)) + packed
+
+    if value is None:
+        raise ValueError(f"A {sql_type} column that is not nullable got None")
+
+    return pack_fixed_value(value, sql_type)
+
+
+def format_text_value(value):
+    if value is None:
+        # An empty field is NULL with KEEPNULLS
+        return ''
+    elif isinstance(value, bool):
+        return '1' if value else '0'
+    elif isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    elif isinstance(value, datetime.date):
+        return value.isoformat()
+
+    return str(value)
+
+
+def write_rows(path: str, table: str, rows: list, file_format: str, nullable=()):
+    if file_format == "csv":
+        with open(path, 'w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file, lineterminator='\n')
+            writer.writerows([format_text_value(value) for value in row] for row in rows)
+    elif file_format == "char":
+        with open(path, 'w', newline='', encoding='utf-16-le') as file:
+            file.writelines('\t'.join(format_text_value(value) for value in row) + '\r\n' for row in rows)
+    elif file_format == "native":
+        fields = [(sql_type, column in nullable) for column, sql_type in TABLES[table]]
+
+        with open(path, 'wb') as file:
+            file.writelines(b''.join(pack_native_value(value, sql_type, is_nullable)
+                                     for value, (sql_type, is_nullable) in zip(row, fields)) for row in rows)
+    elif file_format == "parquet":
+        # pyarrow is only needed for parquet files
+        import pyarrow
+        import pyarrow.parquet
+
+        columns = list(zip(*rows)) if len(rows) != 0 else [[] for _ in TABLES[table]]
+        arrays = {column: list(values) for (column, _), values in zip(TABLES[table], columns)}
+
+        pyarrow.parquet.write_table(pyarrow.table(arrays), path)
+    else:
+        raise ValueError(f"Unknown file format: {file_format}")
+
+
+def get_bulk_insert_sql(path: str, table: str, file_format: str, database: str, schema: str, format_file: str):
+    options = {
+        "csv": "FORMAT = 'CSV', FIELDTERMINATOR = ',', ROWTERMINATOR = '0x0a', CODEPAGE = '65001'",
+        "char": "DATAFILETYPE = 'widechar', FIELDTERMINATOR = '\\t', ROWTERMINATOR = '\\n'",
+        "native": f"FORMATFILE = '{format_file}'",
+    }[file_format]
+
+    return f"bulk insert {database}.{schema}.{table} from '{path}' with ({options}, KEEPNULLS, TABLOCK);"
+
+
+# Writes each table of data to files of rows_per_file rows in directory/table, data is the same as
+# bulk_insert_into so a stream of chunks can be exported too, a table can come in several parts.
+# server_directory is the path of the directory on the sql server machine (i.e. the mounted volume
+# of the docker container) and is used in the bulk insert script. nullable has the nullable columns of
+# each table for the native files, the columns of source.sql are all not null
+def export_tables(data, directory: str, file_format="csv", rows_per_file=1000000, database="source",
+                  schema="Health", server_directory=None, nullable=None):
+    extension = FILE_EXTENSIONS[file_format]
+    server_directory = server_directory or os.path.abspath(directory)
+    nullable = nullable or {}
+
+    # table -> (rows of the current file, list of the file names)
+    tables = {}
+
+    def flush(table):
+        rows, files = tables[table]
+        file_name = f'{table}_{len(files) + 1:05}.{extension}'
+
+        write_rows(os.path.join(directory, table, file_name), table, rows, file_format, nullable.get(table, ()))
+        files.append(file_name)
+        rows.clear()
+
+    for table, records in data:
+        if table not in tables:
+            os.makedirs(os.path.join(directory, table), exist_ok=True)
+            tables[table] = ([], [])
+
+            if file_format == "native":
+                write_format_file(os.path.join(directory, table, f'{table}.fmt'), table, nullable.get(table, ()))
+
+        rows = tables[table][0]
+
+        for row in to_rows(records, get_converters(table)):
+            rows.append(row)
+
+            if len(rows) == rows_per_file:
+                flush(table)
+
+    for table, (rows, files) in tables.items():
+        if len(rows) != 0 or len(files) == 0:
+            flush(table)
+
+    if file_format == "parquet":
+        return
+
+    # Tables are loaded in the order they came, so the foreign keys are loaded before the tables using them
+    script = []
+
+    for table, (_, files) in tables.items():
+        format_file = f'{server_directory}/{table}/{table}.fmt'
+
+        for file_name in files:
+            path = f'{server_directory}/{table}/{file_name}'
+            script.append(get_bulk_insert_sql(path, table, file_format, database, schema, format_file))
+
+    with open(os.path.join(directory, f'bulk_insert_{database}.sql'), 'w') as file:
+        file.write('\n'.join(script) + '\n')
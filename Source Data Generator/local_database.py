@@ -0,0 +1,94 @@
+import datetime
+import re
+import sqlite3
+from schema import TABLES, parse_type
+
+# Stand-ins for the pyodbc cursor of connect_to_sql_server, so the loaders can be run and measured without
+# sql server. Both accept what insert_batches sends: setinputsizes, executemany, commit and close.
+#   RecordingCursor only counts the rows and commits of each table, it measures the python side of the load
+#   SqliteCursor inserts into an in-memory sqlite database with the tables of the schema module,
+#   database.schema.table names are turned to table names
+
+# The three part name of the insert statements
+TABLE_NAME_PATTERN = re.compile(r'\b\w+\.\w+\.(\w+)\b')
+
+sqlite3.register_adapter(datetime.date, lambda value: value.isoformat())
+sqlite3.register_adapter(datetime.datetime, lambda value: value.isoformat(' '))
+
+
+class RecordingCursor:
+    def __init__(self):
+        self.fast_executemany = False
+        self.rows = {}
+        self.commits = 0
+        self.statements = 0
+
+    def setinputsizes(self, input_sizes):
+        pass
+
+    def execute(self, sql: str, *params):
+        self.statements += 1
+        return self
+
+    def executemany(self, sql: str, rows: list):
+        table = TABLE_NAME_PATTERN.search(sql).group(1)
+        self.rows[table] = self.rows.get(table, 0) + len(rows)
+        self.statements += 1
+
+    def commit(self):
+        self.commits += 1
+
+    def close(self):
+        pass
+
+
+def get_sqlite_type(sql_type: str):
+    name, _, _ = parse_type(sql_type)
+
+    if name in ("nvarchar", "date", "datetime"):
+        return "text"
+    elif name == "decimal":
+        return "real"
+
+    return "integer"
+
+
+def create_sqlite_schema(connection: sqlite3.Connection, tables=None):
+    for table in tables or TABLES:
+        columns = ', '.join(f'{column} {get_sqlite_type(sql_type)}' for column, sql_type in TABLES[table])
+        connection.execute(f'create table if not exists {table} ({columns})')
+
+
+class SqliteCursor:
+    def __init__(self, connection: sqlite3.Connection = None):
+        if connection is None:
+            connection = sqlite3.connect(':memory:', check_same_thread=False)
+            create_sqlite_schema(connection)
+
+        self.connection = connection
+        self.cursor = connection.cursor()
+        self.fast_executemany = False
+        self.commits = 0
+
+    def setinputsizes(self, input_sizes):
+        pass
+
+    def execute(self, sql: str, *params):
+        self.cursor.execute(TABLE_NAME_PATTERN.sub(r'\1', sql), params)
+        return self
+
+    def executemany(self, sql: str, rows: list):
+        self.cursor.executemany(TABLE_NAME_PATTERN.sub(r'\1', sql), rows)
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def commit(self):
+        self.connection.commit()
+        self.commits += 1
+
+    def close(self):
+        self.cursor.close()
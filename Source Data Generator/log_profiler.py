@@ -0,0 +1,265 @@
+import argparse
+import csv
+import datetime
+import json
+import statistics
+from common import connect_to_sql_server
+
+# Turns data_warehouse.Warehouse.Log into timings of the etl. Every procedure logs a row right after each
+# truncate/insert of a table, so the time of a step is the time between its log row and the row before it.
+# The type of the steps that run for each day has the date, i.e. 'insert 2021-01-01', so the steps are
+# added up by procedure, by table and by day, and the days of a procedure that take much longer than the
+# days before them are flagged.
+# orchestrator.py runs windows of several procedures at the same time, so their rows interleave and the row
+# before is often from another call. With the calls file of the orchestrator, a row is timed from the row
+# before it in the same call (the procedure and the window of its day) or from the start of the call.
+# The log is read from the server or from a csv export of the table (with a header row), i.e.
+#
+#   python log_profiler.py --file log.csv --folded etl.folded
+#   python log_profiler.py --calls .etl_calls.json
+#
+# The folded file has a line of "procedure;table;action milliseconds" for each step and can be opened
+# with flamegraph.pl or speedscope.
+
+LOG_COLUMNS = ["log_id", "operation_name", "target_table", "type", "created_at"]
+
+
+def read_log_from_server(cursor=None):
+    cursor = cursor or connect_to_sql_server()
+    cursor.execute(f"select {', '.join(LOG_COLUMNS)} from data_warehouse.Warehouse.Log order by log_id")
+
+    return [dict(zip(LOG_COLUMNS, row)) for row in cursor.fetchall()]
+
+
+def read_log_file(path: str):
+    entries = []
+
+    with open(path, 'r', newline='', encoding='utf-8-sig') as file:
+        for row in csv.DictReader(file):
+            entries.append({
+                "log_id": int(row["log_id"]),
+                "operation_name": row["operation_name"],
+                "target_table": row["target_table"],
+                "type": row["type"],
+                "created_at": datetime.datetime.fromisoformat(row["created_at"]),
+            })
+
+    return entries
+
+
+# The calls file of orchestrator.py
+def read_calls(path: str):
+    with open(path, 'r') as file:
+        calls = json.load(file)
+
+    for call in calls:
+        call["started_at"] = datetime.datetime.fromisoformat(call["started_at"])
+        call["finished_at"] = datetime.datetime.fromisoformat(call["finished_at"])
+
+        if call["window"] is not None:
+            call["window"] = [datetime.date.fromisoformat(day) for day in call["window"]]
+
+    return calls
+
+
+# The call that wrote a log row, the day of the row picks the window when a procedure ran several windows
+# at the same time
+def find_call(calls: list[dict], entry: dict, day):
+    for i, call in enumerate(calls):
+        if call["procedure"] != entry["operation_name"]:
+            continue
+
+        if not call["started_at"] <= entry["created_at"] <= call["finished_at"]:
+            continue
+
+        if day is None or call["window"] is None or call["window"][0] <= day <= call["window"][1]:
+            return i
+
+    return None
+
+
+# 'insert 2021-01-01' -> ("insert", date(2021, 1, 1)), 'copy-schema' -> ("copy-schema", None)
+def parse_type(log_type: str):
+    action, _, rest = log_type.strip().partition(' ')
+
+    try:
+        return action, datetime.date.fromisoformat(rest.strip())
+    except ValueError:
+        return log_type.strip(), None
+
+
+# A step is the work between two log rows, a gap longer than max_gap is the start of another run
+# and the first row after it has no duration. The rows of the calls are timed within their call
+def get_steps(entries: list[dict], max_gap=datetime.timedelta(hours=1), calls=None):
+    steps = []
+    previous = None
+    # The time of the last row of each call
+    call_times = {}
+
+    for entry in sorted(entries, key=lambda item: item["log_id"]):
+        action, day = parse_type(entry["type"])
+        call = find_call(calls, entry, day) if calls is not None else None
+        started_at = None
+
+        if call is not None:
+            started_at = call_times.get(call, calls[call]["started_at"])
+            call_times[call] = entry["created_at"]
+        elif previous is not None and entry["created_at"] - previous["created_at"] <= max_gap:
+            started_at = previous["created_at"]
+
+        if started_at is not None:
+            steps.append({
+                "procedure": entry["operation_name"],
+                "table": entry["target_table"],
+                "action": action,
+                "date": day,
+                "seconds": (entry["created_at"] - started_at).total_seconds(),
+            })
+
+        previous = entry
+
+    return steps
+
+
+def add_up(steps: list[dict], key):
+    totals = {}
+
+    for step in steps:
+        name = key(step)
+        total = totals.setdefault(name, {"seconds": 0.0, "count": 0})
+        total["seconds"] += step["seconds"]
+        total["count"] += 1
+
+    return dict(sorted(totals.items(), key=lambda item: -item[1]["seconds"]))
+
+
+# Seconds of each procedure for each day it processed, in the order of the days
+def get_daily_seconds(steps: list[dict]):
+    days = {}
+
+    for step in steps:
+        if step["date"] is not None:
+            procedure_days = days.setdefault(step["procedure"], {})
+            procedure_days[step["date"]] = procedure_days.get(step["date"], 0.0) + step["seconds"]
+
+    return {procedure: dict(sorted(items.items())) for procedure, items in days.items()}
+
+
+# A day is flagged when it took factor times longer than the median of the window days before it,
+# the trend of a procedure is the mean of its last window days divided by the mean of its first window days
+def find_growing_days(daily_seconds: dict, window=7, factor=2.0):
+    flagged = []
+    trends = {}
+
+    for procedure, days in daily_seconds.items():
+        dates = list(days)
+        seconds = list(days.values())
+
+        for i in range(window, len(seconds)):
+            median = statistics.median(seconds[i - window:i])
+
+            if median > 0 and seconds[i] > median * factor:
+                flagged.append({"procedure": procedure, "date": dates[i], "seconds": seconds[i], "median": median})
+
+        if len(seconds) >= window * 2 and statistics.mean(seconds[:window]) > 0:
+            trends[procedure] = statistics.mean(seconds[-window:]) / statistics.mean(seconds[:window])
+
+    return flagged, trends
+
+
+def profile_log(entries: list[dict], max_gap=datetime.timedelta(hours=1), window=7, factor=2.0, calls=None):
+    steps = get_steps(entries, max_gap, calls)
+    daily_seconds = get_daily_seconds(steps)
+    flagged, trends = find_growing_days(daily_seconds, window, factor)
+
+    return {
+        "steps": steps,
+        "total_seconds": sum(step["seconds"] for step in steps),
+        "procedures": add_up(steps, lambda step: step["procedure"]),
+        "tables": add_up(steps, lambda step: (step["procedure"], step["table"], step["action"])),
+        "days": add_up(steps, lambda step: step["date"]),
+        "daily_seconds": daily_seconds,
+        "flagged_days": flagged,
+        "trends": trends,
+    }
+
+
+def format_seconds(seconds: float):
+    return str(datetime.timedelta(seconds=round(seconds)))
+
+
+def format_report(profile: dict, top=20):
+    total = profile["total_seconds"] or 1
+    lines = [f"Total: {format_seconds(profile['total_seconds'])} in {len(profile['steps'])} steps", "",
+             "Procedures:"]
+
+    for procedure, item in profile["procedures"].items():
+        lines.append(f"  {procedure:<40} {format_seconds(item['seconds']):>10} {item['seconds'] / total:>7.1%}"
+                     f" {item['count']:>8} steps")
+
+    lines += ["", f"Hottest {top} steps (procedure, table, action):"]
+
+    for (procedure, table, action), item in list(profile["tables"].items())[:top]:
+        lines.append(f"  {procedure + ' ' + table + ' ' + action:<80} {format_seconds(item['seconds']):>10}"
+                     f" {item['seconds'] / total:>7.1%} avg {item['seconds'] / item['count']:.3f}s")
+
+    days = [(day, item) for day, item in profile["days"].items() if day is not None]
+    lines += ["", f"Slowest {top} days:"]
+
+    for day, item in days[:top]:
+        lines.append(f"  {day}  {format_seconds(item['seconds']):>10}")
+
+    lines += ["", "Trend (mean of the last days / mean of the first days):"]
+
+    for procedure, trend in sorted(profile["trends"].items(), key=lambda item: -item[1]):
+        lines.append(f"  {procedure:<40} x{trend:.2f}")
+
+    lines += ["", f"Days that took much longer than the days before them: {len(profile['flagged_days'])}"]
+
+    for item in profile["flagged_days"][:top]:
+        lines.append(f"  {item['procedure']:<40} {item['date']}  {item['seconds']:.1f}s, median {item['median']:.1f}s")
+
+    return '\n'.join(lines)
+
+
+# Folded stacks for flame graphs, by_date adds the day as the last frame
+def write_folded(steps: list[dict], path: str, by_date=False):
+    stacks = {}
+
+    for step in steps:
+        frames = [step["procedure"], step["table"], step["action"]]
+
+        if by_date and step["date"] is not None:
+            frames.append(str(step["date"]))
+
+        stack = ';'.join(frame.replace(';', '_').replace(' ', '_') for frame in frames)
+        stacks[stack] = stacks.get(stack, 0) + step["seconds"] * 1000
+
+    with open(path, 'w') as file:
+        file.writelines(f"{stack} {round(milliseconds)}\n" for stack, milliseconds in stacks.items())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Timings of the etl steps from Warehouse.Log")
+    parser.add_argument("--file", help="csv export of Warehouse.Log, the server is read when it's not given")
+    parser.add_argument("--calls", help="calls file of orchestrator.py, to time the calls that ran at the same time")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--max-gap", type=float, default=3600, help="seconds between two runs of the etl")
+    parser.add_argument("--window", type=int, default=7, help="days that a day is compared with")
+    parser.add_argument("--factor", type=float, default=2.0, help="how much longer a flagged day takes")
+    parser.add_argument("--folded", help="folded stacks file for a flame graph")
+    parser.add_argument("--by-date", action="store_true", help="add the day to the folded stacks")
+    args = parser.parse_args()
+
+    entries = read_log_file(args.file) if args.file is not None else read_log_from_server()
+    calls = read_calls(args.calls) if args.calls is not None else None
+    profile = profile_log(entries, datetime.timedelta(seconds=args.max_gap), args.window, args.factor, calls)
+
+    print(format_report(profile, args.top))
+
+    if args.folded is not None:
+        write_folded(profile["steps"], args.folded, args.by_date)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+import cProfile
+import json
+import threading
+import time
+import tracemalloc
+
+# Run metrics of the generators and the loaders. It's off by default and the hot paths only check
+# a global for None, so it costs nothing when it's not enabled. When enabled it records:
+#   stages       wall time, rows, rows per second and optionally the tracemalloc peak and a cProfile of each stage
+#                that is written to profile_<stage>.prof
+#   batches      latency of every insert batch of each table with p50/p95/p99, rows per second and commits
+#   connections  time spent opening connections and waiting for a connection of the pool
+# A progress line is printed every progress_interval seconds while batches are inserted and
+# write_report saves everything as json at the end.
+#
+#   enable_metrics(trace_memory=True)
+#   with stage("generate_visits") as current:
+#       visits = generate_visits(doctors, patients)
+#       current.rows = len(visits)
+#   write_report("metrics.json")
+
+metrics = None
+
+
+class NullStage:
+    rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_STAGE = NullStage()
+
+
+# Stages can be nested or run in several threads, the tracemalloc peak is only reset by the outer stage and
+# only one stage is profiled at a time because cProfile can't be enabled twice
+class Stage:
+    def __init__(self, recorder, name: str):
+        self.recorder = recorder
+        self.name = name
+        self.rows = 0
+        self.profiler = None
+        self.started = None
+
+    def __enter__(self):
+        recorder = self.recorder
+
+        with recorder.lock:
+            if recorder.trace_memory:
+                if recorder.active_stages == 0:
+                    if not tracemalloc.is_tracing():
+                        tracemalloc.start()
+
+                    tracemalloc.reset_peak()
+
+            if recorder.profile and not recorder.profiling:
+                recorder.profiling = True
+                self.profiler = recorder.profilers.setdefault(self.name, cProfile.Profile())
+                self.profiler.enable()
+
+            recorder.active_stages += 1
+
+        self.started = time.perf_counter()
+
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.started
+        recorder = self.recorder
+
+        with recorder.lock:
+            recorder.active_stages -= 1
+
+            if self.profiler is not None:
+                self.profiler.disable()
+                recorder.profiling = False
+
+        peak = tracemalloc.get_traced_memory()[1] if recorder.trace_memory else None
+
+        recorder.add_stage(self.name, seconds, self.rows, peak)
+
+        return False
+
+
+def percentile(values: list, percent: int):
+    # Nearest rank of the sorted values
+    if len(values) == 0:
+        return None
+
+    values = sorted(values)
+
+    return values[max(0, -(-len(values) * percent // 100) - 1)]
+
+
+class Metrics:
+    def __init__(self, progress_interval=10.0, trace_memory=False, profile=False, profile_prefix="profile_"):
+        self.progress_interval = progress_interval
+        self.trace_memory = trace_memory
+        self.profile = profile
+        self.profile_prefix = profile_prefix
+
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.last_progress = self.started
+
+        # name -> {"runs", "seconds", "rows", "peak"}
+        self.stages = {}
+        # table -> {"rows", "commits", "latencies"}
+        self.tables = {}
+        self.connections = 0
+        self.connection_seconds = 0.0
+        self.connection_waits = 0
+        self.connection_wait_seconds = 0.0
+
+        self.active_stages = 0
+        self.profiling = False
+        # stage name -> cProfile of all the runs of the stage
+        self.profilers = {}
+
+    # A stage that runs several times (i.e. once for each chunk) is added up under its name
+    def add_stage(self, name: str, seconds: float, rows: int, peak):
+        with self.lock:
+            counters = self.stages.setdefault(name, {"runs": 0, "seconds": 0.0, "rows": 0, "peak": None})
+            counters["runs"] += 1
+            counters["seconds"] += seconds
+            counters["rows"] += rows
+
+            if peak is not None:
+                counters["peak"] = max(peak, counters["peak"] or 0)
+
+    def add_batch(self, table: str, rows: int, seconds: float):
+        with self.lock:
+            counters = self.tables.setdefault(table, {"rows": 0, "commits": 0, "latencies": []})
+            counters["rows"] += rows
+            counters["commits"] += 1
+            counters["latencies"].append(seconds)
+
+            now = time.perf_counter()
+
+            if now - self.last_progress < self.progress_interval:
+                return
+
+            self.last_progress = now
+            total = sum(item["rows"] for item in self.tables.values())
+
+        print(f"Progress: {total} rows inserted in {now - self.started:.0f}s, "
+              f"{total / (now - self.started):.0f} rows/s, last table {table}")
+
+    def add_connection(self, seconds: float):
+        with self.lock:
+            self.connections += 1
+            self.connection_seconds += seconds
+
+    def add_connection_wait(self, seconds: float):
+        with self.lock:
+            self.connection_waits += 1
+            self.connection_wait_seconds += seconds
+
+    def report(self):
+        with self.lock:
+            stages = {}
+
+            for name, counters in self.stages.items():
+                seconds = counters["seconds"]
+
+                stages[name] = {
+                    "runs": counters["runs"],
+                    "seconds": round(seconds, 4),
+                    "rows": counters["rows"],
+                    "rows_per_second": round(counters["rows"] / seconds, 1) if seconds > 0 else None,
+                    "peak_memory_mb": round(counters["peak"] / 1024 / 1024, 2) if counters["peak"] is not None
+                    else None,
+                }
+
+            tables = {}
+
+            for table, counters in self.tables.items():
+                latencies = counters["latencies"]
+                seconds = sum(latencies)
+
+                tables[table] = {
+                    "rows": counters["rows"],
+                    "batches": len(latencies),
+                    "commits": counters["commits"],
+                    "rows_per_second": round(counters["rows"] / seconds, 1) if seconds > 0 else None,
+                    "batch_seconds": {f"p{percent}": round(percentile(latencies, percent), 6)
+                                      for percent in (50, 95, 99)},
+                }
+
+            return {
+                "seconds": round(time.perf_counter() - self.started, 4),
+                "stages": stages,
+                "tables": tables,
+                "connections": {
+                    "opened": self.connections,
+                    "open_seconds": round(self.connection_seconds, 4),
+                    "pool_waits": self.connection_waits,
+                    "pool_wait_seconds": round(self.connection_wait_seconds, 4),
+                },
+            }
+
+
+def enable_metrics(progress_interval=10.0, trace_memory=False, profile=False, profile_prefix="profile_"):
+    global metrics
+
+    metrics = Metrics(progress_interval, trace_memory, profile, profile_prefix)
+
+    return metrics
+
+
+def disable_metrics():
+    global metrics
+
+    metrics = None
+
+
+def get_metrics():
+    return metrics
+
+
+# A stage of the run, returns a shared object that does nothing when metrics are not enabled
+def stage(name: str):
+    if metrics is None:
+        return NULL_STAGE
+
+    return Stage(metrics, name)
+
+
+def write_report(path: str):
+    if metrics is None:
+        return None
+
+    report = metrics.report()
+
+    for name, profiler in metrics.profilers.items():
+        profiler.dump_stats(f"{metrics.profile_prefix}{name}.prof")
+
+    with open(path, 'w') as file:
+        json.dump(report, file, indent=2)
+
+    print(f"Metrics are written to {path}")
+
+    return report
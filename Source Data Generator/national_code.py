@@ -0,0 +1,98 @@
+import random
+import numpy as np
+
+# National codes are 10 digits, the code space is split into two halves of 5 digits and mixed
+# with a small feistel network. The network is a permutation of 0 to 10^10 - 1, so passing a counter
+# through it gives unique codes that look random without keeping or searching the generated ones
+HALF = 100000
+CODE_SPACE = HALF * HALF
+ROUNDS = 4
+
+keys = []
+counter = 0
+
+# Codes that were not produced by the counter, i.e. the ones that already exist in the source database
+reserved_national_code = set()
+
+
+# The seed is taken from the random module when it's not given, so random.seed also fixes national codes.
+# start lets different processes use disjoint parts of the counter
+def reset_national_codes(seed=None, start=0):
+    global keys, counter
+
+    if seed is None:
+        seed = random.getrandbits(64)
+
+    rng = random.Random(seed)
+    keys = [(rng.randint(1, HALF - 1), rng.randint(0, HALF - 1)) for _ in range(ROUNDS)]
+    counter = start
+
+
+# Works both for a single int and for a numpy array of ints
+def permute(number):
+    left = number // HALF
+    right = number % HALF
+
+    for key, offset in keys:
+        left, right = right, (left + ((right * key + offset) ^ (right >> 3))) % HALF
+
+    return left * HALF + right
+
+
+def take_counter(count: int):
+    global counter
+
+    if len(keys) == 0:
+        reset_national_codes()
+
+    if counter + count > CODE_SPACE:
+        raise ValueError("All of the 10 digit national codes are used")
+
+    start = counter
+    counter += count
+
+    return start
+
+
+def allocate_national_code():
+    while True:
+        national_code = f'{permute(take_counter(1)):010d}'
+
+        if national_code not in reserved_national_code:
+            return national_code
+
+
+# Same as allocate_national_code but the codes are computed all together with numpy
+def allocate_national_codes(count: int):
+    national_codes = []
+
+    while len(national_codes) < count:
+        needed = count - len(national_codes)
+        start = take_counter(needed)
+
+        numbers = permute(np.arange(start, start + needed, dtype=np.int64))
+        codes = np.char.zfill(numbers.astype(str), 10).tolist()
+
+        if len(reserved_national_code) != 0:
+            codes = [code for code in codes if code not in reserved_national_code]
+
+        national_codes.extend(codes)
+
+    return national_codes
+
+
+# When new doctors or patients are appended to a filled source database, the codes that are already
+# there should be reserved first, otherwise the unique constraint of national_code may fail
+def reserve_existing_national_codes(cursor, database="source", schema="Health"):
+    for table in ("Doctor", "Patient"):
+        cursor.execute(f'select national_code from {database}.{schema}.{table}')
+
+        while True:
+            rows = cursor.fetchmany(100000)
+
+            if len(rows) == 0:
+                break
+
+            reserved_national_code.update(row[0] for row in rows)
+
+    return len(reserved_national_code)
@@ -0,0 +1,277 @@
+import argparse
+import datetime
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from metrics import stage
+from parallel_loader import create_connection_pool, close_connection_pool
+from scd_engine import update_dimension
+
+# Runs the etl of staging_area.sql and data_warehouse.sql instead of Cache.main and Warehouse.main.
+# The visit dates are split into windows of window_days days and each day-by-day procedure is called once
+# for each window. Windows of the procedures that only insert the rows of their own days run at the same
+# time over a pool of connections, the procedures that use shared temp tables or build on the previous
+# day (the cumulative Fact_Patient_Daily) run their windows one after another.
+# Every finished call is saved in a checkpoint file, so when a run fails the next run skips what's done
+# and continues with the same dates. The checkpoint is removed when the whole run is done.
+# The server times of the start and the end of every call are written to a calls file, log_profiler.py --calls
+# uses them to time the Warehouse.Log rows of the calls that ran at the same time.
+# After their first load, Dim_Doctor and Dim_Patient are updated by scd_engine.py instead of ins_dim_doctor and
+# ins_dim_patient, which truncate the dimensions and number the patient surrogate keys again.
+#
+#   python orchestrator.py --window-days 7 --workers 4
+
+CHECKPOINT_FILE = ".etl_checkpoint.json"
+CALLS_FILE = ".etl_calls.json"
+
+# Steps that run in python instead of a procedure, they are called with a cursor like the procedures
+PYTHON_STEPS = {
+    "scd_engine.update_dim_doctor": lambda cursor: update_dimension(cursor, "doctor"),
+    "scd_engine.update_dim_patient": lambda cursor: update_dimension(cursor, "patient"),
+}
+
+# Each phase runs after the previous phase is done: (procedures, dates, parallel)
+# dates is "cache" or "warehouse" for the procedures that get a window of days and None for the others,
+# procedures of a parallel phase and their windows run at the same time
+PHASES = [
+    (["staging.Cache.fill_department", "staging.Cache.fill_doctor", "staging.Cache.fill_patient"], None, True),
+    (["staging.Cache.fill_visit"], "cache", True),
+    # These copy from Cache.Visit, so they wait for all the windows of fill_visit
+    (["staging.Cache.fill_treatment", "staging.Cache.fill_medication", "staging.Cache.fill_billing"], "cache", True),
+    (["data_warehouse.Warehouse.ins_dim_department"], None, False),
+    (["dim_doctor", "dim_patient"], None, True),
+    (["data_warehouse.Warehouse.ins_dim_visit", "data_warehouse.Warehouse.ins_dim_treatment",
+      "data_warehouse.Warehouse.ins_dim_medication", "data_warehouse.Warehouse.ins_dim_billing"], "warehouse", True),
+    # These use the same temp tables in every call
+    (["data_warehouse.Warehouse.ins_fact_visit_transactional"], "warehouse", False),
+    # Every day is built from the day before it
+    (["data_warehouse.Warehouse.ins_fact_patient_daily"], "warehouse", False),
+    # Both use a temp_patients table
+    (["data_warehouse.Warehouse.ins_fact_patient_acc"], None, False),
+    (["data_warehouse.Warehouse.ins_fact_patient_doctor_factless"], None, False),
+]
+
+
+def query_date(cursor, sql: str):
+    cursor.execute(sql)
+    value = cursor.fetchone()[0]
+
+    if isinstance(value, datetime.datetime):
+        return value.date()
+
+    return value
+
+
+def next_day(day):
+    return day + datetime.timedelta(days=1) if day is not None else None
+
+
+# The dates and procedures of a new run, same as the beginning of Cache.main and Warehouse.main but
+# the last loaded day is not loaded again
+def plan_run(cursor, window_days: int):
+    source_start = query_date(cursor, "select min(visit_date) from source.Health.Visit")
+    source_end = query_date(cursor, "select max(visit_date) from source.Health.Visit")
+
+    cache_start = next_day(query_date(cursor, "select max(visit_date) from staging.Cache.Visit")) or source_start
+    warehouse_start = next_day(query_date(cursor, "select max(visit_date) from data_warehouse.Warehouse.Dim_Visit")) \
+        or source_start
+
+    # The first load of a dimension fills it and scd_engine keeps its history after that
+    procedures = {}
+
+    for name, table in (("dim_doctor", "Dim_Doctor"), ("dim_patient", "Dim_Patient")):
+        cursor.execute(f"select count(*) from data_warehouse.Warehouse.{table}")
+        first_load = cursor.fetchone()[0] == 0
+        procedures[name] = f"data_warehouse.Warehouse.first_load_{name}" if first_load else f"scd_engine.update_{name}"
+
+    return {
+        "dates": {
+            "cache": [str(cache_start), str(source_end)] if source_end is not None else None,
+            "warehouse": [str(warehouse_start), str(source_end)] if source_end is not None else None,
+        },
+        "procedures": procedures,
+        # The windows of a resumed run have to be the same as the failed run
+        "window_days": window_days,
+        "done": [],
+        "calls": [],
+    }
+
+
+def split_windows(start: datetime.date, end: datetime.date, window_days: int):
+    windows = []
+
+    while start <= end:
+        window_end = min(start + datetime.timedelta(days=window_days - 1), end)
+        windows.append((start, window_end))
+        start = window_end + datetime.timedelta(days=1)
+
+    return windows
+
+
+# Calls of a phase as (key, procedure, parameters), the key is saved in the checkpoint
+def get_calls(run: dict, procedures: list, dates, window_days: int):
+    calls = []
+
+    if dates is not None and run["dates"][dates] is None:
+        return calls
+
+    windows = split_windows(*(datetime.date.fromisoformat(day) for day in run["dates"][dates]), window_days) \
+        if dates is not None else [None]
+
+    for window in windows:
+        for procedure in procedures:
+            procedure = run["procedures"].get(procedure, procedure)
+
+            if window is None:
+                calls.append((procedure, procedure, ()))
+            else:
+                calls.append((f"{procedure} {window[0]} {window[1]}", procedure, window))
+
+    return calls
+
+
+def save_checkpoint(run: dict, path: str):
+    # Written to another file first, so a crash while writing doesn't break the checkpoint
+    with open(path + ".tmp", 'w') as file:
+        json.dump(run, file, indent=2)
+
+    os.replace(path + ".tmp", path)
+
+
+def call_procedure(cursor, procedure: str, parameters: tuple):
+    if procedure in PYTHON_STEPS:
+        PYTHON_STEPS[procedure](cursor)
+        return
+
+    placeholders = ', '.join('?' * len(parameters))
+    cursor.execute(f"execute {procedure} {placeholders}", *parameters)
+
+    # The procedure only runs to its end when all of its results are read
+    while cursor.nextset():
+        pass
+
+    cursor.commit()
+
+
+# The clock of the Warehouse.Log rows, so the calls can be compared with them
+def server_time(cursor):
+    cursor.execute("select getdate()")
+
+    return cursor.fetchone()[0]
+
+
+# Runs a call and gives its procedure, window and server times for the calls file
+def run_call(pool, key: str, procedure: str, parameters: tuple):
+    cursor = pool.get()
+
+    try:
+        started = time.perf_counter()
+        started_at = server_time(cursor)
+
+        with stage(procedure.split('.')[-1]):
+            call_procedure(cursor, procedure, parameters)
+
+        print(f"{key}: done in {time.perf_counter() - started:.1f}s")
+
+        return {
+            "procedure": procedure.split('.')[-1],
+            "window": [str(day) for day in parameters] or None,
+            "started_at": started_at.isoformat(),
+            "finished_at": server_time(cursor).isoformat(),
+        }
+    finally:
+        pool.put(cursor)
+
+
+def run_phase(pool, run: dict, calls: list, parallel: bool, workers: int, checkpoint: str):
+    calls = [call for call in calls if call[0] not in run["done"]]
+
+    def finish(key, timing: dict):
+        run["done"].append(key)
+        run["calls"].append(timing)
+        save_checkpoint(run, checkpoint)
+
+    if not parallel:
+        for call in calls:
+            finish(call[0], run_call(pool, *call))
+
+        return
+
+    with ThreadPoolExecutor(workers) as executor:
+        running = {executor.submit(run_call, pool, *call): call[0] for call in calls}
+        error = None
+
+        # The calls that already started can't be stopped on the server, so they are waited for and saved
+        while len(running) != 0:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                key = running.pop(future)
+
+                if future.cancelled():
+                    continue
+
+                if future.exception() is not None:
+                    if error is None:
+                        error = future.exception()
+
+                        for other in running:
+                            other.cancel()
+                else:
+                    finish(key, future.result())
+
+            running = {future: key for future, key in running.items() if not future.cancelled()}
+
+        if error is not None:
+            raise error
+
+
+def run_etl(window_days=7, workers=4, checkpoint=CHECKPOINT_FILE, restart=False, calls_file=CALLS_FILE):
+    pool = create_connection_pool(workers)
+
+    try:
+        if os.path.exists(checkpoint) and not restart:
+            with open(checkpoint, 'r') as file:
+                run = json.load(file)
+
+            # Checkpoints of older runs have no times of their calls
+            run.setdefault("calls", [])
+
+            print(f"Resuming the run of {checkpoint}, {len(run['done'])} calls are already done")
+        else:
+            cursor = pool.get()
+            run = plan_run(cursor, window_days)
+            pool.put(cursor)
+
+            save_checkpoint(run, checkpoint)
+
+        print(f"Cache dates: {run['dates']['cache']}, warehouse dates: {run['dates']['warehouse']}")
+
+        for procedures, dates, parallel in PHASES:
+            run_phase(pool, run, get_calls(run, procedures, dates, run["window_days"]), parallel, workers,
+                      checkpoint)
+
+        with open(calls_file, 'w') as file:
+            json.dump(run["calls"], file, indent=2)
+
+        os.remove(checkpoint)
+        print(f"Etl is done, the times of the calls are in {calls_file}")
+    finally:
+        close_connection_pool(pool)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the staging and warehouse etl in windows of days")
+    parser.add_argument("--window-days", type=int, default=7)
+    parser.add_argument("--workers", type=int, default=4, help="number of connections")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE)
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint of a failed run")
+    parser.add_argument("--calls", default=CALLS_FILE, help="file of the server times of the calls")
+    args = parser.parse_args()
+
+    run_etl(args.window_days, args.workers, args.checkpoint, args.restart, args.calls)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import os
+import random
+from collections import deque
+from itertools import islice
+from math import ceil
+from multiprocessing import Pool
+import numpy as np
+from columnar_generator import generate_visit_columns, generate_treatment_columns, generate_medication_columns, \
+    generate_billing_columns
+
+# Patients are split into shards with a fixed size and each shard is generated in a worker process.
+# The shards and their seeds only depend on the master seed and the shard size, not on the number of workers,
+# so the merged output is exactly the same with 1 or 64 workers.
+# Each shard has its own range of ids, a shard never has more treatments, medications or billings than visits,
+# so all of its ids start from its first visit id and the ranges never overlap (treatment and medication ids
+# have gaps between the shards)
+
+shard_data = {}
+
+
+def init_worker(departments: list[dict], doctors: list[dict], patients: list[dict], visit_per_patient: int,
+                patients_per_shard: int, master_seed: int):
+    shard_data.update(departments=departments, doctors=doctors, patients=patients,
+                      visit_per_patient=visit_per_patient, patients_per_shard=patients_per_shard,
+                      master_seed=master_seed)
+
+
+def get_shard_rng(master_seed: int, shard: int):
+    return np.random.default_rng(np.random.SeedSequence([master_seed, shard]))
+
+
+def generate_shard(shard: int):
+    patients_per_shard = shard_data["patients_per_shard"]
+    visit_per_patient = shard_data["visit_per_patient"]
+
+    start = shard * patients_per_shard
+    patients = shard_data["patients"][start:start + patients_per_shard]
+    first_id = start * visit_per_patient + 1
+
+    rng = get_shard_rng(shard_data["master_seed"], shard)
+
+    visits = generate_visit_columns(shard_data["doctors"], patients, visit_per_patient, rng, first_id)
+    treatments = generate_treatment_columns(visits, shard_data["departments"], rng, first_id)
+    medications = generate_medication_columns(treatments, visits, rng, first_id)
+    billings = generate_billing_columns(visits, treatments, medications, rng, first_id)
+
+    return [("Visit", visits), ("Treatment", treatments), ("Medication", medications), ("Billing", billings)]
+
+
+# Yields the shards in order like stream_generator.generate_chunks, so stream_tables works with both.
+# At most shards_per_worker shards of each worker are generated or waiting for the sink, so the workers wait
+# when the sink is slower and the memory stays bounded. Without a master seed a new one is drawn from the
+# random module
+def generate_shards(departments: list[dict], doctors: list[dict], patients: list[dict], visit_per_patient=100,
+                    patients_per_shard=1000, master_seed=None, workers=None, shards_per_worker=2):
+    if master_seed is None:
+        master_seed = random.getrandbits(64)
+
+    shards = iter(range(ceil(len(patients) / patients_per_shard)))
+    init_args = (departments, doctors, patients, visit_per_patient, patients_per_shard, master_seed)
+    in_flight = (workers or os.cpu_count() or 1) * shards_per_worker
+
+    with Pool(workers, initializer=init_worker, initargs=init_args) as pool:
+        pending = deque(pool.apply_async(generate_shard, (shard,)) for shard in islice(shards, in_flight))
+
+        while len(pending) != 0:
+            shard = pending.popleft().get()
+
+            # The next shard is started before this one goes to the sink
+            for next_shard in islice(shards, 1):
+                pending.append(pool.apply_async(generate_shard, (next_shard,)))
+
+            yield shard
@@ -0,0 +1,125 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from queue import Queue
+from common import connect_to_sql_server, insert_batches
+from metrics import get_metrics
+
+# Foreign keys of the source.Health tables in source.sql, a table is loaded after the tables it references.
+# Tables that don't depend on each other are loaded at the same time and each table is split into
+# slices of rows (continuous ranges of the primary key for the generated tables) that are loaded in parallel,
+# every worker uses its own connection from the pool. pyodbc releases the GIL while the server works,
+# so threads are enough.
+DEPENDENCIES = {
+    "Department": [],
+    "Doctor": ["Department"],
+    "Patient": [],
+    "Visit": ["Patient", "Doctor"],
+    "Treatment": ["Visit", "Department"],
+    "Medication": ["Visit"],
+    "Billing": ["Visit"],
+}
+
+
+def create_connection_pool(size: int):
+    pool = Queue()
+
+    for _ in range(size):
+        cursor = connect_to_sql_server()
+        cursor.fast_executemany = True
+        pool.put(cursor)
+
+    return pool
+
+
+def close_connection_pool(pool: Queue):
+    while not pool.empty():
+        pool.get().close()
+
+
+# Records are a list or a dict of columns
+def split_records(records, slices: int):
+    size = len(next(iter(records.values()))) if isinstance(records, dict) else len(records)
+    step = max(1, -(-size // slices))
+
+    for start in range(0, size, step):
+        if isinstance(records, dict):
+            yield {name: column[start:start + step] for name, column in records.items()}
+        else:
+            yield records[start:start + step]
+
+
+def load_slice(pool: Queue, table: str, records, database: str, schema: str, batch_size: int, quiet: bool):
+    recorder = get_metrics()
+    started = time.perf_counter()
+
+    cursor = pool.get()
+
+    if recorder is not None:
+        recorder.add_connection_wait(time.perf_counter() - started)
+
+    try:
+        return insert_batches(cursor, table, records, database, schema, batch_size, quiet)
+    finally:
+        pool.put(cursor)
+
+
+# Same data as bulk_insert_into, but every table should be complete (not a stream of chunks)
+def parallel_insert_into(data: list[tuple[str, list | dict]], database="source", schema="Health", workers=4,
+                         slices=4, batch_size=10000, quiet=False):
+    tables = dict(data)
+    pool = create_connection_pool(workers)
+    print(f"Connected to Sql Server with {workers} connections...")
+
+    # table -> number of slices that are not loaded yet
+    remaining = {}
+    loaded = set()
+    running = {}
+
+    def is_ready(table):
+        return all(dependency in loaded or dependency not in tables for dependency in DEPENDENCIES.get(table, []))
+
+    try:
+        with ThreadPoolExecutor(workers) as executor:
+            while len(loaded) != len(tables):
+                for table in tables:
+                    if table not in remaining and is_ready(table):
+                        parts = list(split_records(tables[table], slices))
+                        remaining[table] = len(parts)
+
+                        for part in parts:
+                            future = executor.submit(load_slice, pool, table, part, database, schema, batch_size,
+                                                     quiet)
+                            running[future] = table
+
+                        if len(parts) == 0:
+                            loaded.add(table)
+
+                # The last tables can be empty, they are loaded without any slice
+                if len(loaded) == len(tables):
+                    break
+
+                if len(running) == 0:
+                    raise ValueError("The tables that are left depend on each other: " + ', '.join(
+                        table for table in tables if table not in loaded))
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    table = running.pop(future)
+
+                    # An error stops the load, the slices that are not started are cancelled
+                    if future.exception() is not None:
+                        for other in running:
+                            other.cancel()
+
+                        raise future.exception()
+
+                    remaining[table] -= 1
+
+                    if remaining[table] == 0:
+                        loaded.add(table)
+
+                        if not quiet:
+                            print(f"{table} is loaded")
+    finally:
+        close_connection_pool(pool)
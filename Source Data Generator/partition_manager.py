@@ -0,0 +1,139 @@
+import datetime
+from common import connect_to_sql_server, insert_batches
+
+# Fact_Patient_Daily is partitioned by time_key with the DayPartition function (range left), so the partition
+# of a boundary has the days after the previous boundary until the boundary itself.
+# Instead of a boundary for every day from 2020 to 2050, only a window of partitions is kept: the recent periods
+# and a few upcoming ones. New boundaries are added with SPLIT RANGE before their days are loaded and
+# the boundaries that are older than the window are removed with MERGE RANGE, so their rows end up in
+# the first partition. A period is a day by default but it can be a week or a month.
+
+PARTITION_FUNCTION = "DayPartition"
+PARTITION_SCHEME = "DayPartitionScheme"
+STAGE_TABLE = "Fact_Patient_Daily_Stage"
+
+
+# Last day of the period of the day, which is the boundary of the partition of the day
+def period_end(day: datetime.date, granularity="day"):
+    if granularity == "day":
+        return day
+    elif granularity == "week":
+        # weeks end on Sunday
+        return day + datetime.timedelta(days=6 - day.weekday())
+    elif granularity == "month":
+        next_month = day.replace(day=28) + datetime.timedelta(days=4)
+        return next_month - datetime.timedelta(days=next_month.day)
+
+    raise ValueError(f"Unknown granularity: {granularity}")
+
+
+def next_period_end(boundary: datetime.date, granularity="day"):
+    return period_end(boundary + datetime.timedelta(days=1), granularity)
+
+
+def previous_period_end(boundary: datetime.date, granularity="day"):
+    period_start = boundary.replace(day=1) if granularity == "month" else boundary - datetime.timedelta(
+        days=6 if granularity == "week" else 0)
+
+    return period_start - datetime.timedelta(days=1)
+
+
+# Boundaries of the last keep periods until today and ahead periods after it
+def get_window_boundaries(today: datetime.date, granularity="day", keep=30, ahead=7):
+    boundary = period_end(today, granularity)
+
+    for _ in range(keep - 1):
+        boundary = previous_period_end(boundary, granularity)
+
+    boundaries = [boundary]
+
+    for _ in range(keep - 1 + ahead):
+        boundaries.append(next_period_end(boundaries[-1], granularity))
+
+    return boundaries
+
+
+def get_boundaries(cursor):
+    cursor.execute("select cast(prv.value as date) "
+                   "from data_warehouse.sys.partition_range_values as prv "
+                   "inner join data_warehouse.sys.partition_functions as pf on (prv.function_id = pf.function_id) "
+                   f"where pf.name = '{PARTITION_FUNCTION}' "
+                   "order by prv.boundary_id")
+
+    return [row[0] for row in cursor.fetchall()]
+
+
+def create_partition_function(cursor, boundaries: list[datetime.date]):
+    values = ', '.join(f"'{boundary.isoformat()}'" for boundary in boundaries)
+    sql = f"use data_warehouse; create partition function {PARTITION_FUNCTION} (date) " \
+          f"as range left for values ({values})"
+
+    print(sql)
+    cursor.execute(sql)
+    cursor.commit()
+
+
+def split_range(cursor, boundary: datetime.date):
+    cursor.execute(f"use data_warehouse; alter partition scheme {PARTITION_SCHEME} next used [PRIMARY]; "
+                   f"alter partition function {PARTITION_FUNCTION}() split range ('{boundary.isoformat()}')")
+    cursor.commit()
+
+
+def merge_range(cursor, boundary: datetime.date):
+    cursor.execute(f"use data_warehouse; "
+                   f"alter partition function {PARTITION_FUNCTION}() merge range ('{boundary.isoformat()}')")
+    cursor.commit()
+
+
+# Adds the missing boundaries of the window and merges the ones before it, returns the added and merged boundaries
+def slide_window(cursor, today=None, granularity="day", keep=30, ahead=7):
+    window = get_window_boundaries(today or datetime.date.today(), granularity, keep, ahead)
+    existing = get_boundaries(cursor)
+
+    added = [boundary for boundary in window if boundary not in existing]
+    merged = [boundary for boundary in existing if boundary < window[0]]
+
+    for boundary in added:
+        split_range(cursor, boundary)
+
+    for boundary in merged:
+        merge_range(cursor, boundary)
+
+    return added, merged
+
+
+# The rows of one day of Fact_Patient_Daily are inserted into an empty staging table with the same columns
+# and switched into the partition of the day, switching only changes metadata. The day and the day before it
+# are made boundaries, so the partition only has the day and it should not be loaded before
+def switch_in_day(cursor, day: datetime.date, rows, batch_size=10000):
+    existing = get_boundaries(cursor)
+
+    for boundary in (day - datetime.timedelta(days=1), day):
+        if boundary not in existing:
+            split_range(cursor, boundary)
+
+    cursor.execute(f"drop table if exists data_warehouse.Warehouse.{STAGE_TABLE}")
+    cursor.execute(f"select * into data_warehouse.Warehouse.{STAGE_TABLE} "
+                   f"from data_warehouse.Warehouse.Fact_Patient_Daily where 1 = 0")
+    # The check constraint proves to sql server that every row belongs to the partition
+    cursor.execute(f"alter table data_warehouse.Warehouse.{STAGE_TABLE} with check add constraint "
+                   f"{STAGE_TABLE}_day check (time_key = '{day.isoformat()}')")
+    cursor.commit()
+
+    count = insert_batches(cursor, "Fact_Patient_Daily", rows, "data_warehouse", "Warehouse", batch_size, True,
+                           STAGE_TABLE)
+
+    cursor.execute(f"use data_warehouse; alter table Warehouse.{STAGE_TABLE} switch to Warehouse.Fact_Patient_Daily "
+                   f"partition $PARTITION.{PARTITION_FUNCTION}('{day.isoformat()}')")
+    cursor.execute(f"drop table data_warehouse.Warehouse.{STAGE_TABLE}")
+    cursor.commit()
+
+    return count
+
+
+if __name__ == '__main__':
+    # Run it every day before the daily load, i.e. from a scheduled job
+    added, merged = slide_window(connect_to_sql_server())
+
+    print("Added boundaries: ", [boundary.isoformat() for boundary in added])
+    print("Merged boundaries: ", [boundary.isoformat() for boundary in merged])
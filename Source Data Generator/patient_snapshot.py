@@ -0,0 +1,381 @@
+import argparse
+import datetime
+import numpy as np
+from common import connect_to_sql_server, insert_batches
+from partition_manager import switch_in_day
+
+# Builds Fact_Patient_Daily and Fact_Patient_ACC in python instead of ins_fact_patient_daily and
+# ins_fact_patient_acc, which build seven temp tables for every day. Dim_Visit is read once and every
+# measure of a block of days is a matrix of days x patients: the visits of each day are added up with
+# bincount, the totals are the cumulative sum over the days plus the totals of the day before the block,
+# and the current treatment and medication are carried forward from the last visit with a treatment.
+# The result is the same as the procedures with two differences on purpose:
+#   - every current patient gets a row each day, the procedure drops patients that have no row for the
+#     day before under their current surrogate key (new patients and patients whose phone changed)
+#   - a patient whose visits have no treatment gets 0 treatment and medication cost in Fact_Patient_ACC,
+#     the procedure inserts null and fails
+# --verify compares the result with the rows that the procedure made instead of loading it.
+#
+#   python patient_snapshot.py --switch
+
+# Measures that are added up, in the order of the Fact_Patient_Daily columns
+MEASURES = ["total_visits", "total_treatments", "total_medications", "total_cost", "total_insurance_coverage",
+            "total_paid"]
+COUNT_MEASURES = 3
+
+# current_treatment_type and current_medication_name of a patient without any treatment yet
+NO_VALUE = '-1'
+
+
+def fetch_all(cursor, batch_size=100000):
+    rows = []
+
+    while True:
+        batch = cursor.fetchmany(batch_size)
+
+        if len(batch) == 0:
+            return rows
+
+        rows.extend(batch)
+
+
+def to_day(value):
+    return value.date() if isinstance(value, datetime.datetime) else value
+
+
+# Visits of the days from start_date to end_date sorted by patient and date, the rows are turned to numpy
+# columns, a null id is a visit without treatment or medication and a null cost is 0
+def read_visits(cursor, start_date: datetime.date, end_date: datetime.date):
+    cursor.execute("select visit_id, visit_date, patient_id, is_check_up, treatment_id, treatment_type, "
+                   "medication_id, medication_name, total_amount, insurance_coverage, paid_amount, visit_cost, "
+                   "treatment_cost, medication_cost from data_warehouse.Warehouse.Dim_Visit "
+                   "where visit_date >= ? and visit_date < ? order by patient_id, visit_date, visit_id",
+                   start_date, end_date + datetime.timedelta(days=1))
+
+    rows = fetch_all(cursor)
+    columns = list(zip(*rows)) if len(rows) != 0 else [[] for _ in range(14)]
+
+    def numbers(values):
+        return np.array([0.0 if value is None else float(value) for value in values])
+
+    return {
+        "visit_id": np.array(columns[0], dtype=np.int64),
+        "visit_date": np.array([to_day(value) for value in columns[1]], dtype='datetime64[D]'),
+        "patient_id": np.array(columns[2], dtype=np.int64),
+        "is_check_up": np.array(columns[3], dtype=bool),
+        "has_treatment": np.array([value is not None for value in columns[4]], dtype=bool),
+        "treatment_type": np.array(columns[5], dtype=object),
+        "has_medication": np.array([value is not None for value in columns[6]], dtype=bool),
+        "medication_name": np.array(columns[7], dtype=object),
+        "total_amount": numbers(columns[8]),
+        "insurance_coverage": numbers(columns[9]),
+        "paid_amount": numbers(columns[10]),
+        "visit_cost": numbers(columns[11]),
+        "treatment_cost": numbers(columns[12]),
+        "medication_cost": numbers(columns[13]),
+    }
+
+
+# Current rows of Dim_Patient sorted by patient_id
+def read_patients(cursor):
+    cursor.execute("select patient_surrogate_key, patient_id, dob from data_warehouse.Warehouse.Dim_Patient "
+                   "where phone_current_flag = 1 order by patient_id")
+    rows = fetch_all(cursor)
+
+    return {
+        "patient_surrogate_key": np.array([row[0] for row in rows], dtype=np.int64),
+        "patient_id": np.array([row[1] for row in rows], dtype=np.int64),
+        "dob": np.array([to_day(row[2]) for row in rows], dtype='datetime64[D]'),
+    }
+
+
+# Position of each patient id in the sorted patient ids, -1 for the ids that are not there
+def get_patient_index(patient_ids, ids):
+    index = np.searchsorted(patient_ids, ids)
+    index = np.minimum(index, len(patient_ids) - 1)
+
+    return np.where((len(patient_ids) != 0) & (patient_ids[index] == ids), index, -1)
+
+
+# What is carried from a day to the next one: the totals and the current treatment and medication
+def create_state(patients: dict):
+    size = len(patients["patient_id"])
+
+    return {
+        "totals": np.zeros((len(MEASURES), size)),
+        "treatment_type": np.full(size, NO_VALUE, dtype=object),
+        "medication_name": np.full(size, NO_VALUE, dtype=object),
+    }
+
+
+# The state of the day before day from Fact_Patient_Daily, the rows are matched by patient_id so
+# the patients whose surrogate key changed keep their totals
+def read_state(cursor, patients: dict, day: datetime.date):
+    state = create_state(patients)
+
+    cursor.execute(f"select dp.patient_id, {', '.join('f.' + measure for measure in MEASURES)}, "
+                   "f.current_treatment_type, f.current_medication_name "
+                   "from data_warehouse.Warehouse.Fact_Patient_Daily as f "
+                   "inner join data_warehouse.Warehouse.Dim_Patient as dp "
+                   "on (f.patient_surrogate_key = dp.patient_surrogate_key) where f.time_key = ?",
+                   day - datetime.timedelta(days=1))
+
+    for row in fetch_all(cursor):
+        index = get_patient_index(patients["patient_id"], np.array([row[0]]))[0]
+
+        if index != -1:
+            state["totals"][:, index] = [float(value) for value in row[1:1 + len(MEASURES)]]
+            state["treatment_type"][index] = row[-2]
+            state["medication_name"][index] = row[-1]
+
+    return state
+
+
+# Fills every day that has no value (mask is False) with the value of the day before it,
+# the days before the first value get carry
+def forward_fill(values, mask, carry):
+    days, size = values.shape
+
+    index = np.where(mask, np.arange(days)[:, None], -1)
+    index = np.maximum.accumulate(index, axis=0)
+
+    return np.where(index >= 0, values[np.maximum(index, 0), np.arange(size)], carry[None, :])
+
+
+# Yields (day, columns of Fact_Patient_Daily) for every day from start_date to end_date, state is the state of
+# the day before start_date and is moved forward to end_date
+def build_patient_daily(visits: dict, patients: dict, start_date: datetime.date, end_date: datetime.date,
+                        state: dict, days_per_block=31):
+    size = len(patients["patient_id"])
+    total_days = (end_date - start_date).days + 1
+
+    patient_index = get_patient_index(patients["patient_id"], visits["patient_id"])
+    day_index = (visits["visit_date"] - np.datetime64(start_date, 'D')).astype(np.int64)
+
+    # Visits of the patients that are not current anymore and outside the days are skipped,
+    # the rest is sorted by day so each block is a slice
+    keep = (patient_index != -1) & (day_index >= 0) & (day_index < total_days)
+    order = np.argsort(day_index[keep], kind='stable')
+    selected = np.flatnonzero(keep)[order]
+    day_index = day_index[selected]
+    patient_index = patient_index[selected]
+
+    weights = [np.ones(len(selected)), visits["has_treatment"][selected], visits["has_medication"][selected],
+               visits["total_amount"][selected], visits["insurance_coverage"][selected],
+               visits["paid_amount"][selected]]
+
+    # The current treatment comes from the last visit of the day that is not a checkup and has a treatment
+    with_treatment = ~visits["is_check_up"][selected] & visits["has_treatment"][selected]
+
+    for block_start in range(0, total_days, days_per_block):
+        days = min(days_per_block, total_days - block_start)
+        first, last = np.searchsorted(day_index, [block_start, block_start + days])
+        flat = (day_index[first:last] - block_start) * size + patient_index[first:last]
+
+        daily = np.stack([np.bincount(flat, weight[first:last], days * size).reshape(days, size)
+                          for weight in weights])
+        totals = np.cumsum(daily, axis=1) + state["totals"][:, None, :]
+        state["totals"] = totals[:, -1, :].copy()
+
+        treatment = np.flatnonzero(with_treatment[first:last])
+        treatment = treatment[np.lexsort((visits["visit_id"][selected[first:last]][treatment], flat[treatment]))]
+        treatment_flat = flat[treatment]
+
+        # The last visit of each patient and day, a block can have no visits with a treatment
+        is_last = np.ones(len(treatment), dtype=bool)
+        is_last[:-1] = treatment_flat[1:] != treatment_flat[:-1]
+        treatment = treatment[is_last]
+        treatment_flat = flat[treatment]
+        treatment_visits = selected[first:last][treatment]
+
+        types = np.full(days * size, None, dtype=object)
+        medications = np.full(days * size, None, dtype=object)
+        types[treatment_flat] = visits["treatment_type"][treatment_visits]
+        medications[treatment_flat] = visits["medication_name"][treatment_visits]
+
+        types = forward_fill(types.reshape(days, size), (types != None).reshape(days, size),
+                             state["treatment_type"])
+        medications = forward_fill(medications.reshape(days, size), (medications != None).reshape(days, size),
+                                   state["medication_name"])
+        state["treatment_type"] = types[-1].copy()
+        state["medication_name"] = medications[-1].copy()
+
+        for i in range(days):
+            day = start_date + datetime.timedelta(days=block_start + i)
+            columns = {"patient_surrogate_key": patients["patient_surrogate_key"],
+                       "time_key": np.full(size, np.datetime64(day, 'D'))}
+
+            for j, measure in enumerate(MEASURES):
+                columns[measure] = totals[j, i].astype(np.int64) if j < COUNT_MEASURES else totals[j, i]
+
+            columns["current_treatment_type"] = types[i]
+            columns["current_medication_name"] = medications[i]
+
+            yield day, columns
+
+
+# Visit, treatment and medication costs of each patient and whether the patient has any visit
+def sum_costs(visits: dict, patients: dict):
+    size = len(patients["patient_id"])
+    patient_index = get_patient_index(patients["patient_id"], visits["patient_id"])
+    keep = patient_index != -1
+
+    costs = {name: np.bincount(patient_index[keep], visits[name][keep], size)
+             for name in ("visit_cost", "treatment_cost", "medication_cost")}
+    costs["has_visits"] = np.bincount(patient_index[keep], minlength=size) != 0
+
+    return costs
+
+
+def read_costs(cursor, patients: dict):
+    size = len(patients["patient_id"])
+    costs = {name: np.zeros(size) for name in ("visit_cost", "treatment_cost", "medication_cost")}
+    costs["has_visits"] = np.zeros(size, dtype=bool)
+
+    cursor.execute("select patient_id, sum(visit_cost), sum(isnull(treatment_cost, 0)), "
+                   "sum(isnull(medication_cost, 0)) from data_warehouse.Warehouse.Dim_Visit group by patient_id")
+    rows = fetch_all(cursor)
+
+    if len(rows) != 0:
+        index = get_patient_index(patients["patient_id"], np.array([row[0] for row in rows]))
+        keep = index != -1
+
+        for i, name in enumerate(("visit_cost", "treatment_cost", "medication_cost")):
+            costs[name][index[keep]] = np.array([float(row[i + 1]) for row in rows])[keep]
+
+        costs["has_visits"][index[keep]] = True
+
+    return costs
+
+
+# Age in years on today, same as the datediff of ins_fact_patient_acc
+def get_ages(dob, today: datetime.date):
+    years = today.year - 1970 - dob.astype('datetime64[Y]').astype(np.int64)
+    months = dob.astype('datetime64[M]') + (years * 12).astype('timedelta64[M]')
+    birthdays = months.astype('datetime64[D]') + (dob - dob.astype('datetime64[M]').astype('datetime64[D]'))
+
+    # dateadd keeps a february 29 birthday on february 28 of the other years
+    last_days = (months + np.timedelta64(1, 'M')).astype('datetime64[D]') - np.timedelta64(1, 'D')
+    birthdays = np.minimum(birthdays, last_days)
+
+    return years - (birthdays > np.datetime64(today, 'D'))
+
+
+# Fact_Patient_ACC from the state of the last day, only the patients with visits are in it
+def build_patient_acc(patients: dict, state: dict, costs: dict, today: datetime.date):
+    keep = costs["has_visits"]
+
+    columns = {"patient_surrogate_key": patients["patient_surrogate_key"][keep]}
+
+    for j, measure in enumerate(MEASURES):
+        columns[measure] = state["totals"][j][keep].astype(np.int64) if j < COUNT_MEASURES else \
+            state["totals"][j][keep]
+
+    columns["total_visits_cost"] = costs["visit_cost"][keep]
+    columns["total_treatments_cost"] = costs["treatment_cost"][keep]
+    columns["total_medications_cost"] = costs["medication_cost"][keep]
+    columns["current_treatment_type"] = state["treatment_type"][keep]
+    columns["current_medication_name"] = state["medication_name"][keep]
+    columns["patient_age"] = get_ages(patients["dob"][keep], today)
+
+    return columns
+
+
+# Rows that differ between the builder and Fact_Patient_Daily, costs are compared to the 4th decimal
+def compare_with_server(cursor, days, tolerance=0.01):
+    differences = []
+    names = ["patient_surrogate_key", *MEASURES, "current_treatment_type", "current_medication_name"]
+
+    for day, columns in days:
+        cursor.execute(f"select {', '.join(names)} from data_warehouse.Warehouse.Fact_Patient_Daily "
+                       "where time_key = ?", day)
+        expected = {row[0]: row for row in fetch_all(cursor)}
+        built = list(zip(*(columns[name].tolist() for name in names)))
+
+        for row in built:
+            other = expected.pop(row[0], None)
+
+            if other is None:
+                differences.append((day, row[0], "only in the builder"))
+            elif any(abs(float(a) - float(b)) > tolerance for a, b in zip(row[1:7], other[1:7])) or \
+                    tuple(row[7:]) != tuple(other[7:]):
+                differences.append((day, row[0], f"builder {row[1:]}, procedure {tuple(other[1:])}"))
+
+        differences.extend((day, key, "only in the procedure") for key in expected)
+
+    return differences
+
+
+def load_patient_daily(cursor, days, switch=False, batch_size=10000):
+    count = 0
+
+    for day, columns in days:
+        if switch:
+            count += switch_in_day(cursor, day, columns, batch_size)
+        else:
+            count += insert_batches(cursor, "Fact_Patient_Daily", columns, "data_warehouse", "Warehouse", batch_size,
+                                    True)
+
+        print(f"Fact_Patient_Daily {day}: {count} rows inserted")
+
+    return count
+
+
+def load_patient_acc(cursor, columns: dict, batch_size=10000):
+    cursor.execute("truncate table data_warehouse.Warehouse.Fact_Patient_ACC")
+    cursor.commit()
+
+    return insert_batches(cursor, "Fact_Patient_ACC", columns, "data_warehouse", "Warehouse", batch_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds Fact_Patient_Daily and Fact_Patient_ACC from Dim_Visit")
+    parser.add_argument("--start", type=datetime.date.fromisoformat,
+                        help="first day, the day after the last day of Fact_Patient_Daily by default")
+    parser.add_argument("--end", type=datetime.date.fromisoformat, help="last day, the last visit by default")
+    parser.add_argument("--switch", action="store_true", help="load each day with partition_manager.switch_in_day")
+    parser.add_argument("--verify", action="store_true", help="compare with Fact_Patient_Daily instead of loading")
+    parser.add_argument("--days-per-block", type=int, default=31)
+    args = parser.parse_args()
+
+    cursor = connect_to_sql_server()
+    cursor.execute("select min(visit_date), max(visit_date) from data_warehouse.Warehouse.Dim_Visit")
+    first_visit, last_visit = (to_day(value) for value in cursor.fetchone())
+
+    start_date = args.start
+
+    if start_date is None:
+        cursor.execute("select max(time_key) from data_warehouse.Warehouse.Fact_Patient_Daily")
+        last_day = to_day(cursor.fetchone()[0])
+        start_date = last_day + datetime.timedelta(days=1) if last_day is not None and not args.verify \
+            else first_visit
+
+    end_date = args.end or last_visit
+
+    patients = read_patients(cursor)
+    first_build = start_date <= first_visit
+    state = create_state(patients) if first_build else read_state(cursor, patients, start_date)
+
+    visits = read_visits(cursor, start_date, end_date)
+    days = build_patient_daily(visits, patients, start_date, end_date, state, args.days_per_block)
+
+    if args.verify:
+        differences = compare_with_server(cursor, days)
+
+        for difference in differences[:100]:
+            print(*difference)
+
+        print(f"{len(differences)} differences")
+        return
+
+    load_patient_daily(cursor, days, args.switch)
+
+    # The costs of all the visits are needed, they are only read here when the visits start from the first day
+    costs = sum_costs(visits, patients) if first_build else read_costs(cursor, patients)
+    load_patient_acc(cursor, build_patient_acc(patients, state, costs, datetime.date.today()))
+
+    cursor.close()
+
+
+if __name__ == '__main__':
+    main()
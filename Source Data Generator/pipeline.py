@@ -0,0 +1,182 @@
+import threading
+import time
+from queue import Queue, Full, Empty
+from common import connect_to_sql_server, insert_batches
+from parallel_loader import DEPENDENCIES
+
+# The generator runs in the main thread and puts every (table, records) of its data into a bounded queue,
+# loader threads take them from the queue and insert them, so generating and inserting happen at the same time.
+# When the queue is full the generator waits for the loaders and when it's empty the loaders wait for the
+# generator, these waits are measured to show which side is the bottleneck.
+# With more than one loader, a part of a table is only inserted after the parts of the tables it depends on
+# that came before it, so the foreign keys are never violated.
+# If either side fails, the other side stops and the error is raised.
+
+STOP = None
+
+
+class PipelineStopped(Exception):
+    pass
+
+
+def run_pipeline(data, database="source", schema="Health", callback=None, loaders=1, queue_depth=4,
+                 batch_size=10000, quiet=False):
+    queue = Queue(queue_depth)
+    failed = threading.Event()
+    errors = []
+
+    # sequence numbers of the parts that are not inserted yet for each table
+    pending = {}
+    condition = threading.Condition()
+
+    stats = {
+        "generator": {"busy": 0.0, "stalled": 0.0, "parts": 0},
+        "loaders": [{"busy": 0.0, "stalled": 0.0, "waiting_for_dependencies": 0.0, "parts": 0, "rows": 0}
+                    for _ in range(loaders)],
+    }
+
+    def wait_for_dependencies(table, sequence):
+        def is_ready():
+            return failed.is_set() or all(
+                min(pending.get(dependency, [sequence]), default=sequence) >= sequence
+                for dependency in DEPENDENCIES.get(table, []))
+
+        with condition:
+            condition.wait_for(is_ready)
+
+        if failed.is_set():
+            raise PipelineStopped()
+
+    def load(index):
+        loader_stats = stats["loaders"][index]
+        cursor = None
+
+        try:
+            cursor = connect_to_sql_server()
+            cursor.fast_executemany = True
+
+            while True:
+                started = time.perf_counter()
+                item = queue.get()
+                loader_stats["stalled"] += time.perf_counter() - started
+
+                if item is STOP:
+                    break
+
+                sequence, table, records = item
+
+                started = time.perf_counter()
+                wait_for_dependencies(table, sequence)
+                loader_stats["waiting_for_dependencies"] += time.perf_counter() - started
+
+                started = time.perf_counter()
+                loader_stats["rows"] += insert_batches(cursor, table, records, database, schema, batch_size, quiet)
+                loader_stats["busy"] += time.perf_counter() - started
+                loader_stats["parts"] += 1
+
+                with condition:
+                    pending[table].remove(sequence)
+                    condition.notify_all()
+        except PipelineStopped:
+            pass
+        except Exception as error:
+            errors.append(error)
+            failed.set()
+
+            with condition:
+                condition.notify_all()
+        finally:
+            if cursor is not None:
+                cursor.close()
+
+    def put(item):
+        started = time.perf_counter()
+
+        # The timeout lets the generator notice a failed loader instead of waiting forever on a full queue
+        while True:
+            if failed.is_set():
+                raise PipelineStopped()
+
+            try:
+                queue.put(item, timeout=0.1)
+                break
+            except Full:
+                continue
+
+        stats["generator"]["stalled"] += time.perf_counter() - started
+
+    threads = [threading.Thread(target=load, args=(i,), daemon=True) for i in range(loaders)]
+
+    for thread in threads:
+        thread.start()
+
+    print(f"Pipeline started with {loaders} loaders...")
+
+    try:
+        data = iter(data)
+        sequence = 0
+
+        while True:
+            started = time.perf_counter()
+            item = next(data, STOP)
+            stats["generator"]["busy"] += time.perf_counter() - started
+
+            if item is STOP:
+                break
+
+            table, records = item
+
+            with condition:
+                pending.setdefault(table, []).append(sequence)
+
+            put((sequence, table, records))
+            stats["generator"]["parts"] += 1
+            sequence += 1
+    except PipelineStopped:
+        pass
+    except Exception:
+        failed.set()
+
+        with condition:
+            condition.notify_all()
+
+        raise
+    finally:
+        # Loaders that are stuck on a full queue are released by draining it when something failed
+        for _ in threads:
+            while True:
+                try:
+                    queue.put(STOP, timeout=0.1)
+                    break
+                except Full:
+                    if failed.is_set():
+                        try:
+                            queue.get_nowait()
+                        except Empty:
+                            pass
+
+        for thread in threads:
+            thread.join()
+
+    if len(errors) != 0:
+        raise errors[0]
+
+    if callback is not None:
+        cursor = connect_to_sql_server()
+        callback(cursor)
+        cursor.close()
+
+    print_stats(stats)
+
+    return stats
+
+
+def print_stats(stats: dict):
+    generator = stats["generator"]
+    print(f"Generator: {generator['parts']} parts, busy {generator['busy']:.2f}s, "
+          f"waited for loaders {generator['stalled']:.2f}s")
+
+    for i, loader in enumerate(stats["loaders"]):
+        print(f"Loader {i + 1}: {loader['parts']} parts, {loader['rows']} rows, busy {loader['busy']:.2f}s, "
+              f"waited for generator {loader['stalled']:.2f}s, "
+              f"waited for dependencies {loader['waiting_for_dependencies']:.2f}s")
@@ -0,0 +1,387 @@
+import argparse
+import datetime
+import decimal
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from random import seed
+import numpy as np
+from common import connect_to_sql_server, insert_batches
+from data_generator import get_departments, generate_doctors, generate_patients
+from local_database import SqliteCursor, create_sqlite_schema
+from metrics import percentile
+from national_code import reset_national_codes
+from patient_snapshot import create_state, build_patient_daily, build_patient_acc, sum_costs
+from scale_factor import get_scale, get_patient_rounds, generate_scaled_chunks
+from time_generator import build_time_dimension
+
+# A fixed set of analytic queries over the star schema of data_warehouse.sql that is run with a number of
+# concurrent connections, each query is run repeat times and its latency percentiles, the throughput of the
+# whole workload and a checksum of its result are reported as json. With a baseline file the run fails when
+# a query got slower than the threshold allows or returns another result, so the effect of an index or
+# a schema change can be checked.
+# The queries run on sql server or on a local sqlite stand-in of the warehouse that is built from the scaled
+# generator (look at scale_factor.py) the same way the etl builds it, so it works offline.
+#
+#   python query_workload.py --target sqlite --scale-factor 0.05 --concurrency 4 --output workload.json
+#   python query_workload.py --target sqlite --setup indexes.sql --baseline workload.json
+
+LOCAL_DATABASE = ".workload.db"
+
+# Queries that take less time than this are too noisy to compare their speed
+MIN_SECONDS = 0.005
+
+# The sql is the same on sql server and sqlite, SqliteCursor drops the database and schema of the names
+QUERIES = {
+    "revenue_by_department_quarter": """
+        select d.department_name, t.persian_calendar_year, t.persian_calendar_quarter, count(*),
+               sum(f.total_cost), sum(f.total_insurance_coverage), sum(f.total_paid)
+        from data_warehouse.Warehouse.Fact_Visit_Transactional as f
+                 inner join data_warehouse.Warehouse.Dim_Time as t on (f.time_key = t.time_key)
+                 inner join data_warehouse.Warehouse.Dim_Department as d on (f.department_id = d.department_id)
+        group by d.department_name, t.persian_calendar_year, t.persian_calendar_quarter
+        order by d.department_name, t.persian_calendar_year, t.persian_calendar_quarter""",
+    "patients_per_doctor": """
+        select doc.doctor_id, doc.current_specialization, doc.department_name, count(*)
+        from data_warehouse.Warehouse.Fact_Patient_Doctor_Factless as f
+                 inner join data_warehouse.Warehouse.Dim_Doctor as doc on (f.doctor_id = doc.doctor_id)
+        group by doc.doctor_id, doc.current_specialization, doc.department_name
+        order by doc.doctor_id""",
+    "doctor_visits_by_weekday": """
+        select f.doctor_id, t.persian_day_name_of_week, count(*), count(distinct f.patient_surrogate_key),
+               sum(f.total_treatment_cost)
+        from data_warehouse.Warehouse.Fact_Visit_Transactional as f
+                 inner join data_warehouse.Warehouse.Dim_Time as t on (f.time_key = t.time_key)
+        group by f.doctor_id, t.persian_day_name_of_week
+        order by f.doctor_id, t.persian_day_name_of_week""",
+    # Every 50th patient, the snapshot is cumulative so the last day of each month is its max
+    "patient_cost_trajectory": """
+        select f.patient_surrogate_key, t.persian_calendar_year, t.persian_month_number_of_year,
+               max(f.total_visits), max(f.total_cost), max(f.total_paid)
+        from data_warehouse.Warehouse.Fact_Patient_Daily as f
+                 inner join data_warehouse.Warehouse.Dim_Time as t on (f.time_key = t.time_key)
+        where f.patient_surrogate_key % 50 = 0
+        group by f.patient_surrogate_key, t.persian_calendar_year, t.persian_month_number_of_year
+        order by f.patient_surrogate_key, t.persian_calendar_year, t.persian_month_number_of_year""",
+    "cost_by_age": """
+        select patient_age, count(*), sum(total_visits), sum(total_cost), sum(total_treatments_cost),
+               sum(total_medications_cost)
+        from data_warehouse.Warehouse.Fact_Patient_ACC
+        group by patient_age
+        order by patient_age""",
+}
+
+
+# Visits joined with their treatment, medication and billing like Dim_Visit, with the columns that
+# patient_snapshot.read_visits makes
+def join_visit_columns(visits: dict, treatments: dict, medications: dict, billings: dict):
+    first_visit_id = visits["visit_id"][0]
+    size = len(visits["visit_id"])
+
+    def by_visit(table: dict, column: str, ids=False):
+        values = np.full(size, None, dtype=object) if ids else np.zeros(size)
+        values[table["visit_id"] - first_visit_id] = table[column]
+
+        return values
+
+    treatment_id = by_visit(treatments, "treatment_id", True)
+    medication_id = by_visit(medications, "medication_id", True)
+
+    return {
+        "visit_id": visits["visit_id"],
+        "visit_date": visits["visit_date"],
+        "patient_id": visits["patient_id"],
+        "doctor_id": visits["doctor_id"],
+        "is_check_up": visits["is_check_up"] != 0,
+        "treatment_id": treatment_id,
+        "has_treatment": treatment_id != None,
+        "treatment_type": by_visit(treatments, "treatment_type", True),
+        "medication_id": medication_id,
+        "has_medication": medication_id != None,
+        "medication_name": by_visit(medications, "medication_name", True),
+        "billing_id": by_visit(billings, "billing_id", True),
+        "total_amount": by_visit(billings, "total_amount"),
+        "insurance_coverage": by_visit(billings, "insurance_coverage"),
+        "paid_amount": by_visit(billings, "paid_amount"),
+        "visit_cost": visits["visit_cost"],
+        "treatment_cost": by_visit(treatments, "treatment_cost"),
+        "medication_cost": by_visit(medications, "medication_cost"),
+    }
+
+
+def get_gender(gender):
+    # Same as Cache.convert_gender
+    return 'men' if gender else 'woman'
+
+
+# Fills the warehouse tables the queries use from one generated chunk, every patient has one current row
+# in Dim_Patient and the facts are the same as the etl procedures make them
+def load_local_warehouse(cursor, departments: list[dict], doctors: list[dict], patients: list[dict], chunk: list):
+    visits = join_visit_columns(*(records for _, records in chunk))
+    first_date = visits["visit_date"].min().astype(datetime.date)
+    last_date = visits["visit_date"].max().astype(datetime.date)
+
+    department_names = {department["department_id"]: department["department_name"] for department in departments}
+    patients = sorted(patients, key=lambda patient: patient["patient_id"])
+    patient_columns = {
+        "patient_surrogate_key": np.arange(1, len(patients) + 1),
+        "patient_id": np.array([patient["patient_id"] for patient in patients]),
+        "dob": np.array([patient["dob"] for patient in patients], dtype='datetime64[D]'),
+    }
+
+    surrogate_keys = np.zeros(patient_columns["patient_id"].max() + 1, dtype=np.int64)
+    surrogate_keys[patient_columns["patient_id"]] = patient_columns["patient_surrogate_key"]
+    visit_surrogate_keys = surrogate_keys[visits["patient_id"]]
+    doctor_departments = {doctor["doctor_id"]: doctor["department_id"] for doctor in doctors}
+
+    tables = [
+        ("Dim_Time", build_time_dimension(first_date, last_date)),
+        ("Dim_Department", [(department["department_id"], department["department_name"])
+                            for department in departments]),
+        ("Dim_Doctor", [(doctor["doctor_id"], doctor["national_code"], doctor["firstname"], doctor["lastname"],
+                         get_gender(doctor["gender"]), doctor["phone"], None, doctor["specializations"], None,
+                         doctor["department_id"], department_names[doctor["department_id"]]) for doctor in doctors]),
+        ("Dim_Patient", [(key, patient["patient_id"], patient["national_code"], patient["firstname"],
+                          patient["lastname"], patient["dob"], get_gender(patient["gender"]), patient["phone"],
+                          first_date, None, True) for key, patient in enumerate(patients, 1)]),
+        ("Fact_Visit_Transactional", {
+            "visit_id": visits["visit_id"],
+            "patient_surrogate_key": visit_surrogate_keys,
+            "department_id": np.array([doctor_departments[doctor_id] for doctor_id in visits["doctor_id"].tolist()]),
+            "doctor_id": visits["doctor_id"],
+            "treatment_id": visits["treatment_id"],
+            "medication_id": visits["medication_id"],
+            "billing_id": visits["billing_id"],
+            "time_key": visits["visit_date"],
+            "total_cost": visits["total_amount"],
+            "total_insurance_coverage": visits["insurance_coverage"],
+            "total_paid": visits["paid_amount"],
+            "total_medication_cost": visits["medication_cost"],
+            "total_treatment_cost": visits["treatment_cost"],
+        }),
+        ("Fact_Patient_Doctor_Factless", sorted(set(zip(visit_surrogate_keys.tolist(),
+                                                        visits["doctor_id"].tolist())))),
+    ]
+
+    rows = sum(insert_batches(cursor, table, records, "data_warehouse", "Warehouse", quiet=True)
+               for table, records in tables)
+
+    state = create_state(patient_columns)
+
+    for _, columns in build_patient_daily(visits, patient_columns, first_date, last_date, state):
+        rows += insert_batches(cursor, "Fact_Patient_Daily", columns, "data_warehouse", "Warehouse", quiet=True)
+
+    acc = build_patient_acc(patient_columns, state, sum_costs(visits, patient_columns), last_date)
+    rows += insert_batches(cursor, "Fact_Patient_ACC", acc, "data_warehouse", "Warehouse", quiet=True)
+
+    return rows
+
+
+def build_local_database(path: str, scale_factor: float, random_seed=0):
+    seed(random_seed)
+    reset_national_codes(random_seed)
+
+    departments = get_departments()
+    doctors = generate_doctors(departments)
+    scale = get_scale(scale_factor, doctor_skew=1.0, patient_skew=0.5, weekday_curve="clinic", season_curve="flu")
+    patients = generate_patients(get_patient_rounds(scale))[:scale["patients"]]
+    chunk = next(generate_scaled_chunks(departments, doctors, patients, scale, len(patients),
+                                        np.random.default_rng(random_seed)))
+
+    if os.path.exists(path):
+        os.remove(path)
+
+    connection = sqlite3.connect(path)
+    create_sqlite_schema(connection)
+    cursor = SqliteCursor(connection)
+
+    started = time.perf_counter()
+    rows = load_local_warehouse(cursor, departments, doctors, patients, chunk)
+    print(f"{path}: {rows} rows of scale factor {scale_factor} loaded in {time.perf_counter() - started:.1f}s",
+          file=sys.stderr)
+
+    cursor.close()
+    connection.close()
+
+
+def get_cursor_factory(target: str, path: str):
+    if target == "sqlite":
+        return lambda: SqliteCursor(sqlite3.connect(path, check_same_thread=False))
+
+    return connect_to_sql_server
+
+
+# Runs the statements of a sql file that are separated by ;, i.e. the indexes to measure
+def run_setup(cursor, path: str):
+    with open(path, 'r') as file:
+        statements = [statement.strip() for statement in file.read().split(';')]
+
+    for statement in statements:
+        if statement:
+            cursor.execute(statement)
+
+    cursor.commit()
+
+
+def normalize(value):
+    # Sums depend on the order of the rows and sql server adds decimals up exactly
+    if isinstance(value, (float, decimal.Decimal)):
+        return float(f"{float(value):.9g}")
+    elif isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()[:10]
+
+    return value
+
+
+# The result is the same on both engines when the numbers are rounded to 9 digits and the dates are iso strings
+def get_checksum(rows: list):
+    normalized = sorted(tuple(normalize(value) for value in row) for row in rows)
+
+    return hashlib.sha256(repr(normalized).encode()).hexdigest()[:16]
+
+
+def run_query(cursor, sql: str):
+    started = time.perf_counter()
+    cursor.execute(sql)
+    rows = cursor.fetchall()
+
+    return time.perf_counter() - started, rows
+
+
+# Every query runs once on one connection to warm the cache and get its result, then the repeats of all the
+# queries are run by concurrency connections at the same time
+def run_workload(create_cursor, queries: dict, concurrency=4, repeat=5):
+    local = threading.local()
+    cursors = []
+    lock = threading.Lock()
+
+    def get_cursor():
+        if not hasattr(local, "cursor"):
+            local.cursor = create_cursor()
+
+            with lock:
+                cursors.append(local.cursor)
+
+        return local.cursor
+
+    results = {}
+    cursor = create_cursor()
+
+    for name, sql in queries.items():
+        _, rows = run_query(cursor, sql)
+        results[name] = {"rows": len(rows), "checksum": get_checksum(rows), "latencies": []}
+
+    cursor.close()
+
+    def run(name):
+        seconds, _ = run_query(get_cursor(), queries[name])
+
+        with lock:
+            results[name]["latencies"].append(seconds)
+
+    started = time.perf_counter()
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        for future in [executor.submit(run, name) for _ in range(repeat) for name in queries]:
+            future.result()
+
+    seconds = time.perf_counter() - started
+
+    for cursor in cursors:
+        cursor.close()
+
+    report = {}
+
+    for name, result in results.items():
+        latencies = result.pop("latencies")
+
+        report[name] = dict(result, runs=len(latencies), mean=round(sum(latencies) / len(latencies), 6),
+                            **{f"p{percent}": round(percentile(latencies, percent), 6) for percent in (50, 95, 99)})
+
+    return {
+        "seconds": round(seconds, 4),
+        "queries_per_second": round(len(queries) * repeat / seconds, 2),
+        "queries": report,
+    }
+
+
+# A query regresses when its p95 grew by more than the threshold or its result changed
+def compare(report: dict, baseline: dict, threshold: float):
+    regressions = []
+
+    for name, result in report["queries"].items():
+        previous = baseline["queries"].get(name)
+
+        if previous is None:
+            continue
+
+        if result["checksum"] != previous["checksum"]:
+            regressions.append(f"{name}: the result changed ({previous['rows']} rows -> {result['rows']} rows)")
+
+        if max(result["p95"], previous["p95"]) >= MIN_SECONDS and result["p95"] > previous["p95"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {previous['p95']:.4f}s -> {result['p95']:.4f}s")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analytic query workload over the warehouse star schema")
+    parser.add_argument("--target", choices=["sqlite", "server"], default="sqlite")
+    parser.add_argument("--database", default=LOCAL_DATABASE, help="sqlite file of the local warehouse")
+    parser.add_argument("--scale-factor", type=float, default=0.05, help="scale of a new local warehouse")
+    parser.add_argument("--rebuild", action="store_true", help="build the local warehouse again")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", nargs="+", choices=QUERIES, default=list(QUERIES))
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=5, help="runs of each query")
+    parser.add_argument("--setup", help="sql file that runs before the workload, i.e. create index statements")
+    parser.add_argument("--output", help="json file of the report, it's printed when not given")
+    parser.add_argument("--baseline", help="report of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown of the p95")
+    args = parser.parse_args()
+
+    if args.target == "sqlite" and (args.rebuild or not os.path.exists(args.database)):
+        build_local_database(args.database, args.scale_factor, args.seed)
+
+    create_cursor = get_cursor_factory(args.target, args.database)
+
+    if args.setup is not None:
+        cursor = create_cursor()
+        run_setup(cursor, args.setup)
+        cursor.close()
+
+    report = {
+        "created_at": datetime.datetime.now().isoformat(timespec='seconds'),
+        "target": args.target,
+        "concurrency": args.concurrency,
+        "repeat": args.repeat,
+        **run_workload(create_cursor, {name: QUERIES[name] for name in args.queries}, args.concurrency,
+                       args.repeat),
+    }
+
+    text = json.dumps(report, indent=2)
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            file.write(text)
+    else:
+        print(text)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as file:
+            regressions = compare(report, json.load(file), args.threshold)
+
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
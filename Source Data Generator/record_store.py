@@ -0,0 +1,188 @@
+import datetime
+import sys
+from array import array
+from itertools import repeat
+from schema import TABLES, parse_type
+
+# Compact tables for the dict generators of data_generator.py. A list of a million visit dicts keeps the
+# column names and a python object for every value, RecordTable keeps each column in a typed array instead:
+#   int, decimal and bit columns   array of 'q', 'd' and 'b'
+#   date and datetime columns      array of date ordinals, read back as the 'yyyy-mm-dd' strings the generators use
+#   nvarchar columns               category codes, every distinct string is kept once (interned)
+#   prefix columns                 only the length of a prefix of a shared text, i.e. the lorem ipsum diagnosis
+# The generators still append dicts and read records with record["column"], a record is a small object with
+# the table and the index that reads the arrays, so the loaders and billing_join don't change.
+# Only use it for the tables with repeated values, a unique nvarchar column (national_code) would keep
+# every value in the category list anyway.
+#
+#   visits = RecordTable("Visit", {"diagnosis": Prefix(lorem_ipsum)})
+#   visits.append({"visit_id": 1, ...})
+#   visits[0]["visit_date"]
+
+
+class Prefix:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class Category:
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def encode(self, value):
+        code = self.codes.get(value)
+
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(sys.intern(value) if isinstance(value, str) else value)
+
+        return code
+
+
+def get_kind(sql_type: str):
+    name, _, _ = parse_type(sql_type)
+
+    if name == "decimal":
+        return 'd'
+    elif name == "bit":
+        return 'b'
+    elif name in ("date", "datetime"):
+        return "date"
+    elif name == "nvarchar":
+        return "category"
+
+    return 'q'
+
+
+# A column is (kind, array, extra), extra is the category or the prefix text of the column
+def create_column(kind):
+    if isinstance(kind, Prefix):
+        return "prefix", array('I'), kind.text
+    elif kind == "category":
+        return kind, array('I'), Category()
+    elif kind == "date":
+        return kind, array('i'), None
+
+    return kind, array(kind), None
+
+
+def get_prefix(text: str, length: int):
+    return text[:length]
+
+
+def get_date(ordinal: int):
+    return datetime.date.fromordinal(ordinal).isoformat()
+
+
+class Record:
+    __slots__ = ("table", "index")
+
+    def __init__(self, table, index: int):
+        self.table = table
+        self.index = index
+
+    def __getitem__(self, name: str):
+        return self.table.get_value(name, self.index)
+
+    def __contains__(self, name: str):
+        return name in self.table.columns
+
+    def get(self, name: str, default=None):
+        return self[name] if name in self.table.columns else default
+
+    def keys(self):
+        return self.table.columns.keys()
+
+    def values(self):
+        return [self[name] for name in self.table.columns]
+
+    def items(self):
+        return [(name, self[name]) for name in self.table.columns]
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class RecordTable:
+    # kinds overrides the kind of the columns that come from the sql types of the table,
+    # a kind is an array typecode, "date", "category" or a Prefix
+    def __init__(self, table: str, kinds=None, columns=None):
+        self.table = table
+        self.kinds = kinds or {}
+
+        if columns is None:
+            columns = {name: create_column(self.kinds.get(name, get_kind(sql_type)))
+                       for name, sql_type in TABLES[table]}
+
+        self.columns = columns
+
+    def append(self, record: dict):
+        for name, (kind, values, extra) in self.columns.items():
+            value = record[name]
+
+            if kind == "category":
+                values.append(extra.encode(value))
+            elif kind == "prefix":
+                values.append(len(value))
+            elif kind == "date":
+                values.append(datetime.date.fromisoformat(value).toordinal() if isinstance(value, str)
+                              else value.toordinal())
+            else:
+                values.append(value)
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+        return self
+
+    def get_value(self, name: str, index: int):
+        kind, values, extra = self.columns[name]
+
+        if kind == "category":
+            return extra.values[values[index]]
+        elif kind == "prefix":
+            return get_prefix(extra, values[index])
+        elif kind == "date":
+            return get_date(values[index])
+
+        return values[index]
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()))[1])
+
+    # A slice is another table with its own arrays and the same categories, parallel_loader slices the tables
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return RecordTable(self.table, self.kinds, {name: (kind, values[index], extra)
+                                                        for name, (kind, values, extra) in self.columns.items()})
+
+        if index < 0:
+            index += len(self)
+
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+
+        return Record(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield Record(self, index)
+
+    # Tuples of the values in the column order without making records, schema.to_rows reads the tables this way
+    def rows(self):
+        readers = []
+
+        for kind, values, extra in self.columns.values():
+            if kind == "category":
+                readers.append(map(extra.values.__getitem__, values))
+            elif kind == "prefix":
+                readers.append(map(get_prefix, repeat(extra), values))
+            elif kind == "date":
+                readers.append(map(get_date, values))
+            else:
+                readers.append(values)
+
+        return zip(*readers)
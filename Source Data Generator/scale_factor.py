@@ -0,0 +1,136 @@
+import math
+import numpy as np
+from columnar_generator import get_rng, count_rows, make_visit_columns, generate_treatment_columns, \
+    generate_medication_columns, generate_billing_columns
+
+# A single scale factor like the TPC benchmarks instead of the size of the name lists, the rounds of
+# generate_patients and visit_per_patient. Scale factor 1 is 10,000 patients and 1 million visits, the number
+# of patients and visits grows linearly with it and the doctors and departments stay the same (they come
+# from the json files). The number of visits and billings is exactly the same for a scale factor,
+# treatments and medications only depend on the seed.
+# The distributions make some doctors, patients and days much busier than the others:
+#   doctor_skew, patient_skew  exponent of a zipf distribution over the doctors and patients, 0 is uniform and
+#                              1 gives the most popular one about ten times the visits of the 10th one
+#   weekday_curve              relative number of visits of each day of the week, from monday to sunday
+#   season_curve               relative number of visits of each month
+#   checkup_ratio              share of the visits that are checkups and have no treatment
+#
+#   scale = get_scale(10, doctor_skew=1.0, patient_skew=0.5, weekday_curve="clinic", season_curve="flu")
+#   patients = generate_patients(get_patient_rounds(scale))
+#   chunks = generate_scaled_chunks(departments, doctors, patients, scale)
+
+PATIENTS_PER_SCALE = 10000
+# generate_patients makes this many patients in each round
+PATIENTS_PER_ROUND = 10000
+
+# The days of the week are from monday, friday is the weekend and thursday is a half day in Iran
+# and saturday is the busiest day after it
+WEEKDAY_CURVES = {
+    "flat": [1, 1, 1, 1, 1, 1, 1],
+    "clinic": [1.1, 1.0, 1.0, 0.6, 0.1, 1.3, 1.2],
+}
+
+# Winter has the most visits and the nowruz holidays at the end of march the least
+SEASON_CURVES = {
+    "flat": [1] * 12,
+    "flu": [1.3, 1.25, 0.7, 0.85, 0.9, 0.85, 0.85, 0.9, 1.0, 1.1, 1.2, 1.3],
+}
+
+
+def get_curve(curve, curves: dict, size: int):
+    values = np.array(curves[curve] if isinstance(curve, str) else curve, dtype=float)
+
+    if len(values) != size or (values < 0).any() or values.sum() == 0:
+        raise ValueError(f"A curve needs {size} weights that are not negative and not all 0, got {curve}")
+
+    return values
+
+
+def get_scale(scale_factor: float, doctor_skew=0.0, patient_skew=0.0, weekday_curve="flat", season_curve="flat",
+              checkup_ratio=0.1, visit_per_patient=100, start_year=2021, end_year=2023):
+    if scale_factor <= 0:
+        raise ValueError("The scale factor should be more than 0")
+
+    if not 0 <= checkup_ratio <= 1:
+        raise ValueError("The checkup ratio should be between 0 and 1")
+
+    patients = max(1, round(scale_factor * PATIENTS_PER_SCALE))
+
+    return {
+        "scale_factor": scale_factor,
+        "patients": patients,
+        "visits": patients * visit_per_patient,
+        "doctor_skew": doctor_skew,
+        "patient_skew": patient_skew,
+        "weekday_curve": get_curve(weekday_curve, WEEKDAY_CURVES, 7),
+        "season_curve": get_curve(season_curve, SEASON_CURVES, 12),
+        "checkup_ratio": checkup_ratio,
+        "start_year": start_year,
+        "end_year": end_year,
+    }
+
+
+def get_patient_rounds(scale: dict):
+    return math.ceil(scale["patients"] / PATIENTS_PER_ROUND)
+
+
+# Probability of each item when the popularity ranks follow zipf, the ranks are shuffled so the popular
+# items are not always the first ids
+def get_zipf_weights(size: int, skew: float, rng):
+    weights = 1.0 / np.arange(1, size + 1) ** skew
+
+    return rng.permutation(weights / weights.sum())
+
+
+# Every day from the first day of start_year to the last day of end_year and its probability
+def get_day_weights(scale: dict):
+    days = np.arange(np.datetime64(f"{scale['start_year']}-01-01"), np.datetime64(f"{scale['end_year'] + 1}-01-01"))
+
+    # 1970-01-01 was a thursday
+    weekdays = (days.astype(np.int64) + 3) % 7
+    months = days.astype('datetime64[M]').astype(np.int64) % 12
+
+    weights = scale["weekday_curve"][weekdays] * scale["season_curve"][months]
+
+    return days, weights / weights.sum()
+
+
+# Yields the visits, treatments, medications and billings of patients_per_chunk patients at a time like
+# stream_generator.generate_chunks, the visits of all patients add up to the visits of the scale
+def generate_scaled_chunks(departments: list[dict], doctors: list[dict], patients: list[dict], scale: dict,
+                           patients_per_chunk=1000, rng=None):
+    rng = get_rng(rng)
+
+    if len(patients) < scale["patients"]:
+        raise ValueError(f"The scale needs {scale['patients']} patients, generate_patients made {len(patients)}")
+
+    patient_ids = np.array([patient["patient_id"] for patient in patients[:scale["patients"]]])
+    visit_counts = rng.multinomial(scale["visits"], get_zipf_weights(len(patient_ids), scale["patient_skew"], rng))
+    doctor_weights = get_zipf_weights(len(doctors), scale["doctor_skew"], rng)
+    days, day_weights = get_day_weights(scale)
+
+    visit_id = 1
+    treatment_id = 1
+    medication_id = 1
+    billing_id = 1
+
+    for start in range(0, len(patient_ids), patients_per_chunk):
+        patient_id = np.repeat(patient_ids[start:start + patients_per_chunk],
+                               visit_counts[start:start + patients_per_chunk])
+
+        # With a big skew some chunks only have patients without any visit
+        if len(patient_id) == 0:
+            continue
+
+        visits = make_visit_columns(doctors, patient_id, lambda size: rng.choice(days, size, p=day_weights), rng,
+                                    visit_id, scale["checkup_ratio"], doctor_weights)
+        treatments = generate_treatment_columns(visits, departments, rng, treatment_id)
+        medications = generate_medication_columns(treatments, visits, rng, medication_id)
+        billings = generate_billing_columns(visits, treatments, medications, rng, billing_id)
+
+        visit_id += count_rows(visits)
+        treatment_id += count_rows(treatments)
+        medication_id += count_rows(medications)
+        billing_id += count_rows(billings)
+
+        yield [("Visit", visits), ("Treatment", treatments), ("Medication", medications), ("Billing", billings)]
@@ -0,0 +1,206 @@
+import argparse
+import datetime
+import hashlib
+from common import connect_to_sql_server, get_input_sizes
+from schema import column_names, get_converters, to_rows
+
+# Keeps Dim_Patient and Dim_Doctor up to date with staging.Cache without ins_dim_patient and ins_dim_doctor,
+# which fill four or five temp tables, join staging and the dimension column by column and then truncate and
+# insert the whole dimension. The truncate also numbers the patient surrogate keys again and drops the rows
+# of the old phones, so the facts point to other patients after each run.
+# Here the current row of every business key is kept as two hashes, one of the tracked columns and one of
+# the overwritten (type 1) columns. Every staging row is compared with them once, and only the changes
+# are sent to the server in batches:
+#   Dim_Patient  phone is type 2: the current row gets phone_end_date and phone_current_flag = 0 and a new row
+#                is inserted with phone_start_date, the surrogate keys of the other rows stay the same
+#   Dim_Doctor   specialization is type 3 as in data_warehouse.sql: original_specialization gets the last
+#                specialization and specialization_effective_date is the day of the change
+# The other columns are overwritten in all the rows of the business key. New business keys are inserted.
+# orchestrator.py runs it for every load after the first load of the dimensions. Don't call ins_dim_patient
+# and ins_dim_doctor (or Warehouse.main) on the same warehouse after that, they number the keys again.
+#
+#   python scd_engine.py --dry-run
+
+# select of the current rows: surrogate key (the business key for Dim_Doctor), business key, tracked columns and
+# overwritten columns, the staging select has the same columns without the surrogate key, tracked is the number
+# of tracked columns
+DIMENSIONS = {
+    "patient": {
+        "current": "select patient_surrogate_key, patient_id, phone, national_code, firstname, lastname, dob, gender "
+                   "from data_warehouse.Warehouse.Dim_Patient where phone_current_flag = 1",
+        "staging": "select patient_id, phone, national_code, firstname, lastname, dob, gender "
+                   "from staging.Cache.Patient",
+        "tracked": 1,
+    },
+    "doctor": {
+        "current": "select doctor_id, doctor_id, current_specialization, national_code, firstname, lastname, gender, "
+                   "phone, department_id, department_name from data_warehouse.Warehouse.Dim_Doctor",
+        "staging": "select doctor_id, specialization, national_code, firstname, lastname, gender, phone, "
+                   "department_id, department_name from staging.Cache.Doctor",
+        "tracked": 1,
+    },
+}
+
+
+def normalize(value):
+    if value is None:
+        return '\0'
+    elif isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()[:10]
+
+    return str(value)
+
+
+def get_hash(values):
+    return hashlib.blake2b('\x1f'.join(map(normalize, values)).encode(), digest_size=8).digest()
+
+
+# business key -> (surrogate key, hash of the tracked columns, hash of the overwritten columns)
+def build_index(rows, tracked: int):
+    index = {}
+
+    for row in rows:
+        index[row[1]] = (row[0], get_hash(row[2:2 + tracked]), get_hash(row[2 + tracked:]))
+
+    return index
+
+
+# One pass over the staging rows, a business key that is in the index is changed when its tracked hash is
+# different and overwritten when its other hash is different (it can be both)
+def detect_changes(index: dict, staging_rows, tracked: int):
+    changes = {"new": [], "changed": [], "overwritten": [], "unchanged": 0}
+
+    for row in staging_rows:
+        current = index.get(row[0])
+
+        if current is None:
+            changes["new"].append(row)
+            continue
+
+        surrogate_key, tracked_hash, overwritten_hash = current
+        is_changed = get_hash(row[1:1 + tracked]) != tracked_hash
+        is_overwritten = get_hash(row[1 + tracked:]) != overwritten_hash
+
+        if is_changed:
+            changes["changed"].append((surrogate_key, row))
+
+        if is_overwritten:
+            changes["overwritten"].append(row)
+
+        if not is_changed and not is_overwritten:
+            changes["unchanged"] += 1
+
+    return changes
+
+
+# Input sizes of the parameters of an update, by the columns of the table that they are compared with or set to
+def get_parameter_sizes(table: str, columns: list):
+    input_sizes = dict(zip(column_names(table), get_input_sizes(table)))
+
+    return [input_sizes[column] for column in columns]
+
+
+def execute_batches(cursor, sql: str, rows: list, input_sizes: list, batch_size=10000):
+    for start in range(0, len(rows), batch_size):
+        cursor.setinputsizes(input_sizes)
+        cursor.executemany(sql, rows[start:start + batch_size])
+
+
+# Inserts into the columns of the table after skip, Dim_Patient skips its identity surrogate key
+def insert_rows(cursor, table: str, rows: list, skip=0, batch_size=10000):
+    columns = column_names(table)[skip:]
+    rows = list(to_rows(rows, get_converters(table)[skip:]))
+    sql = f"insert into data_warehouse.Warehouse.{table} ({', '.join(columns)}) " \
+          f"values ({', '.join('?' * len(columns))})"
+
+    for start in range(0, len(rows), batch_size):
+        cursor.setinputsizes(get_input_sizes(table)[skip:])
+        cursor.executemany(sql, rows[start:start + batch_size])
+
+
+def apply_patient_changes(cursor, changes: dict, today: datetime.date, batch_size=10000):
+    # Every row of the patient gets the overwritten columns, the old phones too
+    execute_batches(cursor, "update data_warehouse.Warehouse.Dim_Patient set national_code = ?, firstname = ?, "
+                            "lastname = ?, dob = ?, gender = ? where patient_id = ?",
+                    [(*row[2:], row[0]) for row in changes["overwritten"]],
+                    get_parameter_sizes("Dim_Patient", ["national_code", "firstname", "lastname", "dob", "gender",
+                                                        "patient_id"]), batch_size)
+
+    execute_batches(cursor, "update data_warehouse.Warehouse.Dim_Patient set phone_end_date = ?, "
+                            "phone_current_flag = 0 where patient_surrogate_key = ?",
+                    [(today, surrogate_key) for surrogate_key, _ in changes["changed"]],
+                    get_parameter_sizes("Dim_Patient", ["phone_end_date", "patient_surrogate_key"]), batch_size)
+
+    rows = changes["new"] + [row for _, row in changes["changed"]]
+    insert_rows(cursor, "Dim_Patient", [(patient_id, national_code, firstname, lastname, dob, gender, phone, today,
+                                         None, True)
+                                        for patient_id, phone, national_code, firstname, lastname, dob, gender
+                                        in rows], 1, batch_size)
+
+
+def apply_doctor_changes(cursor, changes: dict, today: datetime.date, batch_size=10000):
+    execute_batches(cursor, "update data_warehouse.Warehouse.Dim_Doctor set national_code = ?, firstname = ?, "
+                            "lastname = ?, gender = ?, phone = ?, department_id = ?, department_name = ? "
+                            "where doctor_id = ?",
+                    [(*row[2:], row[0]) for row in changes["overwritten"]],
+                    get_parameter_sizes("Dim_Doctor", ["national_code", "firstname", "lastname", "gender", "phone",
+                                                       "department_id", "department_name", "doctor_id"]), batch_size)
+
+    # The right side of a set is the value before the update, so the original gets the last specialization
+    execute_batches(cursor, "update data_warehouse.Warehouse.Dim_Doctor set original_specialization = "
+                            "current_specialization, current_specialization = ?, specialization_effective_date = ? "
+                            "where doctor_id = ?",
+                    [(row[1], today, doctor_id) for doctor_id, row in changes["changed"]],
+                    get_parameter_sizes("Dim_Doctor", ["current_specialization", "specialization_effective_date",
+                                                       "doctor_id"]), batch_size)
+
+    insert_rows(cursor, "Dim_Doctor", [(doctor_id, national_code, firstname, lastname, gender, phone, None,
+                                        specialization, None, department_id, department_name)
+                                       for doctor_id, specialization, national_code, firstname, lastname, gender,
+                                       phone, department_id, department_name in changes["new"]], 0, batch_size)
+
+
+APPLY = {"patient": apply_patient_changes, "doctor": apply_doctor_changes}
+
+
+# Detects and applies the changes of a dimension in one transaction, dry_run only detects them
+def update_dimension(cursor, dimension: str, today=None, dry_run=False, batch_size=10000):
+    today = today or datetime.date.today()
+    settings = DIMENSIONS[dimension]
+
+    cursor.execute(settings["current"])
+    index = build_index(cursor.fetchall(), settings["tracked"])
+
+    cursor.execute(settings["staging"])
+    changes = detect_changes(index, cursor.fetchall(), settings["tracked"])
+
+    print(f"{dimension}: {len(changes['new'])} new, {len(changes['changed'])} changed, "
+          f"{len(changes['overwritten'])} overwritten, {changes['unchanged']} unchanged")
+
+    if not dry_run:
+        # The cursor of main or of the pool of orchestrator.py, the batches of updates and inserts are sent
+        # as arrays of parameters instead of a round trip for every row
+        cursor.fast_executemany = True
+        APPLY[dimension](cursor, changes, today, batch_size)
+        cursor.commit()
+
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Applies the changes of staging.Cache to Dim_Patient and Dim_Doctor")
+    parser.add_argument("--dimensions", nargs="+", choices=DIMENSIONS, default=list(DIMENSIONS))
+    parser.add_argument("--date", type=datetime.date.fromisoformat, help="date of the changes, today by default")
+    parser.add_argument("--dry-run", action="store_true", help="only count the changes")
+    args = parser.parse_args()
+
+    cursor = connect_to_sql_server()
+
+    for dimension in args.dimensions:
+        update_dimension(cursor, dimension, args.date, args.dry_run)
+
+    cursor.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+import datetime
+from itertools import chain
+
+# Column layout of every table that the python scripts fill, the order is exactly the same as
+# source.sql and data_warehouse.sql because the inserts are positional.
+# Each column is (name, sql type) and the type is written the same way as in the sql files
+TABLES = {
+    "Department": [
+        ("department_id", "int"),
+        ("department_name", "nvarchar(255)"),
+    ],
+    "Doctor": [
+        ("doctor_id", "int"),
+        ("national_code", "nvarchar(10)"),
+        ("firstname", "nvarchar(255)"),
+        ("lastname", "nvarchar(255)"),
+        ("gender", "bit"),
+        ("phone", "nvarchar(10)"),
+        ("specialization", "nvarchar(100)"),
+        ("department_id", "int"),
+    ],
+    "Patient": [
+        ("patient_id", "int"),
+        ("national_code", "nvarchar(10)"),
+        ("firstname", "nvarchar(255)"),
+        ("lastname", "nvarchar(255)"),
+        ("dob", "date"),
+        ("gender", "bit"),
+        ("phone", "nvarchar(10)"),
+    ],
+    "Visit": [
+        ("visit_id", "int"),
+        ("patient_id", "int"),
+        ("doctor_id", "int"),
+        ("visit_date", "datetime"),
+        ("diagnosis", "nvarchar(max)"),
+        ("visit_cost", "decimal(11, 2)"),
+        ("is_check_up", "bit"),
+    ],
+    "Treatment": [
+        ("treatment_id", "int"),
+        ("visit_id", "int"),
+        ("treatment_type", "nvarchar(50)"),
+        ("treatment_description", "nvarchar(max)"),
+        ("treatment_cost", "decimal(11, 2)"),
+        ("department_id", "int"),
+    ],
+    "Medication": [
+        ("medication_id", "int"),
+        ("visit_id", "int"),
+        ("medication_name", "nvarchar(255)"),
+        ("dosage", "decimal(8, 2)"),
+        ("frequency", "int"),
+        ("frequency_unit", "nvarchar(50)"),
+        ("medication_cost", "decimal(11, 2)"),
+        ("prescription_date", "date"),
+        ("duration", "int"),
+    ],
+    "Billing": [
+        ("billing_id", "int"),
+        ("visit_id", "int"),
+        ("total_amount", "decimal(11, 2)"),
+        ("paid_amount", "decimal(11, 2)"),
+        ("tax_amount", "decimal(11, 2)"),
+        ("insurance_coverage", "decimal(11, 2)"),
+    ],
+    "Dim_Time": [
+        ("time_key", "date"),
+        ("full_date_alternate_day", "nvarchar(50)"),
+        ("persian_full_date_alternate_day", "nvarchar(50)"),
+        ("day_number_of_week", "int"),
+        ("persian_number_of_week", "int"),
+        ("day_name_of_week", "nvarchar(50)"),
+        ("persian_day_name_of_week", "nvarchar(50)"),
+        ("day_number_of_month", "int"),
+        ("persian_day_number_of_month", "int"),
+        ("day_number_of_year", "int"),
+        ("persian_day_number_of_year", "int"),
+        ("week_number_of_year", "int"),
+        ("persian_week_number_of_year", "int"),
+        ("month_name", "nvarchar(50)"),
+        ("persian_month_name", "nvarchar(50)"),
+        ("month_number_of_year", "int"),
+        ("persian_month_number_of_year", "int"),
+        ("calendar_quarter", "int"),
+        ("persian_calendar_quarter", "int"),
+        ("calendar_year", "int"),
+        ("persian_calendar_year", "int"),
+    ],
+    "Dim_Department": [
+        ("department_id", "int"),
+        ("department_name", "nvarchar(512)"),
+    ],
+    "Dim_Doctor": [
+        ("doctor_id", "int"),
+        ("national_code", "nvarchar(15)"),
+        ("firstname", "nvarchar(512)"),
+        ("lastname", "nvarchar(512)"),
+        ("gender", "nvarchar(20)"),
+        ("phone", "nvarchar(15)"),
+        ("original_specialization", "nvarchar(255)"),
+        ("current_specialization", "nvarchar(255)"),
+        ("specialization_effective_date", "date"),
+        ("department_id", "int"),
+        ("department_name", "nvarchar(512)"),
+    ],
+    "Dim_Patient": [
+        ("patient_surrogate_key", "int"),
+        ("patient_id", "int"),
+        ("national_code", "nvarchar(15)"),
+        ("firstname", "nvarchar(512)"),
+        ("lastname", "nvarchar(512)"),
+        ("dob", "date"),
+        ("gender", "nvarchar(20)"),
+        ("phone", "nvarchar(15)"),
+        ("phone_start_date", "date"),
+        ("phone_end_date", "date"),
+        ("phone_current_flag", "bit"),
+    ],
+    "Fact_Visit_Transactional": [
+        ("visit_id", "int"),
+        ("patient_surrogate_key", "int"),
+        ("department_id", "int"),
+        ("doctor_id", "int"),
+        ("treatment_id", "int"),
+        ("medication_id", "int"),
+        ("billing_id", "int"),
+        ("time_key", "date"),
+        ("total_cost", "decimal(15, 4)"),
+        ("total_insurance_coverage", "decimal(15, 4)"),
+        ("total_paid", "decimal(15, 4)"),
+        ("total_medication_cost", "decimal(15, 4)"),
+        ("total_treatment_cost", "decimal(15, 4)"),
+    ],
+    "Fact_Patient_Daily": [
+        ("patient_surrogate_key", "int"),
+        ("time_key", "date"),
+        ("total_visits", "int"),
+        ("total_treatments", "int"),
+        ("total_medications", "int"),
+        ("total_cost", "decimal(15, 4)"),
+        ("total_insurance_coverage", "decimal(15, 4)"),
+        ("total_paid", "decimal(15, 4)"),
+        ("current_treatment_type", "nvarchar(255)"),
+        ("current_medication_name", "nvarchar(512)"),
+    ],
+    "Fact_Patient_ACC": [
+        ("patient_surrogate_key", "int"),
+        ("total_visits", "bigint"),
+        ("total_treatments", "bigint"),
+        ("total_medications", "bigint"),
+        ("total_cost", "decimal(15, 4)"),
+        ("total_insurance_coverage", "decimal(15, 4)"),
+        ("total_paid", "decimal(15, 4)"),
+        ("total_visits_cost", "decimal(15, 4)"),
+        ("total_treatments_cost", "decimal(15, 4)"),
+        ("total_medications_cost", "decimal(15, 4)"),
+        ("current_treatment_type", "nvarchar(255)"),
+        ("current_medication_name", "nvarchar(512)"),
+        ("patient_age", "int"),
+    ],
+    "Fact_Patient_Doctor_Factless": [
+        ("patient_surrogate_key", "int"),
+        ("doctor_id", "int"),
+    ],
+}
+
+
+# Splits a type like "decimal(11, 2)" into ("decimal", 11, 2) and "nvarchar(max)" into ("nvarchar", 0, 0)
+def parse_type(sql_type: str):
+    if "(" not in sql_type:
+        return sql_type, 0, 0
+
+    name, args = sql_type[:-1].split("(")
+    args = [arg.strip() for arg in args.split(",")]
+
+    size = 0 if args[0] == "max" else int(args[0])
+    scale = int(args[1]) if len(args) > 1 else 0
+
+    return name, size, scale
+
+
+def column_names(table: str):
+    return [column[0] for column in TABLES[table]]
+
+
+def to_date(value):
+    if isinstance(value, str):
+        # time_key of the time dimension is not zero padded so fromisoformat can't be used
+        year, month, day = value.split('-')
+        return datetime.date(int(year), int(month), int(day))
+
+    return value
+
+
+def to_datetime(value):
+    if isinstance(value, str):
+        year, month, day = value.split('-')
+        return datetime.datetime(int(year), int(month), int(day))
+
+    if not isinstance(value, datetime.datetime):
+        return datetime.datetime(value.year, value.month, value.day)
+
+    return value
+
+
+# A converter for each column that turns the generated value to the python type of the column,
+# i.e. dates are generated as strings and costs can be ints
+def get_converters(table: str):
+    converters = []
+
+    for _, sql_type in TABLES[table]:
+        name, _, _ = parse_type(sql_type)
+
+        if name == "nvarchar":
+            converters.append(str)
+        elif name == "date":
+            converters.append(to_date)
+        elif name == "datetime":
+            converters.append(to_datetime)
+        elif name == "decimal":
+            converters.append(float)
+        elif name == "bit":
+            converters.append(bool)
+        else:
+            converters.append(int)
+
+    return converters
+
+
+# A numpy column is turned to python values a part at a time, so the memory mapped columns of dataset_cache.py
+# are read from the disk while the batches are inserted and not all at once
+def iter_column(column, part_size=10000):
+    if not hasattr(column, 'tolist'):
+        return iter(column)
+
+    return chain.from_iterable(column[start:start + part_size].tolist() for start in range(0, len(column), part_size))
+
+
+def to_rows(records, converters):
+    # The columnar generator gives a dict of numpy columns
+    if isinstance(records, dict):
+        records = zip(*(iter_column(column) for column in records.values()))
+    # A RecordTable of record_store.py gives its rows as tuples
+    elif hasattr(records, 'rows'):
+        records = records.rows()
+
+    for record in records:
+        values = record.values() if isinstance(record, dict) else record
+
+        # None is null, the warehouse tables have nullable columns i.e. the treatment_id of a visit
+        yield tuple(None if value is None else convert(value) for convert, value in zip(converters, values))
@@ -0,0 +1,40 @@
+from columnar_generator import get_rng, count_rows, generate_visit_columns, generate_treatment_columns, \
+    generate_medication_columns, generate_billing_columns
+
+
+# Visits are generated for a chunk of patients at a time and the treatments, medications and billings
+# of the chunk only need the visits of the same chunk. Each chunk is a list of (table, columns) like
+# the data of bulk_insert_into, and nothing keeps it after the sink is done with it,
+# so the memory is the same for 1 million or 500 million visits
+def generate_chunks(departments: list[dict], doctors: list[dict], patients: list[dict], visit_per_patient=100,
+                    patients_per_chunk=1000, rng=None):
+    rng = get_rng(rng)
+
+    visit_id = 1
+    treatment_id = 1
+    medication_id = 1
+    billing_id = 1
+
+    for start in range(0, len(patients), patients_per_chunk):
+        visits = generate_visit_columns(doctors, patients[start:start + patients_per_chunk], visit_per_patient, rng,
+                                        visit_id)
+        treatments = generate_treatment_columns(visits, departments, rng, treatment_id)
+        medications = generate_medication_columns(treatments, visits, rng, medication_id)
+        billings = generate_billing_columns(visits, treatments, medications, rng, billing_id)
+
+        visit_id += count_rows(visits)
+        treatment_id += count_rows(treatments)
+        medication_id += count_rows(medications)
+        billing_id += count_rows(billings)
+
+        yield [("Visit", visits), ("Treatment", treatments), ("Medication", medications), ("Billing", billings)]
+
+
+# Turns the chunks to one stream of (table, records), bulk_insert_into only iterates its data,
+# so passing this stream to it loads every chunk as soon as it's generated
+def stream_tables(head: list[tuple[str, list]], chunks):
+    for table in head:
+        yield table
+
+    for chunk in chunks:
+        yield from chunk
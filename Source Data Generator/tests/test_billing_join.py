@@ -0,0 +1,52 @@
+import unittest
+import numpy as np
+from billing_join import join_costs, sum_columns_by_visit
+from data_generator import generate_billing
+
+# Visit 11 has two treatments and two medications, 12 has a treatment without medication, 13 is a checkup
+# without any and 14 has a treatment with three medications, the visits of the medications are out of order
+
+VISITS = [{"visit_id": visit_id, "visit_cost": visit_cost} for visit_id, visit_cost in
+          ((11, 1000), (12, 2000), (13, 500), (14, 3000))]
+TREATMENTS = [{"visit_id": visit_id, "treatment_cost": cost} for visit_id, cost in
+              ((11, 100), (11, 250), (12, 400), (14, 700))]
+MEDICATIONS = [{"visit_id": visit_id, "medication_cost": cost} for visit_id, cost in
+               ((14, 5), (11, 30), (14, 15), (11, 20), (14, 25))]
+
+# visit_id, treatment cost, medication cost
+EXPECTED = [(11, 350, 50), (12, 400, 0), (13, 0, 0), (14, 700, 45)]
+
+
+class BillingJoinTest(unittest.TestCase):
+    def test_join_costs(self):
+        self.assertEqual([(visit["visit_id"], treatment_cost, medication_cost) for visit, treatment_cost,
+                          medication_cost in join_costs(VISITS, TREATMENTS, MEDICATIONS)], EXPECTED)
+
+    def test_join_costs_without_treatments_and_medications(self):
+        self.assertEqual([(visit["visit_id"], treatment_cost, medication_cost) for visit, treatment_cost,
+                          medication_cost in join_costs(VISITS, [], [])],
+                         [(visit["visit_id"], 0, 0) for visit in VISITS])
+
+    def test_sum_columns_by_visit(self):
+        def sum_columns(rows, cost_column):
+            return sum_columns_by_visit(np.array([row["visit_id"] for row in rows], dtype=np.int64),
+                                        np.array([row[cost_column] for row in rows], dtype=float), 11, len(VISITS))
+
+        self.assertEqual(sum_columns(TREATMENTS, "treatment_cost").tolist(), [350, 400, 0, 700])
+        self.assertEqual(sum_columns(MEDICATIONS, "medication_cost").tolist(), [50, 0, 0, 45])
+        self.assertEqual(sum_columns([], "medication_cost").tolist(), [0, 0, 0, 0])
+
+    def test_billing_adds_up_the_joined_costs(self):
+        for compact in (False, True):
+            billings = generate_billing(VISITS, TREATMENTS, MEDICATIONS, compact)
+
+            self.assertEqual(len(billings), len(VISITS))
+
+            for billing, visit, (visit_id, treatment_cost, medication_cost) in zip(billings, VISITS, EXPECTED):
+                self.assertEqual(billing["visit_id"], visit_id)
+                self.assertAlmostEqual(billing["total_amount"] - billing["tax_amount"],
+                                       visit["visit_cost"] + treatment_cost + medication_cost)
+
+
+if __name__ == '__main__':
+    unittest.main()
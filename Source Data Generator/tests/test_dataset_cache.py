@@ -0,0 +1,126 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from dataset_cache import CategoryColumn, write_dataset, read_dataset, list_entries, prune, MANIFEST_FILE
+from columnar_generator import generate_visit_columns, generate_treatment_columns, generate_medication_columns, \
+    generate_billing_columns
+from data_generator import get_departments, generate_doctors, generate_patients
+from parallel_loader import split_records
+from scale_factor import get_scale, generate_scaled_chunks
+from schema import get_converters, to_rows
+
+# The tables written to the cache and read back (with memory mapped columns and CategoryColumns for the strings)
+# should give the loaders the same rows as the generated tables
+
+TABLES = ("Visit", "Treatment", "Medication", "Billing")
+
+
+def get_rows(data: list):
+    return [list(to_rows(records, get_converters(table))) for table, records in data]
+
+
+class DatasetCacheTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.departments = get_departments()
+        cls.doctors = generate_doctors(cls.departments)
+        cls.patients = generate_patients()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def get_columnar_data(self):
+        rng = np.random.default_rng(1)
+        visits = generate_visit_columns(self.doctors, self.patients[:20], 10, rng)
+        treatments = generate_treatment_columns(visits, self.departments, rng)
+        medications = generate_medication_columns(treatments, visits, rng)
+        billings = generate_billing_columns(visits, treatments, medications, rng)
+
+        return list(zip(TABLES, (visits, treatments, medications, billings)))
+
+    def write(self, key: str, data: list, max_bytes=10 ** 12):
+        return write_dataset(key, data, {"key": key}, self.directory.name, max_bytes)
+
+    def test_columnar_round_trip(self):
+        data = self.get_columnar_data()
+        self.write("columnar", data)
+        cached = read_dataset("columnar", self.directory.name)
+
+        self.assertEqual([table for table, _ in cached], list(TABLES))
+        self.assertIsInstance(cached[0][1]["diagnosis"], CategoryColumn)
+        self.assertIsInstance(cached[0][1]["visit_id"], np.memmap)
+        self.assertEqual(get_rows(cached), get_rows(data))
+
+    def test_scaled_round_trip(self):
+        scale = get_scale(0.01, doctor_skew=1.0, patient_skew=0.5, weekday_curve="clinic")
+        data = next(generate_scaled_chunks(self.departments, self.doctors, self.patients, scale,
+                                           scale["patients"], np.random.default_rng(1)))
+        self.write("scaled", data)
+
+        self.assertEqual(get_rows(read_dataset("scaled", self.directory.name)), get_rows(data))
+
+    def test_lists_of_dicts_round_trip(self):
+        data = [("Department", self.departments), ("Doctor", self.doctors[:10])]
+        self.write("lists", data)
+
+        self.assertEqual(read_dataset("lists", self.directory.name), data)
+
+    def test_missing_entry(self):
+        self.assertIsNone(read_dataset("missing", self.directory.name))
+
+    def test_no_temporary_directory_is_left(self):
+        self.write("columnar", self.get_columnar_data())
+        # Writing the same key again replaces the entry
+        self.write("columnar", self.get_columnar_data())
+
+        self.assertEqual(os.listdir(self.directory.name), ["columnar"])
+
+    def test_category_column_slices(self):
+        self.write("columnar", self.get_columnar_data())
+        visits = read_dataset("columnar", self.directory.name)[0][1]
+        diagnosis = visits["diagnosis"]
+
+        self.assertIsInstance(diagnosis[5:15], CategoryColumn)
+        self.assertEqual(len(diagnosis[5:15]), 10)
+        self.assertEqual(diagnosis[5:15].tolist(), np.asarray(diagnosis)[5:15].tolist())
+        self.assertEqual(diagnosis[5], diagnosis.tolist()[5])
+
+        slices = list(split_records(visits, 3))
+        converters = get_converters("Visit")
+
+        self.assertEqual(len(slices), 3)
+        self.assertTrue(all(isinstance(part["diagnosis"], CategoryColumn) for part in slices))
+        self.assertEqual([row for part in slices for row in to_rows(part, converters)],
+                         list(to_rows(visits, converters)))
+
+    def test_prune_removes_the_least_recently_used(self):
+        data = self.get_columnar_data()
+
+        for i, key in enumerate(("old", "middle", "new")):
+            self.write(key, data)
+            manifest_path = os.path.join(self.directory.name, key, MANIFEST_FILE)
+            os.utime(manifest_path, (1000 + i, 1000 + i))
+
+        total = sum(entry["bytes"] for entry in list_entries(self.directory.name))
+
+        self.assertEqual(prune(total - 1, self.directory.name, keep="old"), ["middle"])
+        self.assertEqual(prune(0, self.directory.name, keep="old"), ["new"])
+        self.assertEqual([entry["key"] for entry in list_entries(self.directory.name)], ["old"])
+
+    def test_read_marks_the_entry_as_used(self):
+        data = self.get_columnar_data()
+
+        for i, key in enumerate(("old", "new")):
+            self.write(key, data)
+            os.utime(os.path.join(self.directory.name, key, MANIFEST_FILE), (1000 + i, 1000 + i))
+
+        read_dataset("old", self.directory.name)
+        total = sum(entry["bytes"] for entry in list_entries(self.directory.name))
+
+        self.assertEqual(prune(total - 1, self.directory.name), ["new"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import datetime
+import os
+import tempfile
+import unittest
+from log_profiler import read_log_file, read_calls, get_steps, get_daily_seconds, find_growing_days, profile_log, \
+    write_folded
+
+# warehouse_log.csv is a csv export of Warehouse.Log with a run of ins_dim_patient and nine days of
+# ins_fact_patient_daily that take 10 seconds each until 2021-01-08 (30 seconds) and 2021-01-09 (60 seconds),
+# then ins_dim_patient runs again three hours later
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+LOG_FILE = os.path.join(FIXTURES, "warehouse_log.csv")
+
+# warehouse_log_windows.csv is the log of orchestrator.py with --window-days 2 for ins_dim_visit (10 seconds a day)
+# and ins_dim_treatment (3 seconds a day, 9 seconds on 2021-01-04) after ins_dim_department (2 seconds),
+# the four windows run at the same time and warehouse_calls.json is the calls file of the run
+WINDOWS_LOG_FILE = os.path.join(FIXTURES, "warehouse_log_windows.csv")
+CALLS_FILE = os.path.join(FIXTURES, "warehouse_calls.json")
+
+
+class LogProfilerTest(unittest.TestCase):
+    def setUp(self):
+        self.entries = read_log_file(LOG_FILE)
+
+    def test_read_log_file(self):
+        self.assertEqual(len(self.entries), 13)
+        self.assertEqual(self.entries[2]["type"], "insert 2021-01-01")
+        self.assertEqual(self.entries[2]["created_at"], datetime.datetime(2024, 1, 1, 0, 0, 15))
+
+    def test_steps_skip_the_first_row_of_each_run(self):
+        steps = get_steps(self.entries)
+
+        # The first row and the first row after the three hour gap have no step
+        self.assertEqual(len(steps), 11)
+        self.assertEqual(steps[0], {"procedure": "ins_dim_patient", "table": "Dim_Patient", "action": "insert",
+                                    "date": None, "seconds": 5.0})
+        self.assertEqual(steps[-1]["seconds"], 7.0)
+        self.assertEqual(steps[1]["date"], datetime.date(2021, 1, 1))
+
+    def test_daily_seconds(self):
+        daily_seconds = get_daily_seconds(get_steps(self.entries))
+
+        self.assertEqual(list(daily_seconds), ["ins_fact_patient_daily"])
+        self.assertEqual(list(daily_seconds["ins_fact_patient_daily"].values()), [10.0] * 7 + [30.0, 60.0])
+
+    def test_growing_days_are_flagged(self):
+        flagged, trends = find_growing_days(get_daily_seconds(get_steps(self.entries)))
+
+        self.assertEqual([(item["date"], item["seconds"], item["median"]) for item in flagged],
+                         [(datetime.date(2021, 1, 8), 30.0, 10.0), (datetime.date(2021, 1, 9), 60.0, 10.0)])
+        # Nine days are not enough for the trend of a window of seven days
+        self.assertEqual(trends, {})
+
+    def test_trend(self):
+        _, trends = find_growing_days(get_daily_seconds(get_steps(self.entries)), window=3)
+
+        self.assertAlmostEqual(trends["ins_fact_patient_daily"], (10 + 30 + 60) / 3 / 10)
+
+    def test_profile_totals(self):
+        profile = profile_log(self.entries)
+
+        self.assertEqual(profile["total_seconds"], 172.0)
+        self.assertEqual(profile["procedures"]["ins_fact_patient_daily"], {"seconds": 160.0, "count": 9})
+        self.assertEqual(profile["procedures"]["ins_dim_patient"], {"seconds": 12.0, "count": 2})
+        self.assertEqual(list(profile["days"])[0], datetime.date(2021, 1, 9))
+
+    def test_write_folded(self):
+        steps = get_steps(self.entries)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "etl.folded")
+
+            write_folded(steps, path)
+
+            with open(path, 'r') as file:
+                self.assertEqual(file.read(), "ins_dim_patient;Dim_Patient;insert 12000\n"
+                                              "ins_fact_patient_daily;Fact_Patient_Daily;insert 160000\n")
+
+            write_folded(steps, path, by_date=True)
+
+            with open(path, 'r') as file, open(os.path.join(FIXTURES, "warehouse_log.folded"), 'r') as expected:
+                self.assertEqual(file.read(), expected.read())
+
+
+class InterleavedWindowsTest(unittest.TestCase):
+    def setUp(self):
+        self.entries = read_log_file(WINDOWS_LOG_FILE)
+        self.calls = read_calls(CALLS_FILE)
+        self.profile = profile_log(self.entries, window=2, calls=self.calls)
+
+    def test_read_calls(self):
+        self.assertEqual(len(self.calls), 5)
+        self.assertIsNone(self.calls[0]["window"])
+        self.assertEqual(self.calls[2]["window"], [datetime.date(2021, 1, 3), datetime.date(2021, 1, 4)])
+        self.assertEqual(self.calls[2]["started_at"], datetime.datetime(2024, 1, 1, 0, 0, 2))
+
+    def test_without_calls_the_rows_are_timed_from_other_calls(self):
+        steps = get_steps(self.entries)
+
+        # The visit of 2021-01-03 is timed from the visit of 2021-01-01 that another window wrote
+        self.assertEqual((steps[4]["procedure"], steps[4]["date"], steps[4]["seconds"]),
+                         ("ins_dim_visit", datetime.date(2021, 1, 3), 1.0))
+
+    def test_procedures(self):
+        self.assertEqual(self.profile["procedures"], {"ins_dim_visit": {"seconds": 40.0, "count": 4},
+                                                      "ins_dim_treatment": {"seconds": 18.0, "count": 4},
+                                                      "ins_dim_department": {"seconds": 2.0, "count": 1}})
+
+    def test_daily_seconds(self):
+        self.assertEqual(list(self.profile["daily_seconds"]["ins_dim_visit"].values()), [10.0] * 4)
+        self.assertEqual(list(self.profile["daily_seconds"]["ins_dim_treatment"].values()), [3.0] * 3 + [9.0])
+        self.assertEqual(self.profile["days"][datetime.date(2021, 1, 4)], {"seconds": 19.0, "count": 2})
+
+    def test_only_the_slow_day_is_flagged(self):
+        self.assertEqual([(item["procedure"], item["date"]) for item in self.profile["flagged_days"]],
+                         [("ins_dim_treatment", datetime.date(2021, 1, 4))])
+
+
+if __name__ == '__main__':
+    unittest.main()
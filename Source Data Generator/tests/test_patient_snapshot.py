@@ -0,0 +1,139 @@
+import datetime
+import unittest
+import numpy as np
+from patient_snapshot import MEASURES, create_state, build_patient_daily, sum_costs, build_patient_acc, get_ages
+
+# A hand computed fixture of what ins_fact_patient_daily and ins_fact_patient_acc make for three patients
+# from 2021-01-01 to 2021-01-05:
+#   patient 10  a checkup on the 1st, a treatment with a medication on the 2nd and two treatments on the 5th,
+#               the last one (higher visit_id) has no medication, so the medication of the 2nd is kept
+#   patient 20  a treatment without medication on the 2nd, a treatment and a checkup on the 4th,
+#               born on february 29
+#   patient 30  no visits
+
+START = datetime.date(2021, 1, 1)
+END = datetime.date(2021, 1, 5)
+
+# visit_id, visit_date, patient_id, is_check_up, treatment_type, medication_name, total_amount, insurance_coverage,
+# paid_amount, visit_cost, treatment_cost, medication_cost, None is a visit without treatment or medication
+VISITS = [
+    (1, "2021-01-01", 10, True, None, None, 100, 20, 80, 100, 0, 0),
+    (2, "2021-01-02", 10, False, "Surgery", "Aspirin", 500, 100, 400, 200, 250, 50),
+    (3, "2021-01-02", 20, False, "Therapy", None, 300, 0, 300, 150, 150, 0),
+    (4, "2021-01-04", 20, False, "Imaging", "Ibuprofen", 400, 50, 350, 100, 200, 100),
+    (5, "2021-01-04", 20, True, None, None, 50, 0, 50, 50, 0, 0),
+    (6, "2021-01-05", 10, False, "Imaging", "Aspirin", 200, 0, 200, 100, 80, 20),
+    (7, "2021-01-05", 10, False, "Therapy", None, 100, 10, 90, 60, 40, 0),
+]
+
+# Fact_Patient_Daily of each day for the patients 10, 20 and 30: the measures and the current
+# treatment and medication
+EXPECTED_DAILY = {
+    "2021-01-01": [(1, 0, 0, 100, 20, 80, "-1", "-1"), (0, 0, 0, 0, 0, 0, "-1", "-1"),
+                   (0, 0, 0, 0, 0, 0, "-1", "-1")],
+    "2021-01-02": [(2, 1, 1, 600, 120, 480, "Surgery", "Aspirin"), (1, 1, 0, 300, 0, 300, "Therapy", "-1"),
+                   (0, 0, 0, 0, 0, 0, "-1", "-1")],
+    "2021-01-03": [(2, 1, 1, 600, 120, 480, "Surgery", "Aspirin"), (1, 1, 0, 300, 0, 300, "Therapy", "-1"),
+                   (0, 0, 0, 0, 0, 0, "-1", "-1")],
+    "2021-01-04": [(2, 1, 1, 600, 120, 480, "Surgery", "Aspirin"), (3, 2, 1, 750, 50, 700, "Imaging", "Ibuprofen"),
+                   (0, 0, 0, 0, 0, 0, "-1", "-1")],
+    "2021-01-05": [(4, 3, 2, 900, 130, 770, "Therapy", "Aspirin"), (3, 2, 1, 750, 50, 700, "Imaging", "Ibuprofen"),
+                   (0, 0, 0, 0, 0, 0, "-1", "-1")],
+}
+
+
+def make_visits(rows: list):
+    columns = list(zip(*rows))
+
+    return {
+        "visit_id": np.array(columns[0], dtype=np.int64),
+        "visit_date": np.array(columns[1], dtype='datetime64[D]'),
+        "patient_id": np.array(columns[2], dtype=np.int64),
+        "is_check_up": np.array(columns[3], dtype=bool),
+        "has_treatment": np.array([value is not None for value in columns[4]], dtype=bool),
+        "treatment_type": np.array(columns[4], dtype=object),
+        "has_medication": np.array([value is not None for value in columns[5]], dtype=bool),
+        "medication_name": np.array(columns[5], dtype=object),
+        "total_amount": np.array(columns[6], dtype=float),
+        "insurance_coverage": np.array(columns[7], dtype=float),
+        "paid_amount": np.array(columns[8], dtype=float),
+        "visit_cost": np.array(columns[9], dtype=float),
+        "treatment_cost": np.array(columns[10], dtype=float),
+        "medication_cost": np.array(columns[11], dtype=float),
+    }
+
+
+def make_patients():
+    return {
+        "patient_surrogate_key": np.array([1, 2, 3], dtype=np.int64),
+        "patient_id": np.array([10, 20, 30], dtype=np.int64),
+        "dob": np.array(["2000-03-15", "2004-02-29", "2001-01-05"], dtype='datetime64[D]'),
+    }
+
+
+def to_rows(columns: dict):
+    return list(zip(*(columns[name].tolist() for name in [*MEASURES, "current_treatment_type",
+                                                          "current_medication_name"])))
+
+
+class PatientSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.visits = make_visits(VISITS)
+        self.patients = make_patients()
+
+    def build(self, start_date, end_date, state, days_per_block=31):
+        return {day.isoformat(): columns for day, columns in build_patient_daily(
+            self.visits, self.patients, start_date, end_date, state, days_per_block)}
+
+    def test_daily(self):
+        days = self.build(START, END, create_state(self.patients))
+
+        self.assertEqual(list(days), list(EXPECTED_DAILY))
+
+        for day, columns in days.items():
+            self.assertEqual(to_rows(columns), EXPECTED_DAILY[day], day)
+            self.assertEqual(columns["patient_surrogate_key"].tolist(), [1, 2, 3])
+            self.assertTrue((columns["time_key"] == np.datetime64(day)).all())
+
+    def test_blocks_and_incremental_runs_are_the_same(self):
+        state = create_state(self.patients)
+        days = self.build(START, datetime.date(2021, 1, 3), state, 2)
+        days.update(self.build(datetime.date(2021, 1, 4), END, state, 2))
+
+        self.assertEqual({day: to_rows(columns) for day, columns in days.items()}, EXPECTED_DAILY)
+
+    def test_visits_outside_the_days_are_skipped(self):
+        days = self.build(datetime.date(2021, 1, 3), datetime.date(2021, 1, 4), create_state(self.patients))
+
+        self.assertEqual(to_rows(days["2021-01-04"]), [(0, 0, 0, 0, 0, 0, "-1", "-1"),
+                                                       (2, 1, 1, 450, 50, 400, "Imaging", "Ibuprofen"),
+                                                       (0, 0, 0, 0, 0, 0, "-1", "-1")])
+
+    def test_acc(self):
+        state = create_state(self.patients)
+        list(build_patient_daily(self.visits, self.patients, START, END, state))
+        columns = build_patient_acc(self.patients, state, sum_costs(self.visits, self.patients),
+                                    datetime.date(2021, 3, 15))
+
+        # The patient without visits is not in Fact_Patient_ACC
+        self.assertEqual(columns["patient_surrogate_key"].tolist(), [1, 2])
+        self.assertEqual(to_rows(columns), [row for row in EXPECTED_DAILY["2021-01-05"][:2]])
+        self.assertEqual(columns["total_visits_cost"].tolist(), [460, 300])
+        self.assertEqual(columns["total_treatments_cost"].tolist(), [370, 350])
+        self.assertEqual(columns["total_medications_cost"].tolist(), [70, 100])
+        self.assertEqual(columns["patient_age"].tolist(), [21, 17])
+
+    def test_ages_on_the_birthday(self):
+        dob = np.array(["2000-03-15", "2004-02-29"], dtype='datetime64[D]')
+
+        self.assertEqual(get_ages(dob, datetime.date(2021, 3, 14)).tolist(), [20, 17])
+        self.assertEqual(get_ages(dob, datetime.date(2021, 3, 15)).tolist(), [21, 17])
+        # dateadd moves february 29 to february 28 in the other years
+        self.assertEqual(get_ages(dob, datetime.date(2021, 2, 27)).tolist(), [20, 16])
+        self.assertEqual(get_ages(dob, datetime.date(2021, 2, 28)).tolist(), [20, 17])
+        self.assertEqual(get_ages(dob, datetime.date(2024, 2, 28)).tolist(), [23, 19])
+        self.assertEqual(get_ages(dob, datetime.date(2024, 2, 29)).tolist(), [23, 20])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+import datetime
+import sqlite3
+import unittest
+from local_database import SqliteCursor, create_sqlite_schema
+from scd_engine import update_dimension
+
+# Snapshots of Dim_Patient and Dim_Doctor before and after update_dimension runs on staging.Cache in a sqlite
+# database, SqliteCursor turns data_warehouse.Warehouse.Dim_Patient and staging.Cache.Patient into
+# Dim_Patient and Patient. The dates are the text that sqlite keeps.
+
+# patient_surrogate_key, patient_id, national_code, firstname, lastname, dob, gender, phone, phone_start_date,
+# phone_end_date, phone_current_flag. Patient 20 changed its phone before
+DIM_PATIENT = [
+    (1, 10, "1000000010", "Ali", "Ahmadi", "2000-01-01", "men", "9100000010", "2021-01-01", None, 1),
+    (2, 20, "1000000020", "Sara", "Bahrami", "2001-02-02", "woman", "9100000020", "2021-01-01", "2021-06-01", 0),
+    (3, 30, "1000000030", "Reza", "Karimi", "2002-03-03", "men", "9100000030", "2021-01-01", None, 1),
+    (4, 40, "1000000040", "Mina", "Rahimi", "2003-04-04", "woman", "9100000040", "2021-01-01", None, 1),
+    (5, 20, "1000000020", "Sara", "Bahrami", "2001-02-02", "woman", "9100000021", "2021-06-01", None, 1),
+]
+
+# staging.Cache.Patient: 10 changed its phone, 20 changed its lastname, 30 is the same, 40 changed its phone and
+# firstname and 50 is new
+PATIENT = [
+    (10, "1000000010", "Ali", "Ahmadi", "2000-01-01", "men", "9100000011"),
+    (20, "1000000020", "Sara", "Bahmani", "2001-02-02", "woman", "9100000021"),
+    (30, "1000000030", "Reza", "Karimi", "2002-03-03", "men", "9100000030"),
+    (40, "1000000040", "Minoo", "Rahimi", "2003-04-04", "woman", "9100000041"),
+    (50, "1000000050", "Omid", "Moradi", "2004-05-05", "men", "9100000050"),
+]
+
+# The old rows keep their surrogate keys, the new phones are new rows and the lastname and firstname are
+# overwritten in every row of the patient
+EXPECTED_DIM_PATIENT = [
+    (1, 10, "1000000010", "Ali", "Ahmadi", "2000-01-01", "men", "9100000010", "2021-01-01", "2022-01-01", 0),
+    (2, 20, "1000000020", "Sara", "Bahmani", "2001-02-02", "woman", "9100000020", "2021-01-01", "2021-06-01", 0),
+    (3, 30, "1000000030", "Reza", "Karimi", "2002-03-03", "men", "9100000030", "2021-01-01", None, 1),
+    (4, 40, "1000000040", "Minoo", "Rahimi", "2003-04-04", "woman", "9100000040", "2021-01-01", "2022-01-01", 0),
+    (5, 20, "1000000020", "Sara", "Bahmani", "2001-02-02", "woman", "9100000021", "2021-06-01", None, 1),
+    (6, 50, "1000000050", "Omid", "Moradi", "2004-05-05", "men", "9100000050", "2022-01-01", None, 1),
+    (7, 10, "1000000010", "Ali", "Ahmadi", "2000-01-01", "men", "9100000011", "2022-01-01", None, 1),
+    (8, 40, "1000000040", "Minoo", "Rahimi", "2003-04-04", "woman", "9100000041", "2022-01-01", None, 1),
+]
+
+# doctor_id, national_code, firstname, lastname, gender, phone, original_specialization, current_specialization,
+# specialization_effective_date, department_id, department_name after first_load_dim_doctor
+DIM_DOCTOR = [
+    (1, "2000000001", "Hamid", "Azizi", "men", "9200000001", None, "Cardiologist", None, 1, "Cardiology"),
+    (2, "2000000002", "Leila", "Jafari", "woman", "9200000002", None, "Neurologist", None, 2, "Neurology"),
+    (3, "2000000003", "Nima", "Sadeghi", "men", "9200000003", None, "Pediatrician", None, 3, "Pediatrics"),
+]
+
+# staging.Cache.Doctor: 1 changed its specialization, 2 changed its phone, 3 is the same and 4 is new
+DOCTOR = [
+    (1, "2000000001", "Hamid", "Azizi", "men", "9200000001", "Interventional Cardiologist", 1, "Cardiology"),
+    (2, "2000000002", "Leila", "Jafari", "woman", "9200000022", "Neurologist", 2, "Neurology"),
+    (3, "2000000003", "Nima", "Sadeghi", "men", "9200000003", "Pediatrician", 3, "Pediatrics"),
+    (4, "2000000004", "Parisa", "Nouri", "woman", "9200000004", "Dermatologist", 4, "Dermatology"),
+]
+
+EXPECTED_DIM_DOCTOR = [
+    (1, "2000000001", "Hamid", "Azizi", "men", "9200000001", "Cardiologist", "Interventional Cardiologist",
+     "2022-01-01", 1, "Cardiology"),
+    (2, "2000000002", "Leila", "Jafari", "woman", "9200000022", None, "Neurologist", None, 2, "Neurology"),
+    (3, "2000000003", "Nima", "Sadeghi", "men", "9200000003", None, "Pediatrician", None, 3, "Pediatrics"),
+    (4, "2000000004", "Parisa", "Nouri", "woman", "9200000004", None, "Dermatologist", None, 4, "Dermatology"),
+]
+
+FIRST_DAY = datetime.date(2022, 1, 1)
+
+
+def create_database():
+    connection = sqlite3.connect(':memory:')
+    # The surrogate key is an identity column on sql server
+    connection.execute("create table Dim_Patient (patient_surrogate_key integer primary key, patient_id integer, "
+                       "national_code text, firstname text, lastname text, dob text, gender text, phone text, "
+                       "phone_start_date text, phone_end_date text, phone_current_flag integer)")
+    create_sqlite_schema(connection, ["Dim_Doctor"])
+    connection.execute("create table Patient (patient_id integer, national_code text, firstname text, "
+                       "lastname text, dob text, gender text, phone text)")
+    connection.execute("create table Doctor (doctor_id integer, national_code text, firstname text, lastname text, "
+                       "gender text, phone text, specialization text, department_id integer, department_name text)")
+
+    connection.executemany(f"insert into Dim_Patient values ({', '.join('?' * 11)})", DIM_PATIENT)
+    connection.executemany(f"insert into Patient values ({', '.join('?' * 7)})", PATIENT)
+    connection.executemany(f"insert into Dim_Doctor values ({', '.join('?' * 11)})", DIM_DOCTOR)
+    connection.executemany(f"insert into Doctor values ({', '.join('?' * 9)})", DOCTOR)
+    connection.commit()
+
+    return connection
+
+
+def count_changes(changes: dict):
+    return {"new": len(changes["new"]), "changed": len(changes["changed"]),
+            "overwritten": len(changes["overwritten"]), "unchanged": changes["unchanged"]}
+
+
+class ScdEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.connection = create_database()
+        self.cursor = SqliteCursor(self.connection)
+
+    def tearDown(self):
+        self.connection.close()
+
+    def select(self, sql: str):
+        return self.connection.execute(sql).fetchall()
+
+    def get_dim_patient(self):
+        return self.select("select * from Dim_Patient order by patient_surrogate_key")
+
+    def get_dim_doctor(self):
+        return self.select("select * from Dim_Doctor order by doctor_id")
+
+    def test_patient(self):
+        changes = update_dimension(self.cursor, "patient", FIRST_DAY)
+
+        self.assertEqual(count_changes(changes), {"new": 1, "changed": 2, "overwritten": 2, "unchanged": 1})
+        self.assertEqual(self.get_dim_patient(), EXPECTED_DIM_PATIENT)
+        # The updates and inserts are sent as arrays of parameters
+        self.assertTrue(self.cursor.fast_executemany)
+
+    def test_patient_has_one_current_row(self):
+        update_dimension(self.cursor, "patient", FIRST_DAY)
+
+        self.assertEqual(self.select("select patient_id, count(*) from Dim_Patient where phone_current_flag = 1 "
+                                     "group by patient_id order by patient_id"),
+                         [(10, 1), (20, 1), (30, 1), (40, 1), (50, 1)])
+
+    def test_patient_run_again_on_the_same_day(self):
+        update_dimension(self.cursor, "patient", FIRST_DAY)
+        changes = update_dimension(self.cursor, "patient", FIRST_DAY)
+
+        self.assertEqual(count_changes(changes), {"new": 0, "changed": 0, "overwritten": 0, "unchanged": 5})
+        self.assertEqual(self.get_dim_patient(), EXPECTED_DIM_PATIENT)
+
+    def test_dry_run(self):
+        changes = update_dimension(self.cursor, "patient", FIRST_DAY, dry_run=True)
+
+        self.assertEqual(count_changes(changes), {"new": 1, "changed": 2, "overwritten": 2, "unchanged": 1})
+        self.assertEqual(self.get_dim_patient(), DIM_PATIENT)
+
+    def test_doctor(self):
+        changes = update_dimension(self.cursor, "doctor", FIRST_DAY)
+
+        self.assertEqual(count_changes(changes), {"new": 1, "changed": 1, "overwritten": 1, "unchanged": 1})
+        self.assertEqual(self.get_dim_doctor(), EXPECTED_DIM_DOCTOR)
+
+    def test_doctor_run_again_on_the_same_day(self):
+        update_dimension(self.cursor, "doctor", FIRST_DAY)
+        changes = update_dimension(self.cursor, "doctor", FIRST_DAY)
+
+        self.assertEqual(count_changes(changes), {"new": 0, "changed": 0, "overwritten": 0, "unchanged": 4})
+        self.assertEqual(self.get_dim_doctor(), EXPECTED_DIM_DOCTOR)
+
+    def test_doctor_original_is_the_previous_specialization(self):
+        update_dimension(self.cursor, "doctor", FIRST_DAY)
+
+        self.connection.execute("update Doctor set specialization = 'Electrophysiologist' where doctor_id = 1")
+        changes = update_dimension(self.cursor, "doctor", datetime.date(2022, 2, 1))
+
+        self.assertEqual(count_changes(changes), {"new": 0, "changed": 1, "overwritten": 0, "unchanged": 3})
+        self.assertEqual(self.select("select original_specialization, current_specialization, "
+                                     "specialization_effective_date from Dim_Doctor where doctor_id = 1"),
+                         [("Interventional Cardiologist", "Electrophysiologist", "2022-02-01")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,15 @@
 import datetime
 import calendar
+import hashlib
+import os
+import pickle
 import jdatetime
-from common import produce_sql_and_insert_into
+import numpy as np
+from common import bulk_insert_into, connect_to_sql_server, insert_batches
+from file_sink import export_tables
+from partition_manager import create_partition_function, get_window_boundaries
+from metrics import enable_metrics, stage, write_report
+from pipeline import run_pipeline
 
 
 def get_days_in_month(year, month):
@@ -26,17 +34,18 @@ def get_quarter(month: int):
     return quarter
 
 
-def time_generator(start_year: int, end_year: int):
-    persian_weekday_names = {
-        'Saturday': 'شنبه',
-        'Sunday': 'یک‌شنبه',
-        'Monday': 'دوشنبه',
-        'Tuesday': 'سه‌شنبه',
-        'Wednesday': 'چهارشنبه',
-        'Thursday': 'پنج‌شنبه',
-        'Friday': 'جمعه'
-    }
+persian_weekday_names = {
+    'Saturday': 'شنبه',
+    'Sunday': 'یک‌شنبه',
+    'Monday': 'دوشنبه',
+    'Tuesday': 'سه‌شنبه',
+    'Wednesday': 'چهارشنبه',
+    'Thursday': 'پنج‌شنبه',
+    'Friday': 'جمعه'
+}
 
+
+def time_generator(start_year: int, end_year: int):
     time_dimension = []
 
     for year in range(start_year, end_year + 1):
@@ -55,7 +64,7 @@ def time_generator(start_year: int, end_year: int):
                     "persian_day_number_of_week": persian_date.weekday(),
                     "day_name_of_week": time_key.strftime("%A"),
                     "persian_day_name_of_week": persian_weekday_names[time_key.strftime("%A")],
-                    "day_number_of_month": month,
+                    "day_number_of_month": day,
                     "persian_day_number_of_month": persian_date.day,
                     "day_number_of_year": time_key.timetuple().tm_yday,
                     "persian_day_number_of_year": get_persian_day_number_of_year(persian_date.month, persian_date.day),
@@ -76,27 +85,228 @@ def time_generator(start_year: int, end_year: int):
     return time_dimension
 
 
-def callback(time_dimension):
-    def closure(cursor):
-        value_ranges = ""
+# The persian day number of year of the Farvardin first of each year decides everything else, so jdatetime is only
+# called once for each year and the rest is computed for all days together with numpy.
+# The result is the columns of Dim_Time in the order of the schema module
+def build_time_dimension(start_date: datetime.date, end_date: datetime.date):
+    dates = np.arange(np.datetime64(start_date), np.datetime64(end_date) + 1)
+    days_since_epoch = dates.astype(np.int64)
+
+    years = dates.astype('datetime64[Y]').astype(np.int64) + 1970
+    months = dates.astype('datetime64[M]').astype(np.int64) % 12 + 1
+    days = (dates - dates.astype('datetime64[M]')).astype(np.int64) + 1
+    day_number_of_year = (dates - dates.astype('datetime64[Y]')).astype(np.int64) + 1
+
+    # 1970-01-01 was a Thursday, Monday is 0 same as datetime.weekday
+    weekdays = (days_since_epoch + 3) % 7
+
+    # Farvardin first of every persian year in the range in days since epoch
+    first_persian_year = jdatetime.date.fromgregorian(date=start_date).year
+    last_persian_year = jdatetime.date.fromgregorian(date=end_date).year
+    persian_new_years = np.array([(jdatetime.date(year, 1, 1).togregorian() - datetime.date(1970, 1, 1)).days
+                                  for year in range(first_persian_year, last_persian_year + 1)])
+
+    persian_year_index = np.searchsorted(persian_new_years, days_since_epoch, side='right') - 1
+    persian_years = persian_year_index + first_persian_year
+    persian_day_number_of_year = days_since_epoch - persian_new_years[persian_year_index] + 1
+
+    # First 6 months have 31 days and the others have 30 days
+    first_half = persian_day_number_of_year <= 186
+    persian_months = np.where(first_half, (persian_day_number_of_year - 1) // 31 + 1,
+                              (persian_day_number_of_year - 187) // 30 + 7)
+    persian_days = np.where(first_half, (persian_day_number_of_year - 1) % 31 + 1,
+                            (persian_day_number_of_year - 187) % 30 + 1)
+
+    # Saturday is 0 same as jdatetime.date.weekday
+    persian_weekdays = (weekdays + 2) % 7
+    persian_new_year_weekdays = (persian_new_years[persian_year_index] + 5) % 7
+
+    day_names = np.array(calendar.day_name, dtype=object)
+    persian_day_names = np.array([persian_weekday_names[name] for name in calendar.day_name], dtype=object)
+
+    return {
+        "time_key": dates,
+        "full_date_alternate_day": np.array([f'{month}/{day}/{year}' for month, day, year in
+                                             zip(months.tolist(), days.tolist(), years.tolist())], dtype=object),
+        "persian_full_date_alternate_day": np.array(
+            [f'{year}/{month}/{day}' for year, month, day in
+             zip(persian_years.tolist(), persian_months.tolist(), persian_days.tolist())], dtype=object),
+        "day_number_of_week": weekdays,
+        "persian_number_of_week": persian_weekdays,
+        "day_name_of_week": day_names[weekdays],
+        "persian_day_name_of_week": persian_day_names[weekdays],
+        "day_number_of_month": days,
+        "persian_day_number_of_month": persian_days,
+        "day_number_of_year": day_number_of_year,
+        "persian_day_number_of_year": persian_day_number_of_year,
+        "week_number_of_year": get_iso_week_numbers(years, day_number_of_year, weekdays),
+        "persian_week_number_of_year": (persian_day_number_of_year + persian_new_year_weekdays - 1) // 7 + 1,
+        "month_name": np.array(calendar.month_name, dtype=object)[months],
+        "persian_month_name": np.array(jdatetime.date.j_months_en, dtype=object)[persian_months - 1],
+        "month_number_of_year": months,
+        "persian_month_number_of_year": persian_months,
+        "calendar_quarter": get_quarter(months),
+        "persian_calendar_quarter": get_quarter(persian_months),
+        "calendar_year": years,
+        "persian_calendar_year": persian_years,
+    }
+
+
+# Same as date.isocalendar()[1], weekdays start from Monday as 0
+def get_iso_week_numbers(years, day_number_of_year, weekdays):
+    def weeks_in_year(year):
+        def p(y):
+            return (y + y // 4 - y // 100 + y // 400) % 7
+
+        return np.where((p(year) == 4) | (p(year - 1) == 3), 53, 52)
+
+    weeks = (day_number_of_year - (weekdays + 1) + 10) // 7
+
+    # Days of week 0 belong to the last week of the previous year and the days after the last week to week 1
+    weeks = np.where(weeks > weeks_in_year(years), 1, weeks)
+    return np.where(weeks < 1, weeks_in_year(years - 1), weeks)
+
+
+def slice_columns(columns: dict, mask):
+    return {name: column[mask] for name, column in columns.items()}
+
+
+TIME_CACHE_FILE = ".time_dimension.pickle"
+
+
+# Same as catalog.get_cache_key, the cache is built again when this file changes, so the days of an older
+# build_time_dimension are never reused
+def get_code_hash():
+    with open(__file__, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+# Dim_Time only grows, so the built days are kept in a local cache and only the years that are
+# not in the cache are built
+def get_time_dimension(start_year: int, end_year: int):
+    columns = None
+    code_hash = get_code_hash()
+
+    if os.path.exists(TIME_CACHE_FILE):
+        with open(TIME_CACHE_FILE, 'rb') as file:
+            cached = pickle.load(file)
+
+        # The caches before the hash only have the columns
+        if isinstance(cached, tuple) and cached[0] == code_hash:
+            columns = cached[1]
 
-        for i, time in enumerate(time_dimension):
-            time_key = time["time_key"]
-            value_ranges += f"'{time_key}'"
+    if columns is None:
+        columns = build_time_dimension(datetime.date(start_year, 1, 1), datetime.date(end_year, 12, 31))
+    else:
+        cached_start = columns["time_key"][0].astype(datetime.date)
+        cached_end = columns["time_key"][-1].astype(datetime.date)
 
-            if i != len(time_dimension) - 1:
-                value_ranges += ", "
+        parts = []
 
-        sql_str = f"use data_warehouse; create partition function DayPartition (date) as range left for values ({value_ranges})"
+        if start_year < cached_start.year:
+            parts.append(build_time_dimension(datetime.date(start_year, 1, 1),
+                                              cached_start - datetime.timedelta(days=1)))
 
-        print(sql_str)
-        cursor.execute(sql_str)
-        cursor.commit()
+        parts.append(columns)
+
+        if end_year > cached_end.year:
+            parts.append(build_time_dimension(cached_end + datetime.timedelta(days=1),
+                                              datetime.date(end_year, 12, 31)))
+
+        if len(parts) == 1:
+            return slice_columns(columns, (columns["calendar_year"] >= start_year) & (
+                    columns["calendar_year"] <= end_year))
+
+        columns = {name: np.concatenate([part[name] for part in parts]) for name in columns}
+
+    with open(TIME_CACHE_FILE, 'wb') as file:
+        pickle.dump((code_hash, columns), file)
+
+    return slice_columns(columns, (columns["calendar_year"] >= start_year) & (columns["calendar_year"] <= end_year))
+
+
+# Builds the time dimension a few years at a time, so the pipeline can insert a part while the next is built
+def generate_time_parts(start_year: int, end_year: int, years_per_part=1):
+    for year in range(start_year, end_year + 1, years_per_part):
+        last_year = min(year + years_per_part - 1, end_year)
+
+        yield "Dim_Time", build_time_dimension(datetime.date(year, 1, 1), datetime.date(last_year, 12, 31))
+
+
+# Adds the days after the last day of Dim_Time until the end of end_year,
+# an empty Dim_Time is filled from start_year
+def extend_time_dimension(start_year: int, end_year: int, batch_size=10000):
+    cursor = connect_to_sql_server()
+
+    cursor.execute("select max(time_key) from data_warehouse.Warehouse.Dim_Time")
+    last_day = cursor.fetchone()[0]
+
+    if last_day is not None:
+        start_year = min(last_day.year, end_year)
+
+    columns = get_time_dimension(start_year, end_year)
+
+    if last_day is not None:
+        columns = slice_columns(columns, columns["time_key"] > np.datetime64(last_day))
+
+    count = insert_batches(cursor, "Dim_Time", columns, "data_warehouse", "Warehouse", batch_size)
+    cursor.close()
+
+    print(f"{count} days added to Dim_Time")
+
+    return columns
+
+
+# DayPartition only gets the boundaries of the partition window around window_day instead of a boundary
+# for every day of the time dimension, partition_manager.slide_window adds the next days later.
+# window_day should be the last day of the loaded facts, so the older days are in the first partition
+# and the days that are switched in later go to the empty partitions of the window
+def callback(window_day: datetime.date):
+    def closure(cursor):
+        create_partition_function(cursor, get_window_boundaries(window_day))
 
     return closure
 
 
 if __name__ == '__main__':
-    t = time_generator(2020, 2050)
-    print(len(t))
-    produce_sql_and_insert_into([("Dim_Time", t)], "data_warehouse", "Warehouse", callback(t))
+    # Same as data_generator.py, records the metrics of the run and writes them to metrics.json
+    instrumented = False
+
+    if instrumented:
+        enable_metrics(trace_memory=True)
+
+    # Extending only adds the days after the last day of Dim_Time, keep it False for the first load
+    # because the DayPartition function is created by the first load
+    extend = False
+
+    # Pipelined builds each year while the previous year is inserted, look at pipeline.py
+    pipelined = False
+
+    # Day of the DayPartition window, data_generator.py generates the visits of 2021 to 2023,
+    # set it to the last day of your facts when they are different
+    window_day = datetime.date(2023, 12, 31)
+
+    if extend:
+        with stage("extend_time_dimension") as current:
+            current.rows = len(extend_time_dimension(2020, 2050)["time_key"])
+    elif pipelined:
+        with stage("load"):
+            run_pipeline(generate_time_parts(2020, 2050), "data_warehouse", "Warehouse", callback(window_day))
+    else:
+        with stage("build_time_dimension") as current:
+            t = get_time_dimension(2020, 2050)
+            current.rows = len(t["time_key"])
+
+        print(len(t["time_key"]))
+
+        # Same as data_generator.py, other outputs write files for bulk insert instead of the odbc insert,
+        # the DayPartition function is only created by the odbc output
+        output = "odbc"
+
+        with stage("load"):
+            if output == "odbc":
+                bulk_insert_into([("Dim_Time", t)], "data_warehouse", "Warehouse", callback(window_day))
+            else:
+                export_tables([("Dim_Time", t)], "output", output, database="data_warehouse", schema="Warehouse")
+
+    write_report("metrics.json")